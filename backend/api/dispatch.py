@@ -0,0 +1,31 @@
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+from backend.core import executor, jobs
+from backend.models.dto import ErrorDetail
+
+RETRY_AFTER_SECONDS = 1
+
+
+async def run_in_pool(endpoint: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run ``fn`` in the worker pool, mapping saturation to 503 with Retry-After."""
+    try:
+        return await executor.run(endpoint, fn, *args, **kwargs)
+    except executor.PoolSaturatedError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=ErrorDetail(code="SERVER_BUSY", message=str(exc)).dict(),
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+
+
+async def run_coalesced(
+    kind: str, key: str, endpoint: str, fn: Callable[..., Any], *args: Any
+) -> Any:
+    """
+    Like `run_in_pool`, but requests with the same `key` that are in flight or
+    finished within JOB_RESULT_TTL_S share one computation (core/jobs.py).
+    """
+    job, _ = jobs.submit(kind, key, lambda: run_in_pool(endpoint, fn, *args), queued=False)
+    return await job.wait()
@@ -1,7 +1,24 @@
-from fastapi import APIRouter, HTTPException, status
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from backend.core import gradient_ops, image_store, synthetic_detector
-from backend.models.dto import AnalysisRequest, AnalysisResponse, ErrorDetail, ErrorResponse
+import numpy as np
+from fastapi import APIRouter, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+
+from backend.api.dispatch import run_coalesced, run_in_pool
+from backend.api.routes_jobs import submit_job
+from backend.api.routes_visuals import visual_url
+from backend.core import executor, gradient_cache, image_store, jobs, synthetic_detector, tiled
+from backend.models import config
+from backend.models.dto import (
+    AnalysisBatchRequest,
+    AnalysisBatchResult,
+    AnalysisRequest,
+    AnalysisResponse,
+    ErrorDetail,
+    ErrorResponse,
+    JobResponse,
+)
 
 router = APIRouter(prefix="/api/analyze", tags=["analysis"])
 
@@ -9,25 +26,194 @@ router = APIRouter(prefix="/api/analyze", tags=["analysis"])
 @router.post(
     "",
     response_model=AnalysisResponse,
-    responses={404: {"model": ErrorResponse}, 500: {"model": ErrorResponse}},
+    responses={
+        400: {"model": ErrorResponse},
+        404: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+        503: {"model": ErrorResponse},
+    },
 )
 async def analyze(req: AnalysisRequest):
+    return await run_coalesced("analyze", _job_key(req), "analysis", _analyze, req)
+
+
+@router.post(
+    "/jobs",
+    response_model=JobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={503: {"model": ErrorResponse}},
+)
+async def submit_analyze_job(req: AnalysisRequest, response: Response):
+    """Queue the analysis; poll /api/jobs/{jobId} or subscribe to its events."""
+    return submit_job(response, "analyze", _job_key(req), "analysis", _analyze, req)
+
+
+def _job_key(req: AnalysisRequest) -> str:
+    return jobs.request_key("analyze", req.dict())
+
+
+def _analyze(req: AnalysisRequest) -> AnalysisResponse:
+    heatmap_level = req.level
     try:
-        image = image_store.load_image(req.imageId)
+        variant = image_store.resolve_variant(req.imageId, req.level)
+        if image_store.is_oversized(variant):
+            scores = tiled.analyze(variant)
+            # A full-resolution heatmap is not renderable; show the largest level.
+            heatmap_level = max(config.PYRAMID_LEVELS)
+        else:
+            dx, dy = gradient_cache.get_sobel_gradients(variant)
+            # The heatmap is rendered only when its visual URL is fetched.
+            scores, _ = synthetic_detector.analyze_gradients(dx, dy, heatmap=False)
     except FileNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=ErrorDetail(code="IMAGE_NOT_FOUND", message=f"No image {req.imageId}").dict(),
         )
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(code="INVALID_REQUEST", message=str(exc)).dict(),
+        )
     except Exception as exc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=ErrorDetail(code="INTERNAL_SERVER_ERROR", message=str(exc)).dict(),
         )
 
-    dx, dy = gradient_ops.compute_gradients(image)
-    scores, heatmap = synthetic_detector.analyze_gradients(dx, dy)
-    heatmap_url = synthetic_detector.save_heatmap(req.imageId, heatmap)
+    # The heatmap itself is rendered and encoded on first fetch by /api/visuals.
+    heatmap_url = visual_url(req.imageId, "heatmap", heatmap_level, None)
 
     return AnalysisResponse(imageId=req.imageId, scores=scores, heatmapUrl=heatmap_url)
 
+
+@router.post(
+    "/batch",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/x-ndjson": {}}},
+        400: {"model": ErrorResponse},
+        503: {"model": ErrorResponse},
+    },
+)
+async def analyze_batch(req: AnalysisBatchRequest):
+    """
+    Score many images in one request. Same-sized images are stacked and scored
+    together; results stream back as NDJSON (one AnalysisBatchResult per line)
+    as each group finishes, so line order is not request order. Per-image
+    failures are reported in the line's `error` instead of failing the stream.
+    """
+    if not req.imageIds or len(req.imageIds) > config.MAX_ANALYSIS_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(
+                code="INVALID_REQUEST",
+                message=f"imageIds must hold 1 to {config.MAX_ANALYSIS_BATCH} ids.",
+            ).dict(),
+        )
+    if req.level is not None and req.level not in config.PYRAMID_LEVELS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(
+                code="INVALID_REQUEST",
+                message=f"Unknown level {req.level}, expected one of {list(config.PYRAMID_LEVELS)}.",
+            ).dict(),
+        )
+    groups, failed = await run_in_pool("analysis", _plan_batch, req.imageIds, req.level)
+    return StreamingResponse(_stream_batch(req, groups, failed), media_type="application/x-ndjson")
+
+
+Group = List[Tuple[str, str]]  # (imageId, variant) pairs of one image size
+# Peak memory of a stacked group per pixel of its images: the per-image Sobel
+# fields (8 bytes), their stacked copies (8) and the analysis itself (16:
+# magnitude, its padded copy and the Laplacian) measure 32 bytes under
+# tracemalloc; the rest is headroom. Checked by tests/test_analysis_memory.py.
+STACK_BYTES_PER_PIXEL = 36
+
+
+def _plan_batch(image_ids: List[str], level: Optional[int]) -> Tuple[List[Group], List[AnalysisBatchResult]]:
+    """Resolve variants and split them into same-sized groups within ANALYSIS_STACK_MB."""
+    by_size: Dict[Tuple[int, int], Group] = defaultdict(list)
+    failed = []
+    for image_id in dict.fromkeys(image_ids):
+        try:
+            variant = image_store.resolve_variant(image_id, level)
+            width, height = image_store.get_image_size(variant)
+        except FileNotFoundError:
+            failed.append(_error_result(image_id, "IMAGE_NOT_FOUND", f"No image {image_id}"))
+            continue
+        except Exception as exc:
+            failed.append(_error_result(image_id, "ANALYSIS_FAILED", str(exc)))
+            continue
+        by_size[(height, width)].append((image_id, variant))
+
+    groups = []
+    for (height, width), members in by_size.items():
+        per_image = STACK_BYTES_PER_PIXEL * height * width
+        size = max(1, (config.ANALYSIS_STACK_MB * 1024 * 1024) // per_image)
+        groups.extend(members[i : i + size] for i in range(0, len(members), size))
+    return groups, failed
+
+
+def _analyze_group(group: Group, level: Optional[int], heatmaps: bool) -> List[AnalysisBatchResult]:
+    results = []
+    fields = []
+    for image_id, variant in group:
+        try:
+            if image_store.is_oversized(variant):
+                # Planned as a group of one: too large to stack, scored tile by tile.
+                url = visual_url(image_id, "heatmap", max(config.PYRAMID_LEVELS), None)
+                results.append(
+                    AnalysisBatchResult(
+                        imageId=image_id,
+                        scores=tiled.analyze(variant),
+                        heatmapUrl=url if heatmaps else None,
+                    )
+                )
+                continue
+            fields.append((image_id, gradient_cache.get_sobel_gradients(variant, store=False)))
+        except Exception as exc:
+            results.append(_error_result(image_id, "ANALYSIS_FAILED", str(exc)))
+    if not fields:
+        return results
+
+    scores = score_stack([gradients for _, gradients in fields])
+    for (image_id, _), image_scores in zip(fields, scores):
+        results.append(
+            AnalysisBatchResult(
+                imageId=image_id,
+                scores=image_scores,
+                heatmapUrl=visual_url(image_id, "heatmap", level, None) if heatmaps else None,
+            )
+        )
+    return results
+
+
+def score_stack(fields: List[Tuple[np.ndarray, np.ndarray]]) -> List[Dict[str, float]]:
+    """Scores of same-sized (dx, dy) fields, stacked and analyzed at once."""
+    dx = np.stack([field[0] for field in fields])
+    dy = np.stack([field[1] for field in fields])
+    # Heatmaps are rendered lazily by /api/visuals; the batch only needs scores.
+    scores, _ = synthetic_detector.analyze_gradient_stack(dx, dy, heatmaps=False)
+    return scores
+
+
+def _error_result(image_id: str, code: str, message: str) -> AnalysisBatchResult:
+    return AnalysisBatchResult(imageId=image_id, error=ErrorDetail(code=code, message=message))
+
+
+def _ndjson(results: List[AnalysisBatchResult]) -> bytes:
+    return b"".join(r.json(exclude_none=True).encode() + b"\n" for r in results)
+
+
+async def _stream_batch(
+    req: AnalysisBatchRequest, groups: List[Group], failed: List[AnalysisBatchResult]
+) -> AsyncIterator[bytes]:
+    if failed:
+        yield _ndjson(failed)
+    for group in groups:
+        try:
+            results = await executor.run("analysis", _analyze_group, group, req.level, req.heatmaps)
+        except executor.PoolSaturatedError as exc:
+            # Headers are already sent; report the group instead of aborting the stream.
+            results = [_error_result(image_id, "SERVER_BUSY", str(exc)) for image_id, _ in group]
+        yield _ndjson(results)
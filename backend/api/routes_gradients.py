@@ -1,6 +1,10 @@
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException, Query, status
 
-from backend.core import gradient_ops, image_store
+from backend.api.dispatch import run_in_pool
+from backend.api.routes_visuals import visual_url
+from backend.core import image_store, visual_cache
 from backend.models import config
 from backend.models.dto import ErrorDetail, ErrorResponse, GradientsResponse
 
@@ -10,40 +14,65 @@ router = APIRouter(prefix="/api/gradients", tags=["gradients"])
 @router.get(
     "",
     response_model=GradientsResponse,
-    responses={404: {"model": ErrorResponse}, 500: {"model": ErrorResponse}},
+    responses={
+        400: {"model": ErrorResponse},
+        404: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+        503: {"model": ErrorResponse},
+    },
 )
-async def get_gradients(imageId: str = Query(..., alias="imageId")):
+async def get_gradients(
+    imageId: str = Query(..., alias="imageId"),
+    level: Optional[int] = Query(None, description="Pyramid level (long side in px)"),
+    format: Optional[str] = Query(None, description="Visual encoder: png, webp or jpeg"),
+):
+    return await run_in_pool("gradients", _compute_gradients, imageId, level, format)
+
+
+def _compute_gradients(
+    imageId: str, level: Optional[int] = None, fmt: Optional[str] = None
+) -> GradientsResponse:
+    """
+    Visuals are rendered lazily by /api/visuals, so this only needs the size of
+    the requested variant.
+    """
+    if fmt is not None and fmt not in visual_cache.VISUAL_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(
+                code="INVALID_REQUEST", message=f"Unknown visual format {fmt!r}"
+            ).dict(),
+        )
     try:
-        image = image_store.load_image(imageId)
+        variant = image_store.resolve_variant(imageId, level)
+        if image_store.is_oversized(variant):
+            # Full-resolution visuals are not renderable (/api/visuals tiles them);
+            # answer with the largest level, as /api/analyze does for its heatmap.
+            level = max(config.PYRAMID_LEVELS)
+            variant = image_store.resolve_variant(imageId, level)
+        width, height = image_store.get_image_size(variant)
     except FileNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=ErrorDetail(code="IMAGE_NOT_FOUND", message=f"No image {imageId}").dict(),
         )
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(code="INVALID_REQUEST", message=str(exc)).dict(),
+        )
     except Exception as exc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=ErrorDetail(code="INTERNAL_SERVER_ERROR", message=str(exc)).dict(),
         )
 
-    dx, dy = gradient_ops.compute_gradients(image)
-
-    dx_url = gradient_ops.save_gradient_visual(
-        dx, dy, "dx", config.GRADIENT_DIR / f"{imageId}_dx.png"
-    )
-    dy_url = gradient_ops.save_gradient_visual(
-        dx, dy, "dy", config.GRADIENT_DIR / f"{imageId}_dy.png"
-    )
-    mag_url = gradient_ops.save_gradient_visual(
-        dx, dy, "mag", config.GRADIENT_DIR / f"{imageId}_mag.png"
-    )
-
     return GradientsResponse(
         imageId=imageId,
-        width=image.shape[1],
-        height=image.shape[0],
-        dxUrl=dx_url,
-        dyUrl=dy_url,
-        magnitudeUrl=mag_url,
+        level=None if variant == imageId else level,
+        width=width,
+        height=height,
+        dxUrl=visual_url(imageId, "dx", level, fmt),
+        dyUrl=visual_url(imageId, "dy", level, fmt),
+        magnitudeUrl=visual_url(imageId, "mag", level, fmt),
     )
-
@@ -1,21 +1,86 @@
-from fastapi import APIRouter, File, HTTPException, UploadFile, status
+from typing import AsyncGenerator, Awaitable, Callable
 
+from fastapi import APIRouter, File, HTTPException, Request, Response, UploadFile, status
+from fastapi.routing import APIRoute
+
+from backend.api.dispatch import run_in_pool
 from backend.core import image_store
+from backend.models import config
 from backend.models.dto import UploadImageResponse, ErrorResponse, ErrorDetail
 
-router = APIRouter(prefix="/api/images", tags=["images"])
+# Multipart boundary and part headers sent on top of the file itself.
+_MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def _max_body_bytes() -> int:
+    return config.MAX_IMAGE_SIZE_MB * 1024 * 1024 + _MULTIPART_OVERHEAD_BYTES
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=ErrorDetail(
+            code="INVALID_REQUEST", message=f"File exceeds max size of {config.MAX_IMAGE_SIZE_MB} MB."
+        ).dict(),
+    )
+
+
+class _SizeLimitedRequest(Request):
+    """Request whose body stream fails as soon as it exceeds the upload limit."""
+
+    async def stream(self) -> AsyncGenerator[bytes, None]:
+        received = 0
+        async for chunk in super().stream():
+            received += len(chunk)
+            if received > _max_body_bytes():
+                raise _too_large()
+            yield chunk
+
+
+class _UploadRoute(APIRoute):
+    """
+    Enforces MAX_IMAGE_SIZE_MB before the multipart body is parsed and spooled
+    to disk: on Content-Length when the client sends one, and on the bytes
+    received otherwise (chunked uploads).
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Awaitable[Response]]:
+        handler = super().get_route_handler()
+
+        async def limited_handler(request: Request) -> Response:
+            length = request.headers.get("content-length", "")
+            if length.isdigit() and int(length) > _max_body_bytes():
+                raise _too_large()
+            return await handler(_SizeLimitedRequest(request.scope, request.receive))
+
+        return limited_handler
+
+
+router = APIRouter(prefix="/api/images", tags=["images"], route_class=_UploadRoute)
 
 
 @router.post(
     "",
     response_model=UploadImageResponse,
-    responses={400: {"model": ErrorResponse}},
+    responses={
+        400: {"model": ErrorResponse},
+        413: {"model": ErrorResponse},
+        503: {"model": ErrorResponse},
+    },
 )
 async def upload_image(file: UploadFile = File(...)):
     try:
-        content = await file.read()
-        image_id, width, height = image_store.save_image(content)
-        return UploadImageResponse(imageId=image_id, width=width, height=height)
+        # The multipart body, already capped by _UploadRoute, has been spooled to a
+        # temporary file (in memory only up to 1 MB); hand that file over instead
+        # of reading it into memory. save_image checks the exact file size again.
+        image_id, width, height, levels, existing = await run_in_pool(
+            "images", image_store.save_image, file.file
+        )
+        return UploadImageResponse(
+            imageId=image_id, width=width, height=height, levels=levels, existing=existing
+        )
+    except HTTPException:
+        raise
     except ValueError as exc:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
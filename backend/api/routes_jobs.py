@@ -0,0 +1,98 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Callable
+
+from fastapi import APIRouter, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+
+from backend.api.dispatch import run_in_pool
+from backend.core import jobs
+from backend.models import config
+from backend.models.dto import ErrorDetail, ErrorResponse, JobResponse
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+
+def job_response(job: jobs.Job, coalesced: bool = False) -> JobResponse:
+    error = None
+    if isinstance(job.error, HTTPException) and isinstance(job.error.detail, dict):
+        error = ErrorDetail(**job.error.detail)
+    elif job.error is not None:
+        error = ErrorDetail(code="INTERNAL_SERVER_ERROR", message=str(job.error))
+    return JobResponse(
+        jobId=job.id,
+        kind=job.kind,
+        status=job.status,
+        coalesced=coalesced,
+        result=job.result.dict() if job.status == jobs.JOB_DONE else None,
+        error=error,
+    )
+
+
+def submit_job(
+    response: Response, kind: str, key: str, endpoint: str, fn: Callable[..., Any], *args: Any
+) -> JobResponse:
+    """Queue `fn(*args)` as a job (or join an identical one) and answer 202 with its id."""
+    try:
+        job, coalesced = jobs.submit(kind, key, lambda: run_in_pool(endpoint, fn, *args))
+    except jobs.JobQueueFullError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=ErrorDetail(code="SERVER_BUSY", message=str(exc)).dict(),
+            headers={"Retry-After": "1"},
+        )
+    response.status_code = status.HTTP_202_ACCEPTED
+    response.headers["Location"] = f"{router.prefix}/{job.id}"
+    return job_response(job, coalesced)
+
+
+def _get_job(job_id: str) -> jobs.Job:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=ErrorDetail(
+                code="INVALID_REQUEST", message=f"No job {job_id} (unknown or expired)"
+            ).dict(),
+        )
+    return job
+
+
+@router.get("/{jobId}", response_model=JobResponse, responses={404: {"model": ErrorResponse}})
+async def get_job(jobId: str):
+    return job_response(_get_job(jobId))
+
+
+@router.get(
+    "/{jobId}/events",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}, 404: {"model": ErrorResponse}},
+)
+async def job_events(jobId: str):
+    """
+    Server-Sent Events: one event per status change, named after the status,
+    whose data is the JobResponse. The stream ends after "done" or "failed".
+    """
+    job = _get_job(jobId)
+    return StreamingResponse(
+        _events(job), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+async def _events(job: jobs.Job) -> AsyncIterator[bytes]:
+    queue = job.subscribe()
+    try:
+        while True:
+            try:
+                state = await asyncio.wait_for(queue.get(), timeout=config.JOB_EVENTS_KEEPALIVE_S)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if state != job.status:
+                continue  # superseded; the newer state is already queued
+            data = json.dumps(job_response(job).dict())
+            yield f"event: {state}\ndata: {data}\n\n".encode()
+            if state in jobs.TERMINAL_STATES:
+                break
+    finally:
+        job.unsubscribe(queue)
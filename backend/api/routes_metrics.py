@@ -0,0 +1,94 @@
+import time
+from typing import Awaitable, Callable, Dict, Tuple
+
+from fastapi import APIRouter, Request, Response
+
+from backend.core import (
+    artifact_store,
+    executor,
+    gradient_cache,
+    jobs,
+    metrics,
+    shared_cache,
+    visual_cache,
+)
+from backend.models import config
+
+router = APIRouter(tags=["metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Stats fields that only ever increase: exported as `<metric>_events_total` counters.
+_COUNTER_FIELDS = {"hits", "misses", "evictions", "rejected", "coalesced", "evicted", "evictedBytes"}
+# metric name -> (help, {label value: number}, label name)
+Families = Dict[str, Tuple[str, Dict[str, float], str]]
+
+
+async def timing_middleware(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    """Time every request by route template and attach its stages as Server-Timing."""
+    start = time.perf_counter()
+    with metrics.collect() as spans:
+        response = await call_next(request)
+    total = time.perf_counter() - start
+    route = request.scope.get("route")
+    template = getattr(route, "path", "unmatched")
+    metrics.http_seconds.observe((template, request.method, str(response.status_code)), total)
+    if config.SERVER_TIMING:
+        # Streaming bodies are timed up to their first byte only.
+        response.headers["Server-Timing"] = metrics.server_timing(spans, total)
+    return response
+
+
+def _gauges() -> Families:
+    pool = executor.pool.stats()
+    return {
+        "gv_gradient_cache": (
+            "Per-worker gradient cache (core/gradient_cache.py).",
+            gradient_cache.stats(),
+            "field",
+        ),
+        "gv_shared_cache": (
+            "Cross-worker shared-memory cache (core/shared_cache.py), if enabled.",
+            shared_cache.stats(),
+            "field",
+        ),
+        "gv_visual_cache": (
+            "Encoded visual cache (core/visual_cache.py).",
+            visual_cache.stats(),
+            "field",
+        ),
+        "gv_worker_pool": (
+            "Worker pool admission (core/executor.py).",
+            {k: pool[k] for k in ("inFlight", "capacity", "rejected")},
+            "field",
+        ),
+        "gv_worker_pool_endpoint_in_flight": (
+            "Tasks running or queued per endpoint.",
+            pool["perEndpoint"],
+            "endpoint",
+        ),
+        "gv_jobs": ("Jobs by status, and coalesced submissions.", jobs.stats(), "field"),
+        "gv_artifacts": ("Stored images and bytes on disk.", artifact_store.stats(), "field"),
+    }
+
+
+def _split_counters(stats: Families) -> Tuple[Families, Families]:
+    """(gauges, counters): the `_COUNTER_FIELDS` of each stats dict become a counter."""
+    gauges: Families = {}
+    counters: Families = {}
+    for metric, (help_text, values, label) in stats.items():
+        current = {k: v for k, v in values.items() if label != "field" or k not in _COUNTER_FIELDS}
+        totals = {k: v for k, v in values.items() if label == "field" and k in _COUNTER_FIELDS}
+        if current:
+            gauges[metric] = (help_text, current, label)
+        if totals:
+            counters[f"{metric}_events_total"] = (help_text, totals, label)
+    return gauges, counters
+
+
+@router.get("/metrics", response_class=Response)
+def get_metrics():
+    """Prometheus text exposition of stage / request latencies, bytes, gauges and counters."""
+    gauges, counters = _split_counters(_gauges())
+    return Response(content=metrics.exposition(gauges, counters), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,39 +1,200 @@
+from typing import Iterator, Optional, Tuple
+
 import numpy as np
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, File, Form, HTTPException, Response, UploadFile, status
 import cv2
 
-from backend.core import gradient_ops, image_store, poisson_solver
+from backend.api.dispatch import run_coalesced
+from backend.api.routes_jobs import submit_job
+from backend.core import (
+    gradient_cache,
+    gradient_ops,
+    image_store,
+    jobs,
+    poisson_solver,
+    sparse_edits,
+    tiled,
+)
+from backend.core.poisson_solver import PoissonBackend
 from backend.models import config
 from backend.models.dto import (
     ErrorDetail,
     ErrorResponse,
+    JobResponse,
     ReconstructionRequest,
     ReconstructionResponse,
 )
 
 router = APIRouter(prefix="/api/reconstruct", tags=["reconstruction"])
 
-# Factor to scale user edits down. 
-# 0.1 means a "full white" stroke adds 0.1 to the gradient derivative.
-# This prevents small edits from blowing out the image dynamic range.
-DELTA_SCALE = 0.1
+# "full" solves the whole frame; "local" only a padded window around the edits.
+RECONSTRUCTION_MODES = {"full", "local"}
+# "luma" edits and solves Y only and keeps the original chroma; "rgb" solves each
+# RGB channel from its own gradients, so edits can change colour.
+RECONSTRUCTION_CHANNELS = {"luma", "rgb"}
+FULL_FRAME = (slice(None), slice(None))
+# Rows of the result converted to uint8 RGB at a time while the PNG is written.
+OUTPUT_STRIP_ROWS = 64
 
 @router.post(
     "",
     response_model=ReconstructionResponse,
-    responses={400: {"model": ErrorResponse}, 404: {"model": ErrorResponse}},
+    responses={
+        400: {"model": ErrorResponse},
+        404: {"model": ErrorResponse},
+        503: {"model": ErrorResponse},
+    },
 )
 async def reconstruct(req: ReconstructionRequest):
+    return await run_coalesced("reconstruct", _job_key(req), "reconstruct", _reconstruct, req)
+
+
+@router.post(
+    "/jobs",
+    response_model=JobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={503: {"model": ErrorResponse}},
+)
+async def submit_reconstruct_job(req: ReconstructionRequest, response: Response):
+    """Queue the reconstruction; poll /api/jobs/{jobId} or subscribe to its events."""
+    return submit_job(response, "reconstruct", _job_key(req), "reconstruct", _reconstruct, req)
+
+
+def _job_key(req: ReconstructionRequest) -> str:
+    return jobs.request_key("reconstruct", req.dict())
+
+
+@router.post(
+    "/sparse",
+    response_model=ReconstructionResponse,
+    responses={
+        400: {"model": ErrorResponse},
+        404: {"model": ErrorResponse},
+        413: {"model": ErrorResponse},
+        503: {"model": ErrorResponse},
+    },
+)
+async def reconstruct_sparse(
+    imageId: str = Form(...),
+    mode: Optional[str] = Form("full"),
+    solver: Optional[str] = Form(None),
+    level: Optional[int] = Form(None),
+    editsDx: Optional[UploadFile] = File(None, description="Sparse dx delta (core/sparse_edits.py format)"),
+    editsDy: Optional[UploadFile] = File(None, description="Sparse dy delta (core/sparse_edits.py format)"),
+):
+    """Reconstruct from sparse binary edit deltas sent as multipart parts."""
+    payloads = []
+    for part in (editsDx, editsDy):
+        payload = await part.read() if part is not None else None
+        if payload is not None and len(payload) > config.MAX_SPARSE_EDIT_MB * 1024 * 1024:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=ErrorDetail(
+                    code="INVALID_REQUEST",
+                    message=f"Edit payload exceeds {config.MAX_SPARSE_EDIT_MB} MB.",
+                ).dict(),
+            )
+        payloads.append(payload)
+    key = jobs.request_key(
+        "reconstruct-sparse", [imageId, mode, solver, level], *(p or b"" for p in payloads)
+    )
+    return await run_coalesced(
+        "reconstruct", key, "reconstruct", _reconstruct_sparse, key, imageId, mode, solver, level, *payloads
+    )
+
+
+def _in_window(arr: np.ndarray, window: Tuple[slice, slice]) -> np.ndarray:
+    """`arr[window]` over the last two axes, for (h, w) fields and (C, h, w) stacks."""
+    return arr[(Ellipsis,) + window]
+
+
+def _apply_delta(
+    orig: np.ndarray, delta: np.ndarray | None, window: Tuple[slice, slice]
+) -> np.ndarray:
+    """
+    Original gradient plus scaled edit delta, restricted to `window`. The sum is
+    accumulated into the decoded `delta`; without one the (read-only) original
+    is returned as is, since the solver only reads it.
+    """
+    region = _in_window(orig, window)
+    if delta is None:
+        return region
+    edited = _in_window(delta, window)
+    edited *= config.EDIT_DELTA_SCALE
+    edited += region
+    return edited
+
+
+def _resolve_options(
+    mode: str | None, solver_name: str | None, channels: str | None = None
+) -> Tuple[str, PoissonBackend]:
+    mode = mode or "full"
+    if mode not in RECONSTRUCTION_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(
+                code="INVALID_REQUEST",
+                message=f"Unknown mode {mode!r}, expected one of {sorted(RECONSTRUCTION_MODES)}",
+            ).dict(),
+        )
+    if channels is not None and channels not in RECONSTRUCTION_CHANNELS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(
+                code="INVALID_REQUEST",
+                message=f"Unknown channels {channels!r}, expected one of {sorted(RECONSTRUCTION_CHANNELS)}",
+            ).dict(),
+        )
+    try:
+        solver = poisson_solver.get_solver(solver_name)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(code="INVALID_REQUEST", message=str(exc)).dict(),
+        )
+    return mode, solver
+
+
+def _resolve_oversized(image_id: str, level: int | None) -> Tuple[str, bool]:
+    """Return (variant id, whether it is too large for full-frame processing)."""
+    try:
+        variant = image_store.resolve_variant(image_id, level)
+        return variant, image_store.is_oversized(variant)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=ErrorDetail(code="IMAGE_NOT_FOUND", message=f"No image {image_id}").dict(),
+        )
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(code="INVALID_REQUEST", message=str(exc)).dict(),
+        )
+
+
+def _load_source(image_id: str, level: int | None, channels: str = "luma") -> Tuple[str, np.ndarray]:
+    """
+    Return (variant id, source channels) of the requested pyramid level: the
+    (h, w, 3) YCrCb image for "luma", the (3, h, w) RGB planes for "rgb".
+    """
     try:
-        # Load image as RGB (0..1)
-        original = image_store.load_image(req.imageId)
+        variant = image_store.resolve_variant(image_id, level)
+        if channels == "rgb":
+            return variant, gradient_cache.get_rgb_planes(variant)
+        # Load image as RGB (0..1) and convert to YCrCb
+        return variant, gradient_cache.get_ycrcb(variant)
     except FileNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=ErrorDetail(
-                code="IMAGE_NOT_FOUND", message=f"No image {req.imageId}"
+                code="IMAGE_NOT_FOUND", message=f"No image {image_id}"
             ).dict(),
         )
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(code="INVALID_REQUEST", message=str(exc)).dict(),
+        )
     except Exception as exc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -42,29 +203,34 @@ async def reconstruct(req: ReconstructionRequest):
             ).dict(),
         )
 
-    # 1. Extract YCbCr channels
-    src_ycrcb = cv2.cvtColor(original, cv2.COLOR_RGB2YCrCb)
-    y_channel = src_ycrcb[:, :, 0]
-    cr_channel = src_ycrcb[:, :, 1]
-    cb_channel = src_ycrcb[:, :, 2]
 
-    # 2. Compute gradients for reconstruction using Forward Differences
+def _reconstruct(req: ReconstructionRequest) -> ReconstructionResponse:
+    channels = req.channels or "luma"
+    mode, solver = _resolve_options(req.mode, req.solver, channels)
+    variant, source = _load_source(req.imageId, req.level, channels)
+    size = source.shape[-2:] if channels == "rgb" else source.shape[:2]
+    edit_channels = 3 if channels == "rgb" else 1
+
+    # Compute gradients for reconstruction using Forward Differences
     # This matches the discrete Laplacian used in the solver, ensuring identity when no edits are made.
     # Note: gradient_ops.compute_gradients (Sobel) is used for frontend visual, 
     # but for mathematical reconstruction we need consistent derivatives.
-    orig_dx, orig_dy = gradient_ops.compute_forward_gradients(y_channel)
+    if channels == "rgb":
+        orig_dx, orig_dy = gradient_cache.get_forward_gradients_rgb(variant)
+    else:
+        orig_dx, orig_dy = gradient_cache.get_forward_gradients(variant)
 
     try:
-        # 3. Decode edits as deltas
-        final_dx = orig_dx
-        final_dy = orig_dy
+        # Decode edits as deltas
+        delta_dx = None
+        delta_dy = None
 
         if req.editedDx:
             # Note: The frontend draws on the "Sobel" view. 
             # Adding "Sobel delta" to "Forward gradient" is a slight mismatch visually 
             # but mathematically robust for the solver to apply the "change".
-            delta_dx = gradient_ops.decode_base64_gradient_png(req.editedDx)
-            if delta_dx.shape != original.shape[:2]:
+            delta_dx = gradient_ops.decode_base64_gradient_png(req.editedDx, edit_channels)
+            if delta_dx.shape[-2:] != size:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=ErrorDetail(
@@ -72,11 +238,10 @@ async def reconstruct(req: ReconstructionRequest):
                         message="Edited dx does not match image dimensions",
                     ).dict(),
                 )
-            final_dx = orig_dx + (delta_dx * DELTA_SCALE)
 
         if req.editedDy:
-            delta_dy = gradient_ops.decode_base64_gradient_png(req.editedDy)
-            if delta_dy.shape != original.shape[:2]:
+            delta_dy = gradient_ops.decode_base64_gradient_png(req.editedDy, edit_channels)
+            if delta_dy.shape[-2:] != size:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=ErrorDetail(
@@ -84,7 +249,6 @@ async def reconstruct(req: ReconstructionRequest):
                         message="Edited dy does not match image dimensions",
                     ).dict(),
                 )
-            final_dy = orig_dy + (delta_dy * DELTA_SCALE)
 
     except Exception as exc:
         if isinstance(exc, HTTPException):
@@ -96,27 +260,172 @@ async def reconstruct(req: ReconstructionRequest):
             ).dict(),
         )
 
-    # 4. Reconstruct Y channel
-    reconstructed_y = poisson_solver.reconstruct_image_from_gradients(
-        final_dx.astype(np.float32),
-        final_dy.astype(np.float32),
-        boundary_image=y_channel,
+    # Either the whole frame or only a window around the edits; masked backends
+    # solve only the dilated edit footprint inside that window.
+    window = FULL_FRAME
+    solve_mask = None
+    if mode == "local":
+        edited = gradient_ops.edit_mask((delta_dx, delta_dy), config.LOCAL_RECON_THRESHOLD)
+        if edited is None:
+            window = None
+        else:
+            window = gradient_ops.edit_bounding_box(edited, config.LOCAL_RECON_MARGIN)
+            if solver.supports_mask:
+                solve_mask = gradient_ops.dilate_mask(edited[window], config.LOCAL_RECON_MARGIN)
+
+    dx_region = dy_region = None
+    if window is not None:
+        dx_region = _apply_delta(orig_dx, delta_dx, window)
+        dy_region = _apply_delta(orig_dy, delta_dy, window)
+    return _solve_and_save(
+        _job_key(req), req.imageId, variant, source, solver, window, solve_mask, dx_region, dy_region, channels
+    )
+
+
+def _reconstruct_sparse(
+    key: str,
+    image_id: str,
+    mode: str | None,
+    solver_name: str | None,
+    level: int | None,
+    dx_payload: bytes | None,
+    dy_payload: bytes | None,
+) -> ReconstructionResponse:
+    mode, solver = _resolve_options(mode, solver_name)
+    variant, oversized = _resolve_oversized(image_id, level)
+
+    # Decoded against the image's shape, so no header can make a payload inflate
+    # beyond what this image allows.
+    width, height = image_store.get_image_size(variant)
+    try:
+        deltas = [
+            None if payload is None else sparse_edits.decode_sparse_delta(payload, (height, width))
+            for payload in (dx_payload, dy_payload)
+        ]
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(
+                code="INVALID_REQUEST", message=f"Cannot decode edits: {exc}"
+            ).dict(),
+        )
+
+    if oversized:
+        # No full-frame buffers: overlapping tiles around the edits are solved
+        # from the memory-mapped pixels, which is local by construction.
+        url = tiled.reconstruct(variant, deltas, solver, key)
+        return ReconstructionResponse(imageId=image_id, reconstructedUrl=url)
+
+    variant, src_ycrcb = _load_source(image_id, level)
+    orig_dx, orig_dy = gradient_cache.get_forward_gradients(variant)
+
+    window = FULL_FRAME
+    solve_mask = None
+    if mode == "local":
+        boxes = [
+            d.bounding_box(config.LOCAL_RECON_MARGIN) for d in deltas if d is not None
+        ]
+        boxes = [box for box in boxes if box is not None]
+        if not boxes:
+            window = None
+        else:
+            window = (
+                slice(min(b[0].start for b in boxes), max(b[0].stop for b in boxes)),
+                slice(min(b[1].start for b in boxes), max(b[1].stop for b in boxes)),
+            )
+            if solver.supports_mask:
+                edited = np.zeros(src_ycrcb[window].shape[:2], dtype=bool)
+                for delta in deltas:
+                    if delta is not None:
+                        delta.mask_in(window, edited)
+                solve_mask = gradient_ops.dilate_mask(edited, config.LOCAL_RECON_MARGIN)
+
+    # Scatter the sparse entries straight into the windowed forward gradients.
+    regions = [None, None]
+    if window is not None:
+        for i, (orig, delta) in enumerate(zip((orig_dx, orig_dy), deltas)):
+            regions[i] = orig[window]
+            if delta is not None:
+                regions[i] = delta.add_to(regions[i].copy(), window, config.EDIT_DELTA_SCALE)
+    return _solve_and_save(key, image_id, variant, src_ycrcb, solver, window, solve_mask, *regions)
+
+
+def _solve_and_save(
+    key: str,
+    image_id: str,
+    variant: str,
+    source: np.ndarray,
+    solver: PoissonBackend,
+    window: Tuple[slice, slice] | None,
+    solve_mask: np.ndarray | None,
+    dx_region: np.ndarray | None,
+    dy_region: np.ndarray | None,
+    channels: str = "luma",
+) -> ReconstructionResponse:
+    """
+    Reconstruct inside `window` (None: nothing edited) with the original as
+    Dirichlet boundary and store the result under the request `key`. "luma" solves the Y channel of the
+    YCrCb `source` and merges it with the original CrCb; "rgb" solves all three
+    (3, h, w) planes of `source` in one batched call.
+
+    The solved channels are the only full-frame buffer: the solver works in
+    place on them (plus its pooled right-hand side) and the RGB output is
+    converted and compressed in strips.
+    """
+    base = source if channels == "rgb" else source[:, :, 0]
+    reconstructed = _solve_channels(variant, base, solver, window, solve_mask, dx_region, dy_region)
+    height, width = base.shape[-2:]
+    url = image_store.save_reconstruction_strips(
+        variant, width, height, _rgb_strips(source, reconstructed, channels), key
     )
-    
-    # 5. Merge back with original CbCr
-    merged_ycrcb = np.zeros_like(src_ycrcb)
-    merged_ycrcb[:, :, 0] = reconstructed_y
-    merged_ycrcb[:, :, 1] = cr_channel
-    merged_ycrcb[:, :, 2] = cb_channel
-    
-    # 6. Convert back to RGB
-    recon_rgb = cv2.cvtColor(merged_ycrcb, cv2.COLOR_YCrCb2RGB)
-    recon_rgb = np.clip(recon_rgb, 0.0, 1.0)
-
-    path = config.RECON_DIR / f"{req.imageId}_recon.png"
-    path.parent.mkdir(parents=True, exist_ok=True)
-    from PIL import Image
-
-    Image.fromarray((recon_rgb * 255).astype(np.uint8)).save(path, format="PNG")
-    url = f"/{path.relative_to(config.BASE_DIR).as_posix()}"
-    return ReconstructionResponse(imageId=req.imageId, reconstructedUrl=url)
+    return ReconstructionResponse(imageId=image_id, reconstructedUrl=url)
+
+
+def _solve_channels(
+    variant: str,
+    base: np.ndarray,
+    solver: PoissonBackend,
+    window: Tuple[slice, slice] | None,
+    solve_mask: np.ndarray | None,
+    dx_region: np.ndarray | None,
+    dy_region: np.ndarray | None,
+) -> np.ndarray:
+    """A float32 copy of the `base` channels with `window` re-solved."""
+    previous = None
+    if solver.supports_warm_start:
+        previous = gradient_cache.get_last_reconstruction(variant)
+        if previous is not None and previous.shape != base.shape:
+            previous = None  # last run used the other channel mode
+
+    reconstructed = np.empty(base.shape, dtype=np.float32)
+    np.copyto(reconstructed, base)
+    if window is not None:
+        region = _in_window(reconstructed, window)
+        poisson_solver.reconstruct_image_from_gradients(
+            dx_region,
+            dy_region,
+            boundary_image=region,
+            solver=solver,
+            initial_guess=None if previous is None else _in_window(previous, window),
+            mask=solve_mask,
+            out=region,
+        )
+    if solver.supports_warm_start:
+        gradient_cache.put_last_reconstruction(variant, reconstructed)
+    return reconstructed
+
+
+def _rgb_strips(source: np.ndarray, reconstructed: np.ndarray, channels: str) -> Iterator[np.ndarray]:
+    """uint8 RGB row strips of the solved planes, or of the solved Y merged with the original CrCb."""
+    height = reconstructed.shape[-2]
+    for top in range(0, height, OUTPUT_STRIP_ROWS):
+        bottom = min(top + OUTPUT_STRIP_ROWS, height)
+        if channels == "rgb":
+            rgb = np.ascontiguousarray(np.moveaxis(reconstructed[:, top:bottom], 0, -1))
+        else:
+            ycrcb = source[top:bottom].copy()
+            ycrcb[:, :, 0] = reconstructed[top:bottom]
+            rgb = cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2RGB, dst=ycrcb)
+        np.clip(rgb, 0.0, 1.0, out=rgb)
+        rgb *= 255.0
+        yield rgb.astype(np.uint8)
@@ -0,0 +1,128 @@
+import json
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect, status
+
+from backend.core import executor, image_store, poisson_solver, sparse_edits
+from backend.core.edit_session import EditSession, PreviewTile
+from backend.models import config
+
+router = APIRouter(prefix="/api/session", tags=["session"])
+
+# Binary stroke frames start with one tag byte naming the field, followed by a
+# sparse delta payload (core/sparse_edits.py).
+STROKE_TAGS = {b"x": "dx", b"y": "dy"}
+
+_active_sessions = 0
+
+
+async def _send_error(websocket: WebSocket, code: str, message: str) -> None:
+    await websocket.send_text(json.dumps({"type": "error", "code": code, "message": message}))
+
+
+async def _send_tile(websocket: WebSocket, tile: Optional[PreviewTile], strokes: int) -> None:
+    if tile is None:
+        await websocket.send_text(json.dumps({"type": "noop", "strokes": strokes}))
+        return
+    header = {
+        "type": "tile",
+        "x": tile.x,
+        "y": tile.y,
+        "width": tile.width,
+        "height": tile.height,
+        "format": tile.format,
+        "strokes": strokes,
+    }
+    await websocket.send_text(json.dumps(header))
+    await websocket.send_bytes(tile.data)
+
+
+def _parse_stroke(frame: bytes, shape: Tuple[int, int]):
+    field = STROKE_TAGS.get(frame[:1])
+    if field is None:
+        raise ValueError("Stroke frame must start with b'x' or b'y'.")
+    delta = sparse_edits.decode_sparse_delta(frame[1:], shape)
+    return (delta, None) if field == "dx" else (None, delta)
+
+
+def _parse_command(text: str) -> Optional[str]:
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"Command is not valid JSON: {exc}") from exc
+    if not isinstance(payload, dict):
+        raise ValueError('Command must be a JSON object like {"type": "save"}.')
+    return payload.get("type")
+
+
+@router.websocket("")
+async def edit_session(
+    websocket: WebSocket,
+    imageId: str = Query(...),
+    solver: Optional[str] = Query(None),
+    level: Optional[int] = Query(None),
+):
+    """
+    Interactive editing over one WebSocket.
+
+    Client -> server: binary stroke frames (tag byte + sparse delta) or JSON text
+    commands {"type": "reset" | "save"}. Server -> client: a JSON header
+    {"type": "tile", x, y, width, height, format} followed by a binary frame with
+    the encoded tile, {"type": "saved", "reconstructedUrl"} or {"type": "error"}.
+    """
+    global _active_sessions
+    await websocket.accept()
+    if _active_sessions >= config.MAX_EDIT_SESSIONS:
+        await _send_error(websocket, "SERVER_BUSY", "Too many active editing sessions.")
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    _active_sessions += 1
+    try:
+        try:
+            backend = poisson_solver.get_solver(solver)
+            variant = await executor.run("session", image_store.resolve_variant, imageId, level)
+            session = await executor.run("session", EditSession, variant, backend)
+        except FileNotFoundError:
+            await _send_error(websocket, "IMAGE_NOT_FOUND", f"No image {imageId}")
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        except (ValueError, executor.PoolSaturatedError) as exc:
+            code = "SERVER_BUSY" if isinstance(exc, executor.PoolSaturatedError) else "INVALID_REQUEST"
+            await _send_error(websocket, code, str(exc))
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+        height, width = session.shape
+        await websocket.send_text(
+            json.dumps({"type": "ready", "imageId": imageId, "width": width, "height": height})
+        )
+
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                if message.get("bytes") is not None:
+                    delta_dx, delta_dy = _parse_stroke(message["bytes"], session.shape)
+                    tile = await executor.run("session", session.apply_stroke, delta_dx, delta_dy)
+                    await _send_tile(websocket, tile, session.strokes)
+                    continue
+
+                command = _parse_command(message.get("text") or "{}")
+                if command == "reset":
+                    tile = await executor.run("session", session.reset)
+                    await _send_tile(websocket, tile, session.strokes)
+                elif command == "save":
+                    url = await executor.run("session", session.save)
+                    await websocket.send_text(json.dumps({"type": "saved", "reconstructedUrl": url}))
+                else:
+                    await _send_error(websocket, "INVALID_REQUEST", f"Unknown command {command!r}")
+            except executor.PoolSaturatedError as exc:
+                await _send_error(websocket, "SERVER_BUSY", str(exc))
+            except ValueError as exc:
+                await _send_error(websocket, "INVALID_REQUEST", str(exc))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _active_sessions -= 1
@@ -0,0 +1,207 @@
+from typing import Optional
+from urllib.parse import urlencode
+
+from fastapi import APIRouter, Header, HTTPException, Query, Response, status
+from PIL import Image
+
+from backend.api.dispatch import run_in_pool
+from backend.core import (
+    gradient_cache,
+    gradient_ops,
+    image_store,
+    synthetic_detector,
+    visual_cache,
+    visual_tiles,
+)
+from backend.models import config
+from backend.models.dto import ErrorDetail, ErrorResponse, VisualTilesResponse
+
+router = APIRouter(prefix="/api/visuals", tags=["visuals"])
+
+VISUAL_NAMES = {"dx", "dy", "mag", "heatmap"}
+# Content under a visual URL never changes (ids are immutable and the URL carries
+# the render version), so browsers may keep it for good.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def visual_url(image_id: str, name: str, level: Optional[int], fmt: Optional[str]) -> str:
+    params = {"v": config.VISUAL_VERSION}
+    if level is not None:
+        params["level"] = level
+    if fmt is not None and fmt != config.VISUAL_FORMAT:
+        params["format"] = fmt
+    return f"{router.prefix}/{image_id}/{name}?{urlencode(params)}"
+
+
+def tile_url_template(image_id: str, name: str, fmt: Optional[str]) -> str:
+    params = {"v": config.VISUAL_VERSION}
+    if fmt is not None and fmt != config.VISUAL_FORMAT:
+        params["format"] = fmt
+    return f"{router.prefix}/{image_id}/{name}/{{z}}/{{x}}/{{y}}?{urlencode(params)}"
+
+
+def _tile_key(image_id: str, zoom: int, x: int, y: int) -> str:
+    return f"{image_id}@{config.VISUAL_TILE_SIZE}/{zoom}/{x}/{y}"
+
+
+def _render(variant: str, name: str) -> Image.Image:
+    dx, dy = gradient_cache.get_sobel_gradients(variant)
+    if name == "heatmap":
+        return synthetic_detector.colorize_heatmap(synthetic_detector.compute_heatmap(dx, dy))
+    return gradient_ops.create_gradient_visual(dx, dy, name)
+
+
+def _http_errors(image_id: str, render):
+    """Run `render`, mapping store / argument errors to HTTP errors."""
+    try:
+        return render()
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=ErrorDetail(code="IMAGE_NOT_FOUND", message=f"No image {image_id}").dict(),
+        )
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorDetail(code="INVALID_REQUEST", message=str(exc)).dict(),
+        )
+
+
+def _encoded_visual(image_id: str, name: str, level: Optional[int], fmt: str):
+    def render():
+        variant = image_store.resolve_variant(image_id, level)
+        # Keyed by the requested level so the ETag can be checked before resolving it.
+        key = image_store.variant_id(image_id, level)
+        return visual_cache.get_or_render(key, name, fmt, lambda: _render(variant, name))
+
+    return _http_errors(image_id, render)
+
+
+def _encoded_tile(image_id: str, name: str, zoom: int, x: int, y: int, fmt: str):
+    key = _tile_key(image_id, zoom, x, y)
+    return _http_errors(
+        image_id,
+        lambda: visual_cache.get_or_render(
+            key, name, fmt, lambda: visual_tiles.render_tile(image_id, name, zoom, x, y)
+        ),
+    )
+
+
+def _tile_grid(image_id: str, fmt: Optional[str]) -> VisualTilesResponse:
+    tiles = _http_errors(image_id, lambda: visual_tiles.grid(image_id))
+    return VisualTilesResponse(
+        imageId=image_id,
+        width=tiles.width,
+        height=tiles.height,
+        tileSize=config.VISUAL_TILE_SIZE,
+        maxZoom=tiles.max_zoom,
+        urls={name: tile_url_template(image_id, name, fmt) for name in visual_tiles.TILE_VISUALS},
+    )
+
+
+def _require_image(image_id: str) -> None:
+    """
+    404 for images that were never stored or have been evicted, checked before
+    the ETag and the cache: both would otherwise keep answering for them.
+    """
+    if not image_store.get_image_path(image_id).exists():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=ErrorDetail(code="IMAGE_NOT_FOUND", message=f"No image {image_id}").dict(),
+        )
+
+
+def _unknown_visual(name: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=ErrorDetail(code="INVALID_REQUEST", message=f"Unknown visual {name!r}").dict(),
+    )
+
+
+_VISUAL_RESPONSES = {
+    200: {"content": {media: {} for media in visual_cache.VISUAL_FORMATS.values()}},
+    304: {"description": "Not modified"},
+    400: {"model": ErrorResponse},
+    404: {"model": ErrorResponse},
+    503: {"model": ErrorResponse},
+}
+
+
+@router.get(
+    "/{imageId}/tiles",
+    response_model=VisualTilesResponse,
+    responses={404: {"model": ErrorResponse}, 503: {"model": ErrorResponse}},
+)
+async def get_visual_tiles(
+    imageId: str,
+    format: Optional[str] = Query(None, description="png, webp or jpeg, carried into the tile URLs"),
+):
+    """Size of the deep-zoom pyramid and the tile URL template of every visual."""
+    return await run_in_pool("visuals", _tile_grid, imageId, format)
+
+
+@router.get(
+    "/{imageId}/{name}/{z}/{x}/{y}",
+    response_class=Response,
+    responses=_VISUAL_RESPONSES,
+)
+async def get_visual_tile(
+    imageId: str,
+    name: str,
+    z: int,
+    x: int,
+    y: int,
+    format: Optional[str] = Query(None, description="png, webp or jpeg"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    One VISUAL_TILE_SIZE tile of a visual at zoom `z` (0 fits the image in a
+    tile), computed on first request from the memory-mapped pixels of the
+    closest stored level and then served like the full visuals.
+    """
+    if name not in visual_tiles.TILE_VISUALS:
+        raise _unknown_visual(name)
+    _require_image(imageId)
+    fmt = format or config.VISUAL_FORMAT
+    headers = {"Cache-Control": CACHE_CONTROL}
+
+    if fmt in visual_cache.VISUAL_FORMATS:
+        etag = visual_cache.visual_etag(_tile_key(imageId, z, x, y), name, fmt)
+        if visual_cache.etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, **headers})
+
+    visual = await run_in_pool("visuals", _encoded_tile, imageId, name, z, x, y, fmt)
+    return Response(
+        content=visual.data,
+        media_type=visual.media_type,
+        headers={"ETag": visual.etag, **headers},
+    )
+
+
+@router.get("/{imageId}/{name}", response_class=Response, responses=_VISUAL_RESPONSES)
+async def get_visual(
+    imageId: str,
+    name: str,
+    level: Optional[int] = Query(None, description="Pyramid level (long side in px)"),
+    format: Optional[str] = Query(None, description="png, webp or jpeg"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Gradient (dx, dy, mag) or heatmap visual, rendered once and served with an ETag."""
+    if name not in VISUAL_NAMES:
+        raise _unknown_visual(name)
+    _require_image(imageId)
+    fmt = format or config.VISUAL_FORMAT
+    headers = {"Cache-Control": CACHE_CONTROL}
+
+    # The ETag is known without touching the image, so revalidation is free.
+    if fmt in visual_cache.VISUAL_FORMATS:
+        etag = visual_cache.visual_etag(image_store.variant_id(imageId, level), name, fmt)
+        if visual_cache.etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, **headers})
+
+    visual = await run_in_pool("visuals", _encoded_visual, imageId, name, level, fmt)
+    return Response(
+        content=visual.data,
+        media_type=visual.media_type,
+        headers={"ETag": visual.etag, **headers},
+    )
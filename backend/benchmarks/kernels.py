@@ -0,0 +1,311 @@
+"""
+Time and measure the memory of the core kernels across image sizes.
+
+    python -m backend.benchmarks.kernels --output baseline.json
+    python -m backend.benchmarks.kernels --baseline baseline.json --threshold 0.2
+
+Every kernel runs on synthetic square images (256 to 4096 px by default): once
+to warm up, `--repeat` times for wall time (best and median), once under
+tracemalloc for the peak of Python/NumPy allocations, and once while a thread
+samples the process RSS (Linux), which also sees OpenCV and FFT buffers.
+
+`--output` writes the results as JSON. `--baseline` compares against such a
+file and exits with status 1 when a kernel got slower, or its traced peak
+grew, by more than `--threshold` (a fraction). Kernels with an absolute
+memory budget (PEAK_BUDGET_FRAMES) fail the run whenever they exceed it. Timings below `--min-time-ms`
+are too noisy to judge and are only reported. Baselines are machine
+specific; record them on the machine that runs the comparison.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+import scipy
+
+from backend.core import gradient_ops, poisson_solver, synthetic_detector
+
+Kernel = Callable[[], Any]
+
+_MB = 1024 * 1024
+
+
+def _test_image(size: int) -> np.ndarray:
+    """Smooth colour gradients plus mild noise, as uint8 RGB."""
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    base = np.stack(
+        [0.5 + 0.3 * np.sin(6 * xx), 0.5 + 0.3 * np.cos(4 * yy), 0.5 + 0.2 * np.sin(3 * (xx + yy))],
+        axis=-1,
+    )
+    noise = np.random.default_rng(0).normal(0.0, 0.02, base.shape)
+    return (np.clip(base + noise, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def _luma(size: int) -> np.ndarray:
+    rgb = _test_image(size).astype(np.float32) / 255.0
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2YCrCb)[:, :, 0].copy()
+
+
+def _compute_gradients(size: int) -> Kernel:
+    image = _test_image(size)
+    return lambda: gradient_ops.compute_gradients(image)
+
+
+def _compute_forward_gradients(size: int) -> Kernel:
+    y = _luma(size)
+    return lambda: gradient_ops.compute_forward_gradients(y)
+
+
+def _reconstruct(size: int) -> Kernel:
+    y = _luma(size)
+    dx, dy = gradient_ops.compute_forward_gradients(y)
+    dx[size // 2 : size // 2 + 8, size // 4 : size // 2] += 0.05
+    solver = poisson_solver.get_solver("dst")
+    return lambda: poisson_solver.reconstruct_image_from_gradients(dx, dy, y, solver=solver)
+
+
+def _reconstruct_pipeline(size: int) -> Kernel:
+    """POST /api/reconstruct after the edit is decoded: apply it, solve, merge to RGB strips."""
+    from backend.api import routes_reconstruct
+
+    rgb = _test_image(size).astype(np.float32) / 255.0
+    ycrcb = cv2.cvtColor(rgb, cv2.COLOR_RGB2YCrCb)
+    dx, dy = gradient_ops.compute_forward_gradients(ycrcb[:, :, 0].copy())
+    edit = np.zeros_like(dx)
+    edit[size // 2 : size // 2 + 8, size // 4 : size // 2] = 0.5
+    delta = np.empty_like(edit)  # stands in for the decoded request edit
+    solver = poisson_solver.get_solver("dst")
+    frame = routes_reconstruct.FULL_FRAME
+
+    def run() -> None:
+        np.copyto(delta, edit)
+        dx_edited = routes_reconstruct._apply_delta(dx, delta, frame)
+        channels = routes_reconstruct._solve_channels(
+            "benchmark", ycrcb[:, :, 0], solver, frame, None, dx_edited, dy
+        )
+        for _ in routes_reconstruct._rgb_strips(ycrcb, channels, "luma"):
+            pass
+
+    return run
+
+
+def _analyze(size: int) -> Kernel:
+    dx, dy = gradient_ops.compute_gradients(_test_image(size))
+    return lambda: synthetic_detector.analyze_gradients(dx, dy, heatmap=False)  # compute_heatmap is its own kernel
+
+
+def _heatmap(size: int) -> Kernel:
+    dx, dy = gradient_ops.compute_gradients(_test_image(size))
+    return lambda: synthetic_detector.compute_heatmap(dx, dy)
+
+
+def _decode_png(size: int) -> Kernel:
+    dx, _ = gradient_ops.compute_forward_gradients(_luma(size))
+    data = gradient_ops.encode_gradient_to_base64_png(dx)
+    return lambda: gradient_ops.decode_base64_gradient_png(data)
+
+
+def _encode_png(size: int) -> Kernel:
+    dx, _ = gradient_ops.compute_forward_gradients(_luma(size))
+    return lambda: gradient_ops.encode_gradient_to_base64_png(dx)
+
+
+# name -> setup(size) returning the call to measure; setup cost is not measured.
+KERNELS: Dict[str, Callable[[int], Kernel]] = {
+    "compute_gradients": _compute_gradients,
+    "compute_forward_gradients": _compute_forward_gradients,
+    "reconstruct_image_from_gradients": _reconstruct,
+    "reconstruct_pipeline": _reconstruct_pipeline,
+    "analyze_gradients": _analyze,
+    "compute_heatmap": _heatmap,
+    "decode_base64_gradient_png": _decode_png,
+    "encode_gradient_to_base64_png": _encode_png,
+}
+
+
+# Peak memory budgets, in float32 frames of the image size: the traced peak of
+# a call plus the work buffers the solver pools keep between calls. Checked
+# from 1024² up, where fixed-size strip buffers no longer dominate.
+PEAK_BUDGET_FRAMES = {"reconstruct_pipeline": 4.0}
+PEAK_BUDGET_MIN_SIZE = 1024
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _release_free_memory() -> None:
+    """Hand freed heap back to the OS (glibc) so earlier runs don't hide RSS growth."""
+    name = ctypes.util.find_library("c")
+    try:
+        ctypes.CDLL(name).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+def _peak_rss_growth(fn: Kernel, interval: float = 0.001) -> Optional[float]:
+    """Peak RSS above the level before the call, in MB (None where unsupported)."""
+    _release_free_memory()
+    before = _rss_bytes()
+    if before is None:
+        return None
+    peak = before
+    done = threading.Event()
+
+    def sample() -> None:
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, _rss_bytes() or 0)
+            time.sleep(interval)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        sampler.join()
+    peak = max(peak, _rss_bytes() or 0)
+    return (peak - before) / _MB
+
+
+def _traced_peak(fn: Kernel) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / _MB
+
+
+def measure(kernel: str, size: int, repeat: int) -> Dict[str, Optional[float]]:
+    poisson_solver.clear_workspaces()  # so pooled_mb holds only this kernel's buffers
+    fn = KERNELS[kernel](size)
+    fn()  # warm-up: plan caches, lazy imports
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+        "traced_peak_mb": _traced_peak(fn),
+        "rss_peak_mb": _peak_rss_growth(fn),
+        "pooled_mb": poisson_solver.pooled_bytes() / _MB,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def run(kernels: List[str], sizes: List[int], repeat: int) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, Optional[float]]] = {}
+    print(f"{'kernel':<34} {'size':>6} {'best':>10} {'median':>10} {'traced':>10} {'rss':>10}")
+    for kernel in kernels:
+        for size in sizes:
+            result = measure(kernel, size, repeat)
+            results[f"{kernel}@{size}"] = result
+            rss = result["rss_peak_mb"]
+            print(
+                f"{kernel:<34} {size:>6} {result['best_s'] * 1e3:>8.2f}ms "
+                f"{result['median_s'] * 1e3:>8.2f}ms {result['traced_peak_mb']:>8.1f}MB "
+                + (f"{rss:>8.1f}MB" if rss is not None else f"{'-':>10}")
+            )
+    return {"environment": environment(), "repeat": repeat, "results": results}
+
+
+def check_budgets(current: Dict[str, Any]) -> List[str]:
+    """Describe every kernel whose peak (traced plus pooled) exceeds its PEAK_BUDGET_FRAMES."""
+    over = []
+    for name, result in current["results"].items():
+        kernel, size = name.rsplit("@", 1)
+        budget = PEAK_BUDGET_FRAMES.get(kernel)
+        if budget is None or int(size) < PEAK_BUDGET_MIN_SIZE:
+            continue
+        frames = (result["traced_peak_mb"] + result["pooled_mb"]) * _MB / (int(size) ** 2 * 4)
+        if frames > budget:
+            over.append(f"{name}: peak {frames:.2f} frames, budget {budget:.1f}")
+    return over
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_time_s: float
+) -> List[str]:
+    """Describe every regression beyond `threshold`; empty when there is none."""
+    regressions = []
+    for name, now in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        if before["best_s"] >= min_time_s and now["best_s"] > before["best_s"] * (1 + threshold):
+            regressions.append(
+                f"{name}: time {before['best_s'] * 1e3:.2f}ms -> {now['best_s'] * 1e3:.2f}ms "
+                f"(x{now['best_s'] / before['best_s']:.2f})"
+            )
+        # Traced allocations are deterministic; ignore sub-MB noise from Python objects.
+        grown = now["traced_peak_mb"] - before["traced_peak_mb"]
+        if grown > 1.0 and now["traced_peak_mb"] > before["traced_peak_mb"] * (1 + threshold):
+            regressions.append(
+                f"{name}: traced peak {before['traced_peak_mb']:.1f}MB -> "
+                f"{now['traced_peak_mb']:.1f}MB"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512, 1024, 2048, 4096])
+    parser.add_argument("--kernels", nargs="+", choices=sorted(KERNELS), default=list(KERNELS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON (e.g. a new baseline)")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--min-time-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = run(args.kernels, args.sizes, args.repeat)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+    failures = check_budgets(results)
+    for line in failures:
+        print(f"OVER BUDGET {line}")
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        regressions = compare(results, baseline, args.threshold, args.min_time_ms / 1e3)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if not regressions:
+            print(f"No regression beyond {args.threshold:.0%} against {args.baseline}.")
+        failures += regressions
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+HTTP load test of the API under concurrent mixed traffic.
+
+    python -m backend.benchmarks.load --users 8 --iterations 4
+    python -m backend.benchmarks.load --url http://127.0.0.1:8000 --scenario reconstruct
+    python -m backend.benchmarks.load --output run.json --compare previous.json
+
+Without `--url` the app from `create_app()` is driven in-process through the
+httpx ASGI transport (no sockets; it stores into the configured directories
+like a server would). Each virtual user runs the scenario `--iterations`
+times on synthetic images, all users concurrently:
+
+- mixed: upload, gradients, magnitude visual, `--reconstructs` reconstructs
+  with a different brush stroke each, analyze
+- reconstruct: one upload per user, then only reconstructs
+- analyze: one upload per user, then only analyze
+- upload: only uploads
+
+Every image and stroke is distinct (seeded per user and iteration, so runs
+are repeatable) unless `--shared-image` makes all users work on one picture,
+which exercises deduplication and request coalescing instead.
+
+The report lists per endpoint the requests, error rate, throughput and
+p50/p95/p99 latency, and status codes. `--output` saves it as JSON;
+`--compare` prints the change against an earlier report.
+"""
+import argparse
+import asyncio
+import io
+import json
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from backend.core import gradient_ops
+
+Scenario = Callable[["User"], Awaitable[None]]
+
+
+def _synthetic_png(size: int, seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    phase = rng.uniform(0, 2 * np.pi, 3)
+    base = np.stack([0.5 + 0.3 * np.sin(5 * xx + p) * np.cos(3 * yy + p) for p in phase], axis=-1)
+    noise = rng.normal(0.0, 0.03, base.shape)
+    pixels = (np.clip(base + noise, 0.0, 1.0) * 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def _stroke_png(width: int, height: int, seed: int) -> str:
+    """Base64 dx edit with one random horizontal stroke, as the lab canvas sends."""
+    rng = np.random.default_rng(seed)
+    delta = np.zeros((height, width), dtype=np.float32)
+    top = int(rng.integers(0, max(height - 8, 1)))
+    left = int(rng.integers(0, max(width // 2, 1)))
+    delta[top : top + 8, left : left + width // 4] = rng.choice([-1.0, 1.0])
+    return gradient_ops.encode_gradient_to_base64_png(delta)
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def request(
+        self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs: Any
+    ) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, 0  # transport failure
+        self.latencies[label].append(time.perf_counter() - start)
+        self.statuses[label][status] += 1
+        if response is None or response.status_code >= 400:
+            return None
+        return response
+
+
+class User:
+    def __init__(self, index: int, client: httpx.AsyncClient, recorder: Recorder, args) -> None:
+        self.index = index
+        self.client = client
+        self.recorder = recorder
+        self.args = args
+        self.iteration = 0
+
+    def seed(self, salt: int = 0) -> int:
+        if self.args.shared_image:
+            return salt
+        return (self.index * 1_000_003 + self.iteration) * 101 + salt
+
+    async def upload(self) -> Optional[str]:
+        data = _synthetic_png(self.args.size, self.seed())
+        response = await self.recorder.request(
+            self.client, "POST /api/images", "POST", "/api/images",
+            files={"file": ("load.png", data, "image/png")},
+        )
+        return response.json()["imageId"] if response else None
+
+    async def gradients(self, image_id: str) -> Optional[Tuple[int, int]]:
+        params = {"imageId": image_id}
+        if self.args.level:
+            params["level"] = self.args.level
+        response = await self.recorder.request(
+            self.client, "GET /api/gradients", "GET", "/api/gradients", params=params
+        )
+        if response is None:
+            return None
+        body = response.json()
+        await self.recorder.request(
+            self.client, "GET /api/visuals", "GET", body["magnitudeUrl"]
+        )
+        return body["width"], body["height"]
+
+    async def reconstruct(self, image_id: str, size: Tuple[int, int], salt: int) -> None:
+        body = {
+            "imageId": image_id,
+            "editedDx": _stroke_png(*size, self.seed(salt)),
+            "mode": self.args.mode,
+        }
+        if self.args.level:
+            body["level"] = self.args.level
+        await self.recorder.request(
+            self.client, "POST /api/reconstruct", "POST", "/api/reconstruct", json=body
+        )
+
+    async def analyze(self, image_id: str) -> None:
+        body = {"imageId": image_id}
+        if self.args.level:
+            body["level"] = self.args.level
+        await self.recorder.request(self.client, "POST /api/analyze", "POST", "/api/analyze", json=body)
+
+
+async def _mixed(user: User) -> None:
+    for user.iteration in range(user.args.iterations):
+        image_id = await user.upload()
+        if image_id is None:
+            continue
+        size = await user.gradients(image_id)
+        if size is not None:
+            for salt in range(1, user.args.reconstructs + 1):
+                await user.reconstruct(image_id, size, salt)
+        await user.analyze(image_id)
+
+
+async def _reconstruct_only(user: User) -> None:
+    image_id = await user.upload()
+    size = await user.gradients(image_id) if image_id else None
+    if size is None:
+        return
+    for user.iteration in range(user.args.iterations):
+        for salt in range(1, user.args.reconstructs + 1):
+            await user.reconstruct(image_id, size, salt)
+
+
+async def _analyze_only(user: User) -> None:
+    image_id = await user.upload()
+    if image_id is None:
+        return
+    for user.iteration in range(user.args.iterations):
+        await user.analyze(image_id)
+
+
+async def _upload_only(user: User) -> None:
+    for user.iteration in range(user.args.iterations):
+        await user.upload()
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "mixed": _mixed,
+    "reconstruct": _reconstruct_only,
+    "analyze": _analyze_only,
+    "upload": _upload_only,
+}
+
+
+def _client(url: Optional[str], timeout: float) -> httpx.AsyncClient:
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout)
+    from backend.main import create_app
+
+    transport = httpx.ASGITransport(app=create_app())
+    return httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout)
+
+
+def summarize(recorder: Recorder, wall: float) -> Dict[str, Dict[str, Any]]:
+    endpoints = {}
+    for label, latencies in sorted(recorder.latencies.items()):
+        statuses = recorder.statuses[label]
+        errors = sum(count for status, count in statuses.items() if status == 0 or status >= 400)
+        p50, p95, p99 = np.percentile(np.asarray(latencies) * 1e3, [50, 95, 99])
+        endpoints[label] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "error_rate": errors / len(latencies),
+            "throughput_rps": len(latencies) / wall,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        }
+    return endpoints
+
+
+async def run(args) -> Dict[str, Any]:
+    recorder = Recorder()
+    scenario = SCENARIOS[args.scenario]
+    async with _client(args.url, args.timeout) as client:
+        users = [User(i, client, recorder, args) for i in range(args.users)]
+        start = time.perf_counter()
+        await asyncio.gather(*(scenario(user) for user in users))
+        wall = time.perf_counter() - start
+    return {
+        "config": {
+            key: getattr(args, key)
+            for key in ("scenario", "users", "iterations", "reconstructs", "size", "level", "mode", "shared_image")
+        },
+        "target": args.url or "in-process",
+        "wall_s": wall,
+        "endpoints": summarize(recorder, wall),
+    }
+
+
+def _change(now: float, before: float) -> str:
+    if not before:
+        return ""
+    return f"({(now - before) / before:+.0%})"
+
+
+def print_report(report: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> None:
+    print(f"{report['target']}: {report['config']} in {report['wall_s']:.1f}s")
+    print(
+        f"{'endpoint':<22} {'reqs':>6} {'err%':>6} {'rps':>14} "
+        f"{'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16}  statuses"
+    )
+    old = (previous or {}).get("endpoints", {})
+    for label, stats in report["endpoints"].items():
+        before = old.get(label, {})
+
+        def column(key: str, width: int) -> str:
+            text = f"{stats[key]:.1f} {_change(stats[key], before.get(key, 0))}".strip()
+            return f"{text:>{width}}"
+
+        print(
+            f"{label:<22} {stats['requests']:>6} {stats['error_rate'] * 100:>5.1f}% "
+            f"{column('throughput_rps', 14)} {column('p50_ms', 16)} {column('p95_ms', 16)} "
+            f"{column('p99_ms', 16)}  {stats['statuses']}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="base URL of a running server (default: in-process)")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--iterations", type=int, default=4, help="scenario repetitions per user")
+    parser.add_argument("--reconstructs", type=int, default=3, help="reconstructs per iteration")
+    parser.add_argument("--size", type=int, default=1024, help="synthetic image side in px")
+    parser.add_argument("--level", type=int, default=None, help="pyramid level to work on")
+    parser.add_argument("--mode", choices=["full", "local"], default="full")
+    parser.add_argument("--shared-image", action="store_true", help="all users use one image")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    previous = None
+    if args.compare:
+        with open(args.compare) as handle:
+            previous = json.load(handle)
+    print_report(report, previous)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
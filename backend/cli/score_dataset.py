@@ -0,0 +1,284 @@
+"""
+Score a folder of images for synthetic-ness without going through the API.
+
+    python -m backend.cli.score_dataset photos/ --output scores.csv
+    python -m backend.cli.score_dataset "shots/**/*.jpg" more/ --output scores.csv --workers 8
+
+Every file is decoded like an upload and scored like `POST /api/analyze` (full
+frame up to MAX_IMAGE_DIMENSION, tile by tile above it), but nothing is stored
+and no heatmap is rendered. Directories are searched recursively for
+IMAGE_SUFFIXES; other arguments are glob patterns (`**` included) or files.
+
+Files are scored by a process pool, `--chunk-size` files per task, with a few
+chunks queued per worker. Each finished chunk is appended to the CSV (one row
+per image: path, width, height and the three scores) and then recorded in a
+manifest next to it, `<output>.manifest.sqlite3`, together with the CSV length
+at that point. Running the same command again after an interruption cuts the
+CSV back to the last recorded chunk and scores only the files the manifest
+does not have, so every image ends up in the CSV exactly once. Files that fail
+to decode are kept out of the CSV and listed in the manifest with their error;
+`--retry-failed` scores them again.
+"""
+import argparse
+import csv
+import glob
+import io
+import os
+import signal
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import cv2
+import numpy as np
+
+from backend.core import gradient_ops, image_store, synthetic_detector, tiled
+from backend.models import config
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff", ".gif"}
+SCORE_NAMES = ("edgeConsistency", "smoothnessScore", "textureWeirdness")
+COLUMNS = ("path", "width", "height") + SCORE_NAMES
+# Chunks waiting per worker, so workers never idle between two chunks.
+_QUEUED_PER_WORKER = 2
+# Failures printed at the end of a run; the manifest has all of them.
+_LISTED_FAILURES = 10
+
+# (path, row or None, error or None)
+Result = Tuple[str, Optional[List[object]], Optional[str]]
+
+
+def find_images(inputs: Sequence[str]) -> List[str]:
+    """Absolute paths of the images under / matching `inputs`, sorted and without duplicates."""
+    found: Set[str] = set()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            candidates: Iterator[Path] = path.rglob("*")
+        elif path.is_file():
+            candidates = iter([path])
+        else:
+            candidates = (Path(match) for match in glob.iglob(item, recursive=True))
+        for candidate in candidates:
+            if candidate.suffix.lower() in IMAGE_SUFFIXES and candidate.is_file():
+                found.add(os.path.abspath(candidate))
+    return sorted(found)
+
+
+def score_file(path: str) -> Tuple[int, int, Dict[str, float]]:
+    """(width, height, scores) of one image file; raises ValueError for unreadable files."""
+    with open(path, "rb") as handle:
+        image = image_store.decode_image(handle)
+    pixels = np.asarray(image)
+    if max(image.size) > config.MAX_IMAGE_DIMENSION:
+        return image.width, image.height, tiled.analyze_pixels(pixels)
+    dx, dy = gradient_ops.compute_gradients(pixels)
+    scores, _ = synthetic_detector.analyze_gradient_stack(dx[np.newaxis], dy[np.newaxis], heatmaps=False)
+    return image.width, image.height, scores[0]
+
+
+def _init_worker() -> None:
+    # The pool already runs one process per core; OpenCV threads would oversubscribe it.
+    cv2.setNumThreads(1)
+    # Ctrl-C reaches the whole process group; the parent finishes the running chunks.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def score_chunk(paths: List[str]) -> List[Result]:
+    results: List[Result] = []
+    for path in paths:
+        try:
+            width, height, scores = score_file(path)
+        except (OSError, ValueError) as exc:
+            results.append((path, None, str(exc) or type(exc).__name__))
+            continue
+        results.append((path, [path, width, height] + [scores[name] for name in SCORE_NAMES], None))
+    return results
+
+
+class Manifest:
+    """
+    SQLite record of a run: the files scored (or failed) so far and how many
+    bytes of the CSV they account for. Both are updated in one transaction per
+    chunk, after the chunk's rows are on disk.
+    """
+
+    def __init__(self, path: Path, output: Path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                error TEXT,
+                scored_at REAL NOT NULL
+            );
+            """
+        )
+        recorded = self._meta("output")
+        if recorded is not None and recorded != str(output):
+            raise ValueError(f"Manifest {path} belongs to {recorded}, not {output}.")
+        if recorded is None:
+            with self._db:
+                self._db.execute("INSERT INTO meta VALUES ('output', ?)", (str(output),))
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    @property
+    def output_bytes(self) -> Optional[int]:
+        value = self._meta("output_bytes")
+        return None if value is None else int(value)
+
+    def finished(self, retry_failed: bool) -> Set[str]:
+        query = "SELECT path FROM files" + (" WHERE status = 'done'" if retry_failed else "")
+        return {row[0] for row in self._db.execute(query)}
+
+    def failures(self) -> List[Tuple[str, str]]:
+        return self._db.execute(
+            "SELECT path, error FROM files WHERE status = 'failed' ORDER BY path"
+        ).fetchall()
+
+    def record(self, results: List[Result], output_bytes: int) -> None:
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                [(path, "done" if row else "failed", error, now) for path, row, error in results],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('output_bytes', ?)", (str(output_bytes),)
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _open_output(path: Path, manifest: Manifest) -> io.TextIOWrapper:
+    """Open the CSV for appending, cut back to what the manifest recorded."""
+    committed = manifest.output_bytes
+    if committed is None:
+        handle = open(path, "w", newline="", encoding="utf-8")
+        csv.writer(handle).writerow(COLUMNS)
+        _sync(handle)
+        manifest.record([], handle.tell())
+        return handle
+    if not path.exists() or path.stat().st_size < committed:
+        raise ValueError(
+            f"{path} is shorter than its manifest records; delete {manifest.path} to start over."
+        )
+    handle = open(path, "r+", newline="", encoding="utf-8")
+    handle.truncate(committed)  # rows of a chunk that was written but not recorded
+    handle.seek(0, os.SEEK_END)
+    return handle
+
+
+def _sync(handle: io.TextIOWrapper) -> None:
+    handle.flush()
+    os.fsync(handle.fileno())
+
+
+def _chunks(paths: List[str], size: int) -> Iterator[List[str]]:
+    for start in range(0, len(paths), size):
+        yield paths[start : start + size]
+
+
+def run(
+    inputs: Sequence[str],
+    output: Path,
+    manifest_path: Path,
+    workers: int,
+    chunk_size: int,
+    retry_failed: bool,
+) -> Dict[str, int]:
+    """Score every image not yet in the manifest; returns counts for the summary."""
+    paths = find_images(inputs)
+    manifest = Manifest(manifest_path, output)
+    handle = _open_output(output, manifest)
+    writer = csv.writer(handle)
+    finished = manifest.finished(retry_failed)
+    pending = [path for path in paths if path not in finished]
+    counts = {"found": len(paths), "skipped": len(paths) - len(pending), "scored": 0, "failed": 0}
+    print(
+        f"{counts['found']} images, {counts['skipped']} already in {manifest_path.name}, "
+        f"{len(pending)} to score with {workers} workers",
+        file=sys.stderr,
+    )
+
+    chunks = _chunks(pending, chunk_size)
+    in_flight: Set[Future] = set()
+    start = last_report = time.monotonic()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    try:
+        while True:
+            while len(in_flight) < workers * _QUEUED_PER_WORKER:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.add(pool.submit(score_chunk, chunk))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                results = future.result()
+                writer.writerows(row for _, row, _ in results if row)
+                _sync(handle)
+                manifest.record(results, handle.tell())
+                failed = sum(1 for _, row, _ in results if not row)
+                counts["scored"] += len(results) - failed
+                counts["failed"] += failed
+
+            now = time.monotonic()
+            if now - last_report >= 1.0 or not in_flight:
+                processed = counts["scored"] + counts["failed"]
+                print(
+                    f"{processed}/{len(pending)} ({counts['failed']} failed), "
+                    f"{processed / (now - start):.1f} images/s",
+                    file=sys.stderr,
+                )
+                last_report = now
+        for path, error in manifest.failures()[:_LISTED_FAILURES]:
+            print(f"failed: {path}: {error}", file=sys.stderr)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        handle.close()
+        manifest.close()
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("inputs", nargs="+", help="directories, glob patterns or image files")
+    parser.add_argument("--output", required=True, type=Path, help="CSV file, appended to on resume")
+    parser.add_argument("--manifest", type=Path, help="default: <output>.manifest.sqlite3")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=16, help="files per pool task")
+    parser.add_argument("--retry-failed", action="store_true", help="score files that failed before again")
+    args = parser.parse_args()
+
+    output = args.output.resolve()
+    manifest = args.manifest or output.with_name(output.name + ".manifest.sqlite3")
+    try:
+        counts = run(
+            args.inputs, output, manifest, max(1, args.workers), max(1, args.chunk_size), args.retry_failed
+        )
+    except KeyboardInterrupt:
+        print(f"Interrupted; run the same command again to resume from {manifest}.", file=sys.stderr)
+        sys.exit(130)
+    except ValueError as exc:
+        parser.error(str(exc))
+    print(
+        f"Scored {counts['scored']}, failed {counts['failed']}, skipped {counts['skipped']}: {output}",
+        file=sys.stderr,
+    )
+    if counts["failed"]:
+        print(f"All failures are in the files table of {manifest}.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Eviction of stored images and everything derived from them.
+
+Files live in sharded directories (see `image_store._sharded`) and are tracked
+in the image index with their size; images carry a last-access time that
+image_store writes at most every ARTIFACT_TOUCH_INTERVAL_S. A background
+sweep removes images not accessed for ARTIFACT_TTL_S, then the least recently
+used ones until the tracked total is below ARTIFACT_QUOTA_MB. An image always
+goes together with its pyramid levels, sidecars and reconstructions, and its
+entries in the in-process gradient cache and tile normalisations.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from backend.core import gradient_cache, image_index, image_store, visual_tiles
+from backend.models import config
+
+logger = logging.getLogger(__name__)
+
+# Images considered per index query while sweeping.
+_SWEEP_BATCH = 256
+
+_lock = threading.Lock()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_evicted = 0
+_evicted_bytes = 0
+
+
+def delete_image(image_id: str) -> int:
+    """Remove an image and its derived files; returns the bytes freed."""
+    freed = 0
+    variants = {image_id}
+    for artifact in image_index.artifacts(image_id):
+        artifact.path.unlink(missing_ok=True)
+        variants.add(artifact.variant)
+        freed += artifact.bytes
+    image_index.forget_image(image_id)
+    image_store.forget_touches(image_id)
+    visual_tiles.forget(image_id)
+    for variant in variants:
+        gradient_cache.invalidate(variant)
+    return freed
+
+
+def evict(now: Optional[float] = None) -> Dict[str, int]:
+    """One sweep by TTL, then by quota. Returns what was removed."""
+    global _evicted, _evicted_bytes
+    now = time.time() if now is None else now
+    cutoff = now - config.ARTIFACT_TTL_S if config.ARTIFACT_TTL_S else None
+    quota = config.ARTIFACT_QUOTA_MB * 1024 * 1024 if config.ARTIFACT_QUOTA_MB else None
+    removed = freed = 0
+    with _lock:
+        _, total = image_index.usage()
+        done = False
+        while not done:
+            # Candidates come oldest first, so the sweep stops at the first image
+            # that is neither expired nor needed to get under the quota.
+            batch = image_index.least_recently_used(_SWEEP_BATCH)
+            done = len(batch) < _SWEEP_BATCH
+            for image_id, last_access, _ in batch:
+                expired = cutoff is not None and last_access < cutoff
+                over_quota = quota is not None and total > quota
+                if not (expired or over_quota):
+                    done = True
+                    break
+                size = delete_image(image_id)
+                total -= size
+                freed += size
+                removed += 1
+        _evicted += removed
+        _evicted_bytes += freed
+    if removed:
+        logger.info("Evicted %d images (%d bytes)", removed, freed)
+    return {"images": removed, "bytes": freed}
+
+
+def _run() -> None:
+    while not _stop.wait(config.ARTIFACT_SWEEP_INTERVAL_S):
+        try:
+            evict()
+        except Exception:
+            logger.exception("Artifact eviction failed")
+
+
+def start() -> None:
+    """Start the background sweep (no-op if it is already running or disabled)."""
+    global _thread
+    if not config.ARTIFACT_SWEEP_INTERVAL_S or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="artifact-eviction", daemon=True)
+    _thread.start()
+
+
+def stop() -> None:
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
+        _thread = None
+
+
+def stats() -> Dict[str, int]:
+    images, size = image_index.usage()
+    return {
+        "images": images,
+        "bytes": size,
+        "quotaBytes": config.ARTIFACT_QUOTA_MB * 1024 * 1024,
+        "evicted": _evicted,
+        "evictedBytes": _evicted_bytes,
+    }
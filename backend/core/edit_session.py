@@ -0,0 +1,126 @@
+import uuid
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from backend.core import (
+    gradient_cache,
+    gradient_ops,
+    image_store,
+    poisson_solver,
+    visual_cache,
+)
+from backend.core.poisson_solver import PoissonBackend
+from backend.core.sparse_edits import SparseDelta
+from backend.models import config
+
+FULL_FRAME = (slice(None), slice(None))
+
+
+@dataclass
+class PreviewTile:
+    """Encoded RGB crop of the reconstruction at (x, y)."""
+
+    x: int
+    y: int
+    width: int
+    height: int
+    format: str
+    data: bytes
+
+
+class EditSession:
+    """
+    In-memory state of one interactive editing session on an image.
+
+    Holds the YCrCb channels, the forward gradients, the accumulated gradient
+    deltas and the current reconstruction, so each stroke only solves a window
+    around itself (Dirichlet boundary = current reconstruction) and returns the
+    changed tile. Nothing is written to disk until `save` is called.
+    """
+
+    def __init__(self, image_id: str, solver: PoissonBackend):
+        self.image_id = image_id
+        self.solver = solver
+        self.ycrcb = gradient_cache.get_ycrcb(image_id)
+        self.orig_dx, self.orig_dy = gradient_cache.get_forward_gradients(image_id)
+        self.delta_dx = np.zeros_like(self.orig_dx)
+        self.delta_dy = np.zeros_like(self.orig_dy)
+        self.current_y = self.ycrcb[:, :, 0].copy()
+        self.strokes = 0
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.current_y.shape
+
+    def reset(self) -> PreviewTile:
+        self.delta_dx.fill(0)
+        self.delta_dy.fill(0)
+        np.copyto(self.current_y, self.ycrcb[:, :, 0])
+        self.strokes = 0
+        return self.preview(FULL_FRAME)
+
+    def apply_stroke(
+        self, delta_dx: Optional[SparseDelta], delta_dy: Optional[SparseDelta]
+    ) -> Optional[PreviewTile]:
+        """Accumulate a stroke, re-solve around it and return the changed tile."""
+        deltas = [d for d in (delta_dx, delta_dy) if d is not None]
+        for delta in deltas:
+            if delta.shape != self.shape:
+                raise ValueError("Stroke does not match image dimensions.")
+        boxes = [d.bounding_box(config.LOCAL_RECON_MARGIN) for d in deltas]
+        boxes = [box for box in boxes if box is not None]
+        if not boxes:
+            return None
+
+        if delta_dx is not None:
+            delta_dx.add_to(self.delta_dx, FULL_FRAME, config.EDIT_DELTA_SCALE)
+        if delta_dy is not None:
+            delta_dy.add_to(self.delta_dy, FULL_FRAME, config.EDIT_DELTA_SCALE)
+        self.strokes += 1
+
+        window = (
+            slice(min(b[0].start for b in boxes), max(b[0].stop for b in boxes)),
+            slice(min(b[1].start for b in boxes), max(b[1].stop for b in boxes)),
+        )
+        solve_mask = None
+        if self.solver.supports_mask:
+            edited = np.zeros(self.current_y[window].shape, dtype=bool)
+            for delta in deltas:
+                delta.mask_in(window, edited)
+            solve_mask = gradient_ops.dilate_mask(edited, config.LOCAL_RECON_MARGIN)
+
+        current = self.current_y[window]
+        self.current_y[window] = poisson_solver.reconstruct_image_from_gradients(
+            self.orig_dx[window] + self.delta_dx[window],
+            self.orig_dy[window] + self.delta_dy[window],
+            boundary_image=current,
+            solver=self.solver,
+            initial_guess=current,
+            mask=solve_mask,
+        )
+        return self.preview(window)
+
+    def _rgb(self, window: Tuple[slice, slice]) -> np.ndarray:
+        merged = self.ycrcb[window].copy()
+        merged[:, :, 0] = self.current_y[window]
+        return cv2.cvtColor(merged, cv2.COLOR_YCrCb2RGB)
+
+    def preview(self, window: Tuple[slice, slice]) -> PreviewTile:
+        rgb = (np.clip(self._rgb(window), 0.0, 1.0) * 255).astype(np.uint8)
+        fmt = config.SESSION_PREVIEW_FORMAT
+        return PreviewTile(
+            x=window[1].start or 0,
+            y=window[0].start or 0,
+            width=rgb.shape[1],
+            height=rgb.shape[0],
+            format=fmt,
+            data=visual_cache.encode_image(Image.fromarray(rgb), fmt),
+        )
+
+    def save(self) -> str:
+        """Persist the current reconstruction like POST /api/reconstruct does, as a new file."""
+        return image_store.save_reconstruction(self.image_id, self._rgb(FULL_FRAME), uuid.uuid4().hex)
@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from backend.models import config
+
+THREAD = "thread"
+PROCESS = "process"
+
+
+class PoolSaturatedError(RuntimeError):
+    """Raised when the pool queue or an endpoint's concurrency limit is full."""
+
+
+class WorkerPool:
+    """
+    Runs CPU-bound work off the event loop.
+
+    NumPy, OpenCV, SciPy FFT and Pillow release the GIL in their kernels, so the
+    thread pool is the default. Endpoints configured for ``process`` run in a
+    process pool instead (each process has its own caches).
+
+    Admission is bounded: at most ``threads + queue_size`` tasks may be in
+    flight and each endpoint has its own concurrency limit. Beyond that,
+    ``run`` fails fast with PoolSaturatedError instead of queueing unboundedly.
+    """
+
+    def __init__(
+        self,
+        threads: int,
+        processes: int,
+        queue_size: int,
+        endpoint_limits: Dict[str, int],
+        endpoint_kinds: Dict[str, str],
+    ):
+        self.threads = threads
+        self.processes = processes
+        self.capacity = threads + max(processes, 0) + queue_size
+        self.endpoint_limits = dict(endpoint_limits)
+        self.endpoint_kinds = dict(endpoint_kinds)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._per_endpoint: Dict[str, int] = {}
+        self._rejected = 0
+        self._thread_pool: ThreadPoolExecutor | None = None
+        self._process_pool: ProcessPoolExecutor | None = None
+
+    def _executor(self, endpoint: str) -> Executor:
+        kind = self.endpoint_kinds.get(endpoint, THREAD)
+        with self._lock:
+            if kind == PROCESS and self.processes > 0:
+                if self._process_pool is None:
+                    self._process_pool = ProcessPoolExecutor(max_workers=self.processes)
+                return self._process_pool
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    max_workers=self.threads, thread_name_prefix="gv-worker"
+                )
+            return self._thread_pool
+
+    def _acquire(self, endpoint: str) -> None:
+        with self._lock:
+            limit = self.endpoint_limits.get(endpoint)
+            running = self._per_endpoint.get(endpoint, 0)
+            if self._in_flight >= self.capacity or (limit is not None and running >= limit):
+                self._rejected += 1
+                raise PoolSaturatedError(f"Worker pool saturated for '{endpoint}'.")
+            self._in_flight += 1
+            self._per_endpoint[endpoint] = running + 1
+
+    def _release(self, endpoint: str) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._per_endpoint[endpoint] -= 1
+
+    async def run(self, endpoint: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        executor = self._executor(endpoint)
+        self._acquire(endpoint)
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(fn, *args, **kwargs)
+            if isinstance(executor, ThreadPoolExecutor):
+                # Run in the caller's context so per-request state (metrics spans) follows.
+                call = functools.partial(contextvars.copy_context().run, call)
+            return await loop.run_in_executor(executor, call)
+        finally:
+            self._release(endpoint)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "inFlight": self._in_flight,
+                "capacity": self.capacity,
+                "rejected": self._rejected,
+                "perEndpoint": dict(self._per_endpoint),
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pools = [self._thread_pool, self._process_pool]
+            self._thread_pool = None
+            self._process_pool = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+
+pool = WorkerPool(
+    threads=config.WORKER_THREADS,
+    processes=config.WORKER_PROCESSES,
+    queue_size=config.WORKER_QUEUE_SIZE,
+    endpoint_limits=config.ENDPOINT_CONCURRENCY,
+    endpoint_kinds=config.ENDPOINT_EXECUTOR,
+)
+
+
+async def run(endpoint: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await pool.run(endpoint, fn, *args, **kwargs)
+
+
+def shutdown() -> None:
+    pool.shutdown()
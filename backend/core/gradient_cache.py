@@ -0,0 +1,220 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple, Union
+
+import cv2
+import numpy as np
+
+from backend.core import gradient_ops, image_store, metrics, shared_cache
+from backend.models import config
+
+# Cache entry kinds. Each image id can hold one entry per kind.
+KIND_YCRCB = "ycrcb"  # float32 YCrCb of the RGB image
+KIND_SOBEL = "sobel"  # (dx, dy) Sobel gradients used for visuals / analysis
+KIND_FORWARD = "forward"  # (dx, dy) forward differences of the Y channel
+KIND_RGB = "rgb"  # float32 RGB planes (3, H, W) in 0..1
+KIND_FORWARD_RGB = "forward_rgb"  # (dx, dy) forward differences of each RGB plane, (3, H, W)
+KIND_RECONSTRUCTION = "reconstruction"  # last reconstructed Y or RGB planes, warm start for iterative solvers
+
+# Kinds derived only from the stored image; these go to core/shared_cache.py
+# when it is enabled. Reconstructions are per-worker warm starts and stay local.
+SHARED_KINDS = (KIND_YCRCB, KIND_SOBEL, KIND_FORWARD, KIND_RGB, KIND_FORWARD_RGB)
+
+CacheValue = Union[np.ndarray, Tuple[np.ndarray, ...]]
+
+
+def _freeze(value: CacheValue) -> CacheValue:
+    """Mark cached arrays read-only so callers cannot corrupt shared entries."""
+    arrays = value if isinstance(value, tuple) else (value,)
+    for arr in arrays:
+        arr.setflags(write=False)
+    return value
+
+
+def _nbytes(value: CacheValue) -> int:
+    if isinstance(value, tuple):
+        return sum(arr.nbytes for arr in value)
+    return value.nbytes
+
+
+class ArrayLRUCache:
+    """
+    Thread-safe LRU cache of numpy arrays bounded by total byte size.
+    Keys are (image_id, kind) tuples; values are arrays or tuples of arrays.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[CacheValue, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> CacheValue | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: CacheValue) -> CacheValue:
+        value = _freeze(value)
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            # Larger than the whole budget: hand it back without caching.
+            return value
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def get_or_compute(
+        self, key: Hashable, compute: Callable[[], CacheValue], store: bool = True
+    ) -> CacheValue:
+        """`store=False` still uses a cached value but does not insert a computed one."""
+        value = self.get(key)
+        if value is None:
+            # Computed outside the lock; concurrent misses may duplicate work
+            # but never block unrelated lookups.
+            value = compute()
+            if store:
+                value = self.put(key, value)
+        return value
+
+    def invalidate(self, image_id: str) -> None:
+        """Drop every entry belonging to ``image_id``."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == image_id]:
+                _, size = self._entries.pop(key)
+                self._bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_cache = ArrayLRUCache(config.GRADIENT_CACHE_MAX_MB * 1024 * 1024)
+
+
+def _get_or_compute(
+    image_id: str, kind: str, compute: Callable[[], CacheValue], store: bool = True
+) -> CacheValue:
+    if kind in SHARED_KINDS and shared_cache.enabled():
+        return shared_cache.get_or_compute(f"{image_id}:{kind}", compute, store=store)
+    return _cache.get_or_compute((image_id, kind), compute, store=store)
+
+
+def get_pixels(image_id: str) -> np.ndarray:
+    """
+    uint8 RGB pixels, memory-mapped by image_store. Not held in the LRU: the OS
+    page cache already keeps them. Raises FileNotFoundError like image_store.
+    """
+    return image_store.load_pixels(image_id)
+
+
+def _full_frame_pixels(image_id: str) -> np.ndarray:
+    """Pixels of an image small enough for full-frame kernels; see core/tiled.py otherwise."""
+    pixels = get_pixels(image_id)
+    if max(pixels.shape[:2]) > config.MAX_IMAGE_DIMENSION:
+        raise ValueError(
+            f"Image {image_id} exceeds {config.MAX_IMAGE_DIMENSION}px per side; "
+            "request a pyramid level or use a tiled endpoint."
+        )
+    return pixels
+
+
+@metrics.timed("gradient_cache.ycrcb", size_arg=None)
+def _ycrcb(image_id: str) -> np.ndarray:
+    _full_frame_pixels(image_id)
+    rgb = image_store.load_image(image_id)
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2YCrCb, dst=rgb)
+
+
+def get_ycrcb(image_id: str) -> np.ndarray:
+    return _get_or_compute(image_id, KIND_YCRCB, lambda: _ycrcb(image_id))
+
+
+def get_sobel_gradients(image_id: str, store: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """Pass `store=False` for one-off scans (batch analysis) so they don't evict hot entries."""
+    return _get_or_compute(
+        image_id,
+        KIND_SOBEL,
+        lambda: gradient_ops.compute_gradients(_full_frame_pixels(image_id)),
+        store=store,
+    )
+
+
+def get_forward_gradients(image_id: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Forward-difference gradients of the Y channel, as used by the Poisson solver."""
+    return _get_or_compute(
+        image_id,
+        KIND_FORWARD,
+        lambda: gradient_ops.compute_forward_gradients(get_ycrcb(image_id)[:, :, 0]),
+    )
+
+
+@metrics.timed("gradient_cache.rgb_planes", size_arg=None)
+def _rgb_planes(image_id: str) -> np.ndarray:
+    pixels = _full_frame_pixels(image_id)
+    planes = np.empty((3,) + pixels.shape[:2], dtype=np.float32)
+    np.multiply(np.moveaxis(pixels, -1, 0), np.float32(1.0 / 255.0), out=planes, dtype=np.float32)
+    return planes
+
+
+def get_rgb_planes(image_id: str) -> np.ndarray:
+    """Channel-first float32 RGB (3, H, W), the layout of multi-channel reconstruction."""
+    return _get_or_compute(image_id, KIND_RGB, lambda: _rgb_planes(image_id))
+
+
+def get_forward_gradients_rgb(image_id: str) -> Tuple[np.ndarray, np.ndarray]:
+    return _get_or_compute(
+        image_id,
+        KIND_FORWARD_RGB,
+        lambda: gradient_ops.compute_forward_gradient_stack(get_rgb_planes(image_id)),
+    )
+
+
+def get_last_reconstruction(image_id: str) -> np.ndarray | None:
+    return _cache.get((image_id, KIND_RECONSTRUCTION))
+
+
+def put_last_reconstruction(image_id: str, channels: np.ndarray) -> None:
+    """Y channel (H, W) or RGB planes (3, H, W) of the latest reconstruction."""
+    _cache.put((image_id, KIND_RECONSTRUCTION), channels)
+
+
+def invalidate(image_id: str) -> None:
+    _cache.invalidate(image_id)
+    shared_cache.invalidate(image_id)
+
+
+def clear() -> None:
+    _cache.clear()
+
+
+def stats() -> Dict[str, int]:
+    return _cache.stats()
@@ -1,27 +1,34 @@
 import base64
 import io
-from pathlib import Path
-from typing import Tuple
+from typing import Iterable, Optional, Tuple
 
 import cv2
 import numpy as np
 from PIL import Image
 
-from backend.models import config
+from backend.core import metrics
 
 
+@metrics.timed("gradient_ops.compute_gradients")
 def compute_gradients(image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-    """Compute dx and dy using Sobel on a grayscale version of the image."""
-    if image.ndim == 3:
-        gray = cv2.cvtColor((image * 255).astype(np.uint8), cv2.COLOR_RGB2GRAY)
-    else:
-        gray = (image * 255).astype(np.uint8)
-
-    dx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3) / 255.0
-    dy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3) / 255.0
-    return dx.astype(np.float32), dy.astype(np.float32)
+    """
+    Compute dx and dy using Sobel on a grayscale version of the image.
+    Accepts uint8 pixels directly or floats in 0..1 (used as they are, without
+    quantizing to uint8).
+    """
+    scale = 1.0 / 255.0
+    if image.dtype != np.uint8:
+        image = image.astype(np.float32, copy=False)
+        scale = 1.0
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+
+    # The scale is applied inside the filter, so each field is allocated once.
+    dx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3, scale=scale)
+    dy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3, scale=scale)
+    return dx, dy
 
 
+@metrics.timed("gradient_ops.compute_forward_gradients")
 def compute_forward_gradients(image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     """
     Compute gradients using simple forward differences.
@@ -65,52 +72,108 @@ def compute_forward_gradients(image: np.ndarray) -> Tuple[np.ndarray, np.ndarray
     return dx, dy
 
 
+@metrics.timed("gradient_ops.compute_forward_gradient_stack")
+def compute_forward_gradient_stack(planes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Forward differences of every channel of a (C, H, W) stack, as in compute_forward_gradients."""
+    dx = np.zeros(planes.shape, dtype=np.float32)
+    dy = np.zeros(planes.shape, dtype=np.float32)
+    np.subtract(planes[:, :, 1:], planes[:, :, :-1], out=dx[:, :, :-1])
+    np.subtract(planes[:, 1:, :], planes[:, :-1, :], out=dy[:, :-1, :])
+    return dx, dy
+
+
 def gradient_magnitude(dx: np.ndarray, dy: np.ndarray) -> np.ndarray:
     return np.sqrt(dx ** 2 + dy ** 2)
 
 
-def _normalize_signed_field(field: np.ndarray) -> np.ndarray:
+def _normalize_signed_field(field: np.ndarray, max_abs: Optional[float] = None) -> np.ndarray:
     """Map signed field to 0..255 for visualization."""
-    max_abs = np.max(np.abs(field)) + 1e-6
+    max_abs = (np.max(np.abs(field)) if max_abs is None else max_abs) + 1e-6
     normalized = (field / (2 * max_abs) + 0.5) * 255.0
     return np.clip(normalized, 0, 255).astype(np.uint8)
 
 
-def _normalize_magnitude_field(field: np.ndarray) -> np.ndarray:
-    max_val = np.max(field) + 1e-6
+def _normalize_magnitude_field(field: np.ndarray, max_val: Optional[float] = None) -> np.ndarray:
+    max_val = (np.max(field) if max_val is None else max_val) + 1e-6
     normalized = (field / max_val) * 255.0
     return np.clip(normalized, 0, 255).astype(np.uint8)
 
 
-def create_gradient_visual(dx: np.ndarray, dy: np.ndarray, mode: str) -> Image.Image:
+@metrics.timed("gradient_ops.create_gradient_visual")
+def create_gradient_visual(
+    dx: np.ndarray, dy: np.ndarray, mode: str, scale: Optional[float] = None
+) -> Image.Image:
+    """
+    Grayscale visual of dx, dy (mid-grey is zero) or the magnitude. Values are
+    scaled by the field's own maximum, or by `scale` so that several pieces of
+    one image (tiles) share a normalisation.
+    """
     if mode == "dx":
-        data = _normalize_signed_field(dx)
+        data = _normalize_signed_field(dx, scale)
     elif mode == "dy":
-        data = _normalize_signed_field(dy)
+        data = _normalize_signed_field(dy, scale)
     elif mode == "mag":
-        data = _normalize_magnitude_field(gradient_magnitude(dx, dy))
+        data = _normalize_magnitude_field(gradient_magnitude(dx, dy), scale)
     else:
         raise ValueError(f"Unknown gradient visual mode: {mode}")
     return Image.fromarray(data, mode="L")
 
 
-def save_gradient_visual(dx: np.ndarray, dy: np.ndarray, mode: str, path: Path) -> str:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    image = create_gradient_visual(dx, dy, mode)
-    image.save(path, format="PNG")
-    # Return url path component
-    relative = path.relative_to(config.BASE_DIR)
-    return f"/{relative.as_posix()}"
-
-
-def decode_base64_gradient_png(data: str) -> np.ndarray:
-    """Decode base64 PNG (grayscale) to float field in [-1, 1]."""
+def edit_mask(deltas: Iterable[Optional[np.ndarray]], threshold: float) -> Optional[np.ndarray]:
+    """
+    Boolean (h, w) mask of pixels where any delta exceeds `threshold`; (C, h, w)
+    deltas count a pixel as edited in any channel. None if nothing was edited.
+    """
+    mask = None
+    for delta in deltas:
+        if delta is None:
+            continue
+        edited = np.abs(delta) > threshold
+        if edited.ndim == 3:
+            edited = edited.any(axis=0)
+        mask = edited if mask is None else mask | edited
+    if mask is None or not mask.any():
+        return None
+    return mask
+
+
+def edit_bounding_box(mask: np.ndarray, margin: int) -> Tuple[slice, slice]:
+    """Bounding box (row slice, col slice) of `mask`, padded by `margin` and clipped."""
+    h, w = mask.shape
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    return (
+        slice(max(rows[0] - margin, 0), min(rows[-1] + margin + 1, h)),
+        slice(max(cols[0] - margin, 0), min(cols[-1] + margin + 1, w)),
+    )
+
+
+def dilate_mask(mask: np.ndarray, radius: int) -> np.ndarray:
+    """Grow a boolean mask by `radius` pixels (Euclidean)."""
+    distance = cv2.distanceTransform((~mask).astype(np.uint8), cv2.DIST_L2, 3)
+    return distance <= radius
+
+
+@metrics.timed("gradient_ops.decode_base64_png")
+def decode_base64_gradient_png(data: str, channels: int = 1) -> np.ndarray:
+    """
+    Decode base64 PNG to float field in [-1, 1]: grayscale (h, w) for one
+    channel, or (3, h, w) with one field per RGB channel (a grayscale PNG then
+    applies the same edit to every channel).
+    """
     raw = base64.b64decode(data)
-    image = Image.open(io.BytesIO(raw)).convert("L")
-    arr = np.asarray(image).astype(np.float32) / 255.0
-    return (arr - 0.5) * 2.0
-
-
+    image = Image.open(io.BytesIO(raw)).convert("L" if channels == 1 else "RGB")
+    pixels = np.asarray(image)
+    if channels != 1:
+        pixels = np.moveaxis(pixels, -1, 0)
+    # (p / 255 - 0.5) * 2, computed into the one float32 output.
+    field = np.empty(pixels.shape, dtype=np.float32)
+    np.multiply(pixels, np.float32(2.0 / 255.0), out=field, dtype=np.float32)
+    field -= 1.0
+    return field
+
+
+@metrics.timed("gradient_ops.encode_base64_png")
 def encode_gradient_to_base64_png(field: np.ndarray) -> str:
     """Encode float field in [-1, 1] to base64 PNG (grayscale)."""
     visual = _normalize_signed_field(field)
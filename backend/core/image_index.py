@@ -0,0 +1,192 @@
+"""
+Persistent index of stored images, their files and upload aliases (SQLite
+under DATA_DIR).
+
+Image ids are content addresses (a hash of the decoded pixels), so everything
+derived from an id is shared by every upload of the same picture. The index
+adds an alias from the hash of the raw upload bytes to that id, which lets a
+byte-identical re-upload skip decoding altogether, and remembers each image's
+size and pyramid levels.
+
+Every file written for an image (PNG, pixel sidecar, pyramid levels,
+reconstructions) is recorded as an artifact of it with its size, and images
+carry a last-access time; core/artifact_store.py evicts on those. Deleting an
+image row cascades to its artifacts and aliases.
+"""
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from backend.models import config
+
+# Applied in order; PRAGMA user_version counts the ones already applied.
+_MIGRATIONS = (
+    """
+    CREATE TABLE images (
+        image_id TEXT PRIMARY KEY,
+        width INTEGER NOT NULL,
+        height INTEGER NOT NULL,
+        levels TEXT NOT NULL,
+        created REAL NOT NULL
+    );
+    CREATE TABLE upload_aliases (
+        content_hash TEXT PRIMARY KEY,
+        image_id TEXT NOT NULL REFERENCES images(image_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    ALTER TABLE images ADD COLUMN last_access REAL NOT NULL DEFAULT 0;
+    UPDATE images SET last_access = created;
+    CREATE INDEX images_last_access ON images(last_access);
+    CREATE TABLE artifacts (
+        path TEXT PRIMARY KEY,
+        image_id TEXT NOT NULL REFERENCES images(image_id) ON DELETE CASCADE,
+        variant TEXT NOT NULL,
+        bytes INTEGER NOT NULL
+    );
+    CREATE INDEX artifacts_image ON artifacts(image_id);
+    """,
+)
+
+_lock = threading.Lock()
+_initialized = False
+
+
+class ImageRecord(NamedTuple):
+    image_id: str
+    width: int
+    height: int
+    levels: List[int]
+
+
+class Artifact(NamedTuple):
+    path: Path
+    variant: str
+    bytes: int
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    """Short-lived connection; SQLite handles cross-process locking, `_lock` the threads."""
+    global _initialized
+    with _lock:
+        config.DATA_DIR.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(config.INDEX_DB_PATH, timeout=10)
+        try:
+            conn.execute("PRAGMA foreign_keys = ON")
+            if not _initialized:
+                conn.execute("PRAGMA journal_mode = WAL")
+                _migrate(conn)
+                _initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0 and conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images'"
+    ).fetchone():
+        version = 1  # created before the index was versioned
+    for number, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+        conn.executescript(f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;")
+
+
+def _record(row) -> ImageRecord:
+    return ImageRecord(row[0], row[1], row[2], json.loads(row[3]))
+
+
+def get_image(image_id: str) -> Optional[ImageRecord]:
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT image_id, width, height, levels FROM images WHERE image_id = ?", (image_id,)
+        ).fetchone()
+    return None if row is None else _record(row)
+
+
+def lookup_upload(content_hash: str) -> Optional[ImageRecord]:
+    """Image previously stored from upload bytes with this hash, if any."""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT i.image_id, i.width, i.height, i.levels FROM upload_aliases a "
+            "JOIN images i ON i.image_id = a.image_id WHERE a.content_hash = ?",
+            (content_hash,),
+        ).fetchone()
+    return None if row is None else _record(row)
+
+
+def record_image(record: ImageRecord, content_hash: Optional[str] = None) -> None:
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO images (image_id, width, height, levels, created, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(image_id) DO UPDATE SET levels = excluded.levels, "
+            "last_access = excluded.last_access",
+            (record.image_id, record.width, record.height, json.dumps(record.levels), now, now),
+        )
+        if content_hash is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO upload_aliases (content_hash, image_id) VALUES (?, ?)",
+                (content_hash, record.image_id),
+            )
+
+
+def record_artifact(image_id: str, variant: str, path: Path) -> None:
+    """
+    Record a file derived from `image_id` (or replace its size). Files of images
+    the index does not know, i.e. stored before it existed, are not tracked.
+    """
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO artifacts (path, image_id, variant, bytes) "
+            "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM images WHERE image_id = ?)",
+            (str(path), image_id, variant, path.stat().st_size, image_id),
+        )
+
+
+def touch(image_ids: Iterable[str], when: float) -> None:
+    with _connect() as conn:
+        conn.executemany(
+            "UPDATE images SET last_access = MAX(last_access, ?) WHERE image_id = ?",
+            [(when, image_id) for image_id in image_ids],
+        )
+
+
+def artifacts(image_id: str) -> List[Artifact]:
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT path, variant, bytes FROM artifacts WHERE image_id = ?", (image_id,)
+        ).fetchall()
+    return [Artifact(Path(path), variant, size) for path, variant, size in rows]
+
+
+def usage() -> Tuple[int, int]:
+    """(tracked images, total bytes of their artifacts)."""
+    with _connect() as conn:
+        images = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        size = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM artifacts").fetchone()[0]
+    return images, size
+
+
+def least_recently_used(limit: int) -> List[Tuple[str, float, int]]:
+    """(image_id, last_access, bytes) of the `limit` least recently accessed images."""
+    with _connect() as conn:
+        return conn.execute(
+            "SELECT image_id, last_access, "
+            "(SELECT COALESCE(SUM(bytes), 0) FROM artifacts a WHERE a.image_id = i.image_id) "
+            "FROM images i ORDER BY last_access LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+
+def forget_image(image_id: str) -> None:
+    """Drop an image with its artifacts and aliases (e.g. when its files are gone)."""
+    with _connect() as conn:
+        conn.execute("DELETE FROM images WHERE image_id = ?", (image_id,))
@@ -1,55 +1,345 @@
+import hashlib
 import io
+import os
+import struct
+import time
 import uuid
+import zlib
 from pathlib import Path
-from typing import Tuple
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
 
 import numpy as np
-from PIL import Image, ImageOps
+from PIL import Image, ImageOps, UnidentifiedImageError
 
+from backend.core import image_index, metrics
 from backend.models import config
 
+# Oversized images are legitimate up to MAX_TILED_IMAGE_DIMENSION; keep Pillow's
+# decompression-bomb guard just above that instead of its ~89 MP default.
+Image.MAX_IMAGE_PIXELS = config.MAX_TILED_IMAGE_DIMENSION ** 2
+
+# Rows per strip when copying pixels to the sidecar.
+_STRIP_ROWS = 256
+# Upload bytes are hashed and size-checked this much at a time.
+_CHUNK_BYTES = 1024 * 1024
+
+# Last time each image's access was written to the index, to batch touches.
+_touched: Dict[str, float] = {}
+
 
 def _validate_dimensions(image: Image.Image) -> None:
-    if image.width > config.MAX_IMAGE_DIMENSION or image.height > config.MAX_IMAGE_DIMENSION:
+    limit = config.MAX_TILED_IMAGE_DIMENSION
+    if image.width > limit or image.height > limit:
         raise ValueError(
             f"Image dimensions too large ({image.width}x{image.height}), "
-            f"max {config.MAX_IMAGE_DIMENSION}px per side."
+            f"max {limit}px per side."
         )
 
 
-def _validate_size(content: bytes) -> None:
+def _hash_upload(source: BinaryIO) -> str:
+    """
+    SHA-256 of the upload, read in chunks so the size limit stops reading as
+    soon as it is exceeded. Leaves `source` rewound.
+    """
     max_bytes = config.MAX_IMAGE_SIZE_MB * 1024 * 1024
-    if len(content) > max_bytes:
-        raise ValueError(f"File exceeds max size of {config.MAX_IMAGE_SIZE_MB} MB.")
+    digest = hashlib.sha256()
+    size = 0
+    source.seek(0)
+    while chunk := source.read(_CHUNK_BYTES):
+        size += len(chunk)
+        if size > max_bytes:
+            raise ValueError(f"File exceeds max size of {config.MAX_IMAGE_SIZE_MB} MB.")
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
 
 
-def save_image(content: bytes) -> Tuple[str, int, int]:
-    """Save image bytes to disk and return (image_id, width, height)."""
-    _validate_size(content)
-    image = Image.open(io.BytesIO(content)).convert("RGB")
-    
+@metrics.timed("image_store.decode", size_arg=None)
+def decode_image(source: BinaryIO) -> Image.Image:
+    """
+    Decode an upload (or any image file) to upright RGB, once. Dimensions come
+    from the header (`Image.open` is lazy) and are checked before any pixel is
+    decoded, so oversized images and decompression bombs are rejected for the
+    price of a header read.
+    """
+    try:
+        image = Image.open(source)
+        _validate_dimensions(image)
+        image.load()
+    except UnidentifiedImageError as exc:
+        raise ValueError("Unsupported or invalid image file.") from exc
+    except Image.DecompressionBombError as exc:
+        raise ValueError(str(exc)) from exc
+    except OSError as exc:  # truncated or corrupt data
+        raise ValueError(f"Could not decode image: {exc}") from exc
+    if image.mode != "RGB":
+        image = image.convert("RGB")
     # Handle EXIF rotation
-    image = ImageOps.exif_transpose(image)
-    
-    _validate_dimensions(image)
+    ImageOps.exif_transpose(image, in_place=True)
+    return image
 
-    image_id = uuid.uuid4().hex
-    path = get_image_path(image_id)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    image.save(path, format="PNG")
-    return image_id, image.width, image.height
+
+def _level_size(width: int, height: int, level: int) -> Tuple[int, int]:
+    """Size of a pyramid level whose long side is `level` pixels."""
+    scale = level / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _save_png_atomic(image: Image.Image, path: Path) -> None:
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    image.save(tmp, format="PNG")
+    os.replace(tmp, path)
+
+
+def _save_pixels_atomic(image: Image.Image, path: Path) -> None:
+    """
+    Write the raw uint8 RGB sidecar that `load_pixels` memory-maps, a strip at a
+    time so large images are not copied whole.
+    """
+    image = image.convert("RGB")
+    width, height = image.size
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8, shape=(height, width, 3))
+    for top in range(0, height, _STRIP_ROWS):
+        bottom = min(top + _STRIP_ROWS, height)
+        out[top:bottom] = np.asarray(image.crop((0, top, width, bottom)))
+    out.flush()
+    del out
+    os.replace(tmp, path)
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+def _write_png_strips(path: Path, width: int, height: int, strips: Iterable[np.ndarray]) -> None:
+    """
+    Write an 8-bit RGB PNG from (rows, width, 3) uint8 strips, top to bottom,
+    without holding the whole image. Rows use the Sub filter.
+    """
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    compressor = zlib.compressobj(config.PNG_COMPRESS_LEVEL)
+    with open(tmp, "wb") as handle:
+        handle.write(b"\x89PNG\r\n\x1a\n")
+        handle.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        for strip in strips:
+            flat = strip.reshape(strip.shape[0], width * 3)
+            rows = np.empty((flat.shape[0], flat.shape[1] + 1), dtype=np.uint8)
+            rows[:, 0] = 1  # filter type Sub: byte minus the same channel one pixel left
+            rows[:, 1:4] = flat[:, :3]
+            np.subtract(flat[:, 3:], flat[:, :-3], out=rows[:, 4:])
+            data = compressor.compress(rows.tobytes())
+            if data:
+                handle.write(_png_chunk(b"IDAT", data))
+        handle.write(_png_chunk(b"IDAT", compressor.flush()))
+        handle.write(_png_chunk(b"IEND", b""))
+    os.replace(tmp, path)
+
+
+def root_id(variant: str) -> str:
+    """Image id a variant (pyramid level) belongs to."""
+    return variant.split("_L", 1)[0]
+
+
+def _sharded(directory: Path, variant: str, name: str) -> Path:
+    """
+    `directory/<first two hex digits of the image id>/name`, which keeps every
+    directory small. Files stored flat before sharding are still found.
+    """
+    path = directory / root_id(variant)[:2] / name
+    if not path.exists():
+        legacy = directory / name
+        if legacy.exists():
+            return legacy
+    return path
+
+
+def _track(variant: str, path: Path) -> None:
+    image_index.record_artifact(root_id(variant), variant, path)
+
+
+def _touch(variant: str) -> None:
+    """Record an access for eviction, at most once per ARTIFACT_TOUCH_INTERVAL_S per image."""
+    image_id = root_id(variant)
+    now = time.time()
+    if now - _touched.get(image_id, 0.0) < config.ARTIFACT_TOUCH_INTERVAL_S:
+        return
+    if len(_touched) > 100_000:
+        _touched.clear()
+    _touched[image_id] = now
+    image_index.touch([image_id], now)
+
+
+def forget_touches(image_id: str) -> None:
+    _touched.pop(image_id, None)
+
+
+@metrics.timed("image_store.save_variant", size_arg=None)
+def _save_variant(image_id: str, image: Image.Image) -> None:
+    for path, save in (
+        (get_image_path(image_id), _save_png_atomic),
+        (get_pixels_path(image_id), _save_pixels_atomic),
+    ):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        save(image, path)
+        _track(image_id, path)
+
+
+@metrics.timed("image_store.pyramid", size_arg=None)
+def _build_pyramid(image_id: str, image: Image.Image) -> List[int]:
+    """Persist downsampled copies for every configured level below the full size."""
+    levels = []
+    current = image
+    for level in sorted(config.PYRAMID_LEVELS, reverse=True):
+        if level >= max(image.size):
+            continue
+        # Each level is resampled from the next larger one, which is much
+        # cheaper than going back to the full-resolution image every time.
+        current = current.resize(
+            _level_size(image.width, image.height, level),
+            Image.Resampling.LANCZOS,
+            reducing_gap=2.0,
+        )
+        _save_variant(variant_id(image_id, level), current)
+        levels.append(level)
+    return sorted(levels)
+
+
+def variant_id(image_id: str, level: Optional[int]) -> str:
+    """Storage id of a pyramid level (the image id itself for full resolution)."""
+    return image_id if level is None else f"{image_id}_L{level}"
+
+
+def resolve_variant(image_id: str, level: Optional[int]) -> str:
+    """
+    Map (image_id, level) to the id of the stored variant. Levels at or above the
+    image's long side resolve to the full image; missing levels of images stored
+    before the pyramid existed are built on demand.
+    """
+    if level is None:
+        return image_id
+    _touch(image_id)
+    if level not in config.PYRAMID_LEVELS:
+        raise ValueError(f"Unknown level {level}, expected one of {list(config.PYRAMID_LEVELS)}.")
+    full_path = get_image_path(image_id)
+    if not full_path.exists():
+        raise FileNotFoundError(f"Image {image_id} not found.")
+
+    variant = variant_id(image_id, level)
+    path = get_image_path(variant)
+    if path.exists():
+        return variant
+    with Image.open(full_path) as image:
+        width, height = image.size
+        if level >= max(width, height):
+            return image_id
+        resized = image.convert("RGB").resize(
+            _level_size(width, height, level), Image.Resampling.LANCZOS, reducing_gap=2.0
+        )
+    _save_variant(variant, resized)
+    return variant
+
+
+@metrics.timed("image_store.pixel_hash", size_arg=None)
+def _pixel_hash(image: Image.Image) -> str:
+    """Content address of decoded RGB pixels, hashed a strip at a time."""
+    width, height = image.size
+    digest = hashlib.sha256(f"{width}x{height}:".encode())
+    for top in range(0, height, _STRIP_ROWS):
+        bottom = min(top + _STRIP_ROWS, height)
+        digest.update(np.asarray(image.crop((0, top, width, bottom))).tobytes())
+    # Same length as the uuid4 hex ids of images stored before content addressing.
+    return digest.hexdigest()[:32]
+
+
+def _stored(record: image_index.ImageRecord) -> bool:
+    return get_image_path(record.image_id).exists()
+
+
+def save_image(source: Union[bytes, BinaryIO]) -> Tuple[str, int, int, List[int], bool]:
+    """
+    Save an uploaded image (bytes or a seekable binary file) and its pyramid;
+    return (image_id, width, height, levels, existing). The id is a hash of the
+    decoded pixels, so uploading a picture that is already stored (`existing`)
+    returns its id without writing anything and every artifact derived from
+    that id is reused.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    upload_hash = _hash_upload(source)
+    record = image_index.lookup_upload(upload_hash)
+    if record is not None:
+        if _stored(record):
+            _touch(record.image_id)
+            return (*record, True)
+        image_index.forget_image(record.image_id)
+
+    image = decode_image(source)
+    image_id = _pixel_hash(image)
+    record = image_index.get_image(image_id)
+    if record is not None and _stored(record):
+        # Same pixels from different bytes (re-encoded, other metadata, ...).
+        image_index.record_image(record, upload_hash)
+        return (*record, True)
+
+    # Recorded before writing so every file is tracked as an artifact of it.
+    image_index.record_image(image_index.ImageRecord(image_id, image.width, image.height, []))
+    _save_variant(image_id, image)
+    levels = _build_pyramid(image_id, image)
+    record = image_index.ImageRecord(image_id, image.width, image.height, levels)
+    image_index.record_image(record, upload_hash)
+    return (*record, False)
 
 
 def get_image_path(image_id: str) -> Path:
-    return config.IMAGE_DIR / f"{image_id}.png"
+    return _sharded(config.IMAGE_DIR, image_id, f"{image_id}.png")
 
 
-def load_image(image_id: str) -> np.ndarray:
+def get_pixels_path(image_id: str) -> Path:
+    return _sharded(config.IMAGE_DIR, image_id, f"{image_id}.npy")
+
+
+def get_image_size(image_id: str) -> Tuple[int, int]:
+    """(width, height) read from the file header without decoding pixels."""
     path = get_image_path(image_id)
     if not path.exists():
         raise FileNotFoundError(f"Image {image_id} not found.")
-    image = Image.open(path).convert("RGB")
-    return np.asarray(image).astype(np.float32) / 255.0
+    _touch(image_id)
+    with Image.open(path) as image:
+        return image.size
+
+
+def is_oversized(image_id: str) -> bool:
+    """True if the stored variant exceeds MAX_IMAGE_DIMENSION and must be processed tiled."""
+    return max(get_image_size(image_id)) > config.MAX_IMAGE_DIMENSION
+
+
+def load_pixels(image_id: str) -> np.ndarray:
+    """
+    Read-only uint8 RGB pixels (H, W, 3), memory-mapped from the `.npy` sidecar.
+
+    Nothing is decoded or copied: pages are read on first touch and shared
+    through the OS page cache between workers. Images stored before sidecars
+    existed get one written from their PNG on first load.
+    """
+    path = get_pixels_path(image_id)
+    if not path.exists():
+        png_path = get_image_path(image_id)
+        if not png_path.exists():
+            raise FileNotFoundError(f"Image {image_id} not found.")
+        with Image.open(png_path) as image:
+            _save_pixels_atomic(image, path)
+        _track(image_id, path)
+    _touch(image_id)
+    return np.load(path, mmap_mode="r")
+
+
+@metrics.timed("image_store.load_image", size_arg=None)
+def load_image(image_id: str) -> np.ndarray:
+    """Float32 RGB copy in 0..1, for kernels that need floats."""
+    image = load_pixels(image_id).astype(np.float32)
+    image *= 1.0 / 255.0
+    return image
 
 
 def load_image_pil(image_id: str) -> Image.Image:
@@ -57,3 +347,36 @@ def load_image_pil(image_id: str) -> Image.Image:
     if not path.exists():
         raise FileNotFoundError(f"Image {image_id} not found.")
     return Image.open(path).convert("RGB")
+
+
+def _reconstruction_path(image_id: str, key: str) -> Path:
+    """
+    One file per reconstruction request: `key` (a request hash, see
+    jobs.request_key) keeps a finished result's URL pointing at its own pixels
+    after later edits of the same image.
+    """
+    tag = key.rsplit(":", 1)[-1][:16]
+    path = _sharded(config.RECON_DIR, image_id, f"{image_id}_{tag}_recon.png")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@metrics.timed("image_store.save_reconstruction", size_arg=1)
+def save_reconstruction(image_id: str, rgb: np.ndarray, key: str) -> str:
+    """Save a reconstructed RGB float image (0..1) under request `key` and return its URL path."""
+    path = _reconstruction_path(image_id, key)
+    data = (np.clip(rgb, 0.0, 1.0) * 255).astype(np.uint8)
+    _save_png_atomic(Image.fromarray(data), path)
+    _track(image_id, path)
+    return f"/{path.relative_to(config.BASE_DIR).as_posix()}"
+
+
+@metrics.timed("image_store.save_reconstruction", size_arg=None)
+def save_reconstruction_strips(
+    image_id: str, width: int, height: int, strips: Iterable[np.ndarray], key: str
+) -> str:
+    """Like `save_reconstruction`, from uint8 RGB row strips produced top to bottom."""
+    path = _reconstruction_path(image_id, key)
+    _write_png_strips(path, width, height, strips)
+    _track(image_id, path)
+    return f"/{path.relative_to(config.BASE_DIR).as_posix()}"
@@ -0,0 +1,186 @@
+"""
+In-process job subsystem with request coalescing.
+
+A job is identified by a key derived from its request (kind, image, options and
+a hash of the edit payload). Submitting a key that is already queued, running
+or finished within JOB_RESULT_TTL_S returns the existing job instead of
+computing again, so double-fired or retried requests share one computation and
+never race each other. Failed jobs are dropped from the key index right away so
+a retry recomputes.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from backend.models import config
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+TERMINAL_STATES = {JOB_DONE, JOB_FAILED}
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when MAX_PENDING_JOBS jobs are already waiting to run."""
+
+
+def request_key(kind: str, *parts: Any) -> str:
+    """Stable key of a request: JSON-able parts and raw bytes are hashed together."""
+    digest = hashlib.sha256(kind.encode())
+    for part in parts:
+        digest.update(b"\0")
+        if isinstance(part, (bytes, bytearray)):
+            digest.update(part)
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return f"{kind}:{digest.hexdigest()}"
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    kind: str
+    key: str
+    status: str = JOB_QUEUED
+    result: Any = None
+    error: Optional[BaseException] = None
+    created: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+    _subscribers: List[asyncio.Queue] = field(default_factory=list, repr=False)
+    _done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def _set_status(self, status: str) -> None:
+        self.status = status
+        if status in TERMINAL_STATES:
+            self.finished = time.monotonic()
+            self._done.set()
+        for queue in self._subscribers:
+            queue.put_nowait(status)
+
+    async def wait(self) -> Any:
+        """Result of the job; re-raises the exception it failed with."""
+        await self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of status changes, starting with the current status."""
+        queue: asyncio.Queue = asyncio.Queue()
+        queue.put_nowait(self.status)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with contextlib.suppress(ValueError):
+            self._subscribers.remove(queue)
+
+
+class JobManager:
+    """
+    Tracks jobs by id and by request key. Queued jobs run at most `concurrency`
+    at a time; inline jobs (synchronous endpoints that just want coalescing)
+    start immediately and rely on the worker pool's own limits.
+    """
+
+    def __init__(self, ttl_seconds: float, max_pending: int, concurrency: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, Job] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.coalesced = 0
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.ttl_seconds:
+                del self._jobs[job_id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge()
+        return self._jobs.get(job_id)
+
+    def submit(
+        self,
+        kind: str,
+        key: str,
+        run: Callable[[], Awaitable[Any]],
+        queued: bool = True,
+    ) -> Tuple[Job, bool]:
+        """Return (job, coalesced). `run` is only called if no job for `key` exists."""
+        self._purge()
+        existing = self._by_key.get(key)
+        if existing is not None:
+            self.coalesced += 1
+            return existing, True
+        if queued and self._pending() >= self.max_pending:
+            raise JobQueueFullError(f"{self.max_pending} jobs are already waiting.")
+
+        job = Job(id=uuid.uuid4().hex, kind=kind, key=key)
+        self._jobs[job.id] = job
+        self._by_key[key] = job
+        task = asyncio.create_task(self._run(job, run, queued))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job, False
+
+    def _pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == JOB_QUEUED)
+
+    async def _run(self, job: Job, run: Callable[[], Awaitable[Any]], queued: bool) -> None:
+        if queued and self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self._slots if queued else contextlib.nullcontext():
+                job._set_status(JOB_RUNNING)
+                job.result = await run()
+        except Exception as exc:
+            job.error = exc
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+            job._set_status(JOB_FAILED)
+        else:
+            job._set_status(JOB_DONE)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Jobs by status. Read-only (expired jobs are skipped, not purged), so
+        /metrics may call it from a pool thread while the event loop owns the jobs.
+        """
+        now = time.monotonic()
+        counts = {state: 0 for state in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+        for job in list(self._jobs.values()):
+            if job.finished is not None and now - job.finished > self.ttl_seconds:
+                continue
+            counts[job.status] += 1
+        return {**counts, "coalesced": self.coalesced}
+
+
+manager = JobManager(
+    ttl_seconds=config.JOB_RESULT_TTL_S,
+    max_pending=config.MAX_PENDING_JOBS,
+    concurrency=config.JOB_CONCURRENCY,
+)
+
+
+def submit(kind: str, key: str, run: Callable[[], Awaitable[Any]], queued: bool = True) -> Tuple[Job, bool]:
+    return manager.submit(kind, key, run, queued)
+
+
+def get(job_id: str) -> Optional[Job]:
+    return manager.get(job_id)
+
+
+def stats() -> Dict[str, int]:
+    return manager.stats()
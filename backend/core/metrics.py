@@ -0,0 +1,217 @@
+"""
+Lightweight timing instrumentation and Prometheus text exposition.
+
+Stages are timed with `span(name)` (context manager) or `@timed(name)`
+(decorator) and feed a latency histogram per stage plus a counter of the bytes
+they processed. Spans also append to the current request's timing list when
+one is active (see `collect`), which api/routes_metrics.py turns into a
+`Server-Timing` header. Worker threads see that list because the worker pool
+runs tasks in a copy of the caller's context.
+
+Metrics are per process; with several workers every process exposes its own.
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from backend.models import config
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# (stage, seconds) of the request being served, if any.
+_request_spans: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_spans", default=None
+)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set, Prometheus style."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # Per-bucket counts (last slot: +Inf), then sum and count.
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, ...], List[float]]:
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], value: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+stage_seconds = Histogram(config.METRICS_BUCKETS)
+stage_bytes = Counter()
+http_seconds = Histogram(config.METRICS_BUCKETS)
+
+
+def _nbytes(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return 0
+
+
+def record(name: str, seconds: float, nbytes: int = 0) -> None:
+    stage_seconds.observe((name,), seconds)
+    if nbytes:
+        stage_bytes.inc((name,), nbytes)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextlib.contextmanager
+def span(name: str, nbytes: int = 0) -> Iterator[None]:
+    """Time the enclosed block as stage `name`; `nbytes` is the data it processed."""
+    if not config.METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, nbytes)
+
+
+def timed(name: str, size_arg: Optional[int] = 0) -> Callable[[F], F]:
+    """
+    Decorator form of `span`. Bytes processed are those of the positional
+    argument `size_arg` (an array, bytes or str); None counts none.
+    """
+
+    def decorate(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not config.METRICS_ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                size = _nbytes(args[size_arg]) if size_arg is not None and len(args) > size_arg else 0
+                record(name, time.perf_counter() - start, size)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the spans recorded by the current request (and the work it awaits)."""
+    spans: List[Tuple[str, float]] = []
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+
+def server_timing(spans: List[Tuple[str, float]], total: float) -> str:
+    """`Server-Timing` value: stages summed by name, slowest first, then the total."""
+    totals: Dict[str, float] = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = sorted(totals.items(), key=lambda item: -item[1])[: config.SERVER_TIMING_MAX_ENTRIES]
+    parts = [f"{name};dur={seconds * 1e3:.2f}" for name, seconds in entries]
+    parts.append(f"total;dur={total * 1e3:.2f}")
+    return ", ".join(parts)
+
+
+def _number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _histogram_lines(
+    metric: str, help_text: str, histogram: Histogram, names: Tuple[str, ...]
+) -> List[str]:
+    lines = [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+    for labels, series in sorted(histogram.snapshot().items()):
+        cumulative = 0.0
+        for bound, count in zip(histogram.buckets + (float("inf"),), series):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            lines.append(f"{metric}_bucket{_labels(names, labels, le)} {_number(cumulative)}")
+        lines.append(f"{metric}_sum{_labels(names, labels)} {_number(series[-2])}")
+        lines.append(f"{metric}_count{_labels(names, labels)} {_number(series[-1])}")
+    return lines
+
+
+def _sample_lines(
+    metric: str, help_text: str, values: Dict[str, float], label: str, kind: str
+) -> List[str]:
+    lines = [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+    for key, value in sorted(values.items()):
+        lines.append(f'{metric}{{{label}="{_escape(key)}"}} {_number(value)}')
+    return lines
+
+
+def exposition(
+    gauges: Dict[str, Tuple[str, Dict[str, float], str]],
+    counters: Dict[str, Tuple[str, Dict[str, float], str]],
+) -> str:
+    """
+    Prometheus text format of all stage/HTTP metrics plus `gauges` and
+    `counters` (names ending in `_total`), both given as
+    metric name -> (help, {label value: number}, label name).
+    """
+    lines = _histogram_lines(
+        "gv_stage_seconds", "Duration of instrumented processing stages.", stage_seconds, ("stage",)
+    )
+    lines += ["# HELP gv_stage_bytes_total Bytes of input processed per stage.",
+              "# TYPE gv_stage_bytes_total counter"]
+    for labels, value in sorted(stage_bytes.snapshot().items()):
+        lines.append(f"gv_stage_bytes_total{_labels(('stage',), labels)} {_number(value)}")
+    lines += _histogram_lines(
+        "gv_http_request_seconds",
+        "HTTP request duration by route template, method and status.",
+        http_seconds,
+        ("route", "method", "status"),
+    )
+    for metric, (help_text, values, label) in gauges.items():
+        lines += _sample_lines(metric, help_text, values, label, "gauge")
+    for metric, (help_text, values, label) in counters.items():
+        lines += _sample_lines(metric, help_text, values, label, "counter")
+    return "\n".join(lines) + "\n"
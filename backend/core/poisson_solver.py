@@ -1,117 +1,304 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Protocol, Tuple
+
 import numpy as np
-from scipy.fft import dst, idst
+from scipy.fft import dstn, idstn
 
+from backend.core import metrics
+from backend.core.multigrid_solver import MultigridPoissonSolver
 from backend.models import config
 
 
-def _dst1(x: np.ndarray) -> np.ndarray:
-    """DST-I (Type 1) Discrete Sine Transform."""
-    # scipy.fft.dst with type=1
-    return dst(dst(x, type=1, norm="ortho", axis=0), type=1, norm="ortho", axis=1)
+class PoissonBackend(Protocol):
+    """
+    Solves laplacian(u) = f on a 2-D grid with zero Dirichlet boundary.
+
+    Backends advertise whether they accept a solve mask (unknowns outside are
+    fixed at zero), an initial guess ``x0`` for warm starts and a (C, h, w)
+    stack of independent right-hand sides solved in one call.
+    """
+
+    name: str
+    supports_mask: bool
+    supports_warm_start: bool
+    supports_batch: bool
+
+    def solve(
+        self,
+        f: np.ndarray,
+        out: np.ndarray | None = None,
+        x0: np.ndarray | None = None,
+        mask: np.ndarray | None = None,
+    ) -> np.ndarray:
+        ...
+
+
+class _WorkspacePool:
+    """Free-list of float32 buffers per shape, reused across solves and threads."""
+
+    def __init__(self, max_shapes: int, max_per_shape: int):
+        self.max_shapes = max_shapes
+        self.max_per_shape = max_per_shape
+        self._free: "OrderedDict[Tuple[int, ...], List[np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, shape: Tuple[int, ...]) -> np.ndarray:
+        with self._lock:
+            buffers = self._free.get(shape)
+            if buffers:
+                self._free.move_to_end(shape)
+                return buffers.pop()
+        return np.empty(shape, dtype=np.float32)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._free.clear()
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(buf.nbytes for buffers in self._free.values() for buf in buffers)
+
+    def release(self, buf: np.ndarray) -> None:
+        with self._lock:
+            buffers = self._free.setdefault(buf.shape, [])
+            self._free.move_to_end(buf.shape)
+            if len(buffers) < self.max_per_shape:
+                buffers.append(buf)
+            while len(self._free) > self.max_shapes:
+                self._free.popitem(last=False)
+
+
+class DSTPoissonSolver:
+    """
+    Direct solver for laplacian(u) = f with zero Dirichlet boundary using DST-I.
+
+    Everything that depends only on the grid shape is cached: the eigenvalues of
+    the 5-point Laplacian are kept as two separable 1-D vectors per (h, w) and
+    broadcast during the division, and the float32 work buffers are pooled and
+    transformed in place (``overwrite_x``). A solve then costs the forward and
+    inverse transform plus one pass over the spectrum. A (C, h, w) stack shares
+    the eigenvalue table and goes through a single (multi-threaded) transform
+    over the last two axes.
+    """
+
+    name = "dst"
+    supports_mask = False
+    supports_warm_start = False
+    supports_batch = True
+
+    # Rows divided per block so the broadcast denominator never spans the full frame.
+    _DIVIDE_BLOCK_ROWS = 256
+
+    def __init__(self, workers: int | None = None, max_cached_shapes: int = 8):
+        self.workers = workers
+        self.max_cached_shapes = max_cached_shapes
+        self._eigen: "OrderedDict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._workspaces = _WorkspacePool(max_cached_shapes, max_per_shape=2)
+
+    def eigenvalues(self, h: int, w: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (lam_y[:, None], lam_x[None, :]) whose sum is the 2-D spectrum."""
+        key = (h, w)
+        with self._lock:
+            cached = self._eigen.get(key)
+            if cached is not None:
+                self._eigen.move_to_end(key)
+                return cached
+        # Standard 5-point stencil eigenvalues for DST-I:
+        # lambda_ij = 2*cos(pi*i/(h+1)) + 2*cos(pi*j/(w+1)) - 4
+        # The small epsilon keeps the original guard against an exact zero.
+        lam_y = 2 * np.cos(np.pi * np.arange(1, h + 1) / (h + 1)) - 2
+        lam_x = 2 * np.cos(np.pi * np.arange(1, w + 1) / (w + 1)) - 2 - 1e-10
+        cached = (
+            lam_y.astype(np.float32)[:, None],
+            lam_x.astype(np.float32)[None, :],
+        )
+        with self._lock:
+            self._eigen[key] = cached
+            while len(self._eigen) > self.max_cached_shapes:
+                self._eigen.popitem(last=False)
+        return cached
+
+    @metrics.timed("poisson.dst_solve", size_arg=1)
+    def solve(
+        self,
+        f: np.ndarray,
+        out: np.ndarray | None = None,
+        x0: np.ndarray | None = None,
+        mask: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """
+        Solve for u given f, (h, w) or a (C, h, w) stack. Writes into ``out`` when
+        provided; ``x0`` is ignored.
+        """
+        if mask is not None:
+            raise ValueError("The DST solver only handles rectangular domains; use a masked backend.")
+        h, w = f.shape[-2:]
+        lam_y, lam_x = self.eigenvalues(h, w)
+        axes = (-2, -1)
 
+        # Solving in place (out is f) needs no work buffer: the transforms overwrite it.
+        in_place = out is f and f.dtype == np.float32 and f.flags.c_contiguous
+        work = f if in_place else self._workspaces.acquire(f.shape)
+        try:
+            if not in_place:
+                np.copyto(work, f, casting="same_kind")
+            spec = dstn(work, type=1, axes=axes, norm="ortho", workers=self.workers, overwrite_x=True)
+            for start in range(0, h, self._DIVIDE_BLOCK_ROWS):
+                stop = min(start + self._DIVIDE_BLOCK_ROWS, h)
+                block = spec[..., start:stop, :]
+                np.divide(block, lam_y[start:stop] + lam_x, out=block)
+            u = idstn(spec, type=1, axes=axes, norm="ortho", workers=self.workers, overwrite_x=True)
+            if out is None:
+                out = u.copy()
+            elif not np.shares_memory(out, u):
+                np.copyto(out, u, casting="same_kind")
+        finally:
+            if not in_place:
+                self._workspaces.release(work)
+        return out
 
-def _idst1(x: np.ndarray) -> np.ndarray:
-    """IDST-I (Type 1) Inverse Discrete Sine Transform."""
-    # Inverse of DST-I is DST-I itself (with ortho normalization)
-    return idst(idst(x, type=1, norm="ortho", axis=0), type=1, norm="ortho", axis=1)
 
+SOLVERS: Dict[str, PoissonBackend] = {
+    "dst": DSTPoissonSolver(workers=config.POISSON_FFT_WORKERS),
+    "multigrid": MultigridPoissonSolver(tol=config.POISSON_EPS),
+}
 
-def _solve_poisson_dst1(laplacian: np.ndarray) -> np.ndarray:
+
+# Right-hand sides of reconstruct_image_from_gradients, solved in place.
+_rhs_workspaces = _WorkspacePool(max_shapes=8, max_per_shape=2)
+
+
+def _pools() -> List[_WorkspacePool]:
+    return [_rhs_workspaces] + [
+        solver._workspaces for solver in SOLVERS.values() if isinstance(solver, DSTPoissonSolver)
+    ]
+
+
+def pooled_bytes() -> int:
+    """Bytes of float32 work buffers kept between solves (right-hand sides, DST work)."""
+    return sum(pool.nbytes() for pool in _pools())
+
+
+def clear_workspaces() -> None:
+    for pool in _pools():
+        pool.clear()
+
+
+def get_solver(name: str | None = None) -> PoissonBackend:
+    """Return the backend registered under `name` (default: config.POISSON_SOLVER)."""
+    key = name or config.POISSON_SOLVER
+    try:
+        return SOLVERS[key]
+    except KeyError:
+        raise ValueError(f"Unknown Poisson solver {key!r}, expected one of {sorted(SOLVERS)}")
+
+
+def residual_rhs(dx: np.ndarray, dy: np.ndarray, boundary: np.ndarray, out: np.ndarray) -> np.ndarray:
     """
-    Solve Poisson equation laplacian(u) = f with zero boundary conditions using DST-I.
-    The input `laplacian` is f.
+    div(G) - Lap(U) on the interior, written to `out` of shape (..., h - 2, w - 2).
+
+    With forward-difference gradients G = (dx, dy) the 5-point stencils are
+        div[y, x] = dx[y, x] - dx[y, x-1] + dy[y, x] - dy[y-1, x]
+        Lap[y, x] = U[y, x+1] + U[y, x-1] + U[y+1, x] + U[y-1, x] - 4 U[y, x]
+    Both are accumulated into `out` term by term, so no full-frame temporary
+    is allocated whatever the dtypes of the (possibly strided) inputs.
     """
-    h, w = laplacian.shape
-    
-    # Compute RHS in frequency domain using DST-I
-    rhs = _dst1(laplacian)
-
-    # Eigenvalues of the discrete Laplacian for DST-I
-    # For DST-I (boundary 0 at -1 and N), eigenvalues are:
-    # lambda_ij = 2*cos(pi*i/(N+1)) - 2  (simplification, standard form is -4*sin^2...)
-    
-    yy, xx = np.meshgrid(
-        np.arange(1, h + 1, dtype=np.float32),
-        np.arange(1, w + 1, dtype=np.float32),
-        indexing="ij",
-    )
-    
-    # Standard 5-point stencil eigenvalues for DST-I
-    denom = (
-        2 * np.cos(np.pi * xx / (w + 1))
-        + 2 * np.cos(np.pi * yy / (h + 1))
-        - 4
-    )
-    
-    # Avoid division by zero (should not happen for Dirichlet unless constant 0 mode exists? No, DST-I has no DC mode)
-    u_hat = rhs / (denom - 1e-10) # subtract small epsilon to avoid exact zero if any
-    
-    return _idst1(u_hat)
+    inner = (Ellipsis, slice(1, -1), slice(1, -1))
+    np.multiply(boundary[inner], 4.0, out=out, casting="same_kind")
+    for neighbour in (
+        boundary[..., 1:-1, 2:],
+        boundary[..., 1:-1, :-2],
+        boundary[..., 2:, 1:-1],
+        boundary[..., :-2, 1:-1],
+    ):
+        np.subtract(out, neighbour, out=out, casting="same_kind")
+    np.add(out, dx[inner], out=out, casting="same_kind")
+    np.subtract(out, dx[..., 1:-1, :-2], out=out, casting="same_kind")
+    np.add(out, dy[inner], out=out, casting="same_kind")
+    np.subtract(out, dy[..., :-2, 1:-1], out=out, casting="same_kind")
+    return out
 
 
+@metrics.timed("poisson.reconstruct")
 def reconstruct_image_from_gradients(
-    dx: np.ndarray, dy: np.ndarray, boundary_image: np.ndarray | None = None
+    dx: np.ndarray,
+    dy: np.ndarray,
+    boundary_image: np.ndarray | None = None,
+    solver: PoissonBackend | None = None,
+    initial_guess: np.ndarray | None = None,
+    mask: np.ndarray | None = None,
+    out: np.ndarray | None = None,
 ) -> np.ndarray:
     """
-    Reconstruct grayscale image from gradient fields using Residual method + DST-I.
-    
+    Reconstruct grayscale image from gradient fields using Residual method + DST-I
+    (or another registered backend).
+
     We solve: Laplacian(U) = div(G)
     Let U = U_orig + R
     Laplacian(R) = div(G) - Laplacian(U_orig)
     R = 0 on boundary (enforced by DST-I)
+
+    `initial_guess` is a previous reconstruction of U used to warm-start iterative
+    backends; `mask` (h, w) limits the solve to its True pixels, everything else
+    keeps the boundary image.
+
+    Multi-channel: with (C, h, w) gradient stacks (e.g. one per RGB channel) the
+    boundary image, initial guess and result are (C, h, w) too. Batched backends
+    solve all channels in one call; others are called once per channel.
+
+    The result is written to `out` when given (float32, the shape of dx; it may
+    be the boundary image itself). Besides `out` a call allocates one pooled
+    interior-sized buffer, which holds the right-hand side and is solved in place.
     """
-    h, w = dx.shape
-    
-    # 1. Compute divergence of the target gradient field G
-    # Div(G) = dx/dx + dy/dy (forward/backward differences to match Laplacian stencil)
-    # Use central differences for interior? Standard approach is consistent differences.
-    # Let's use the standard discrete divergence matching the 5-point Laplacian.
-    # div[y, x] = (dx[y, x] - dx[y, x-1]) + (dy[y, x] - dy[y-1, x])
-    
-    div = np.zeros((h, w), dtype=np.float32)
-    div[:, 1:-1] += dx[:, 1:-1] - dx[:, :-2]
-    div[1:-1, :] += dy[1:-1, :] - dy[:-2, :]
-    
-    # 2. Prepare boundary image
-    boundary_gray = np.zeros((h, w), dtype=np.float32)
-    if boundary_image is not None:
-        if boundary_image.ndim == 3:
-            boundary_gray = (
-                0.299 * boundary_image[..., 0]
-                + 0.587 * boundary_image[..., 1]
-                + 0.114 * boundary_image[..., 2]
-            )
-        else:
-            boundary_gray = boundary_image.astype(np.float32)
-            
-    # 3. Compute Laplacian of the original image (U_orig)
-    # Lap(U) = U[y, x+1] + U[y, x-1] + U[y+1, x] + U[y-1, x] - 4*U[y, x]
-    # We compute this only for the interior points
-    lap_orig = np.zeros((h, w), dtype=np.float32)
-    lap_orig[1:-1, 1:-1] = (
-        boundary_gray[1:-1, 2:] + boundary_gray[1:-1, :-2] +
-        boundary_gray[2:, 1:-1] + boundary_gray[:-2, 1:-1] -
-        4 * boundary_gray[1:-1, 1:-1]
-    )
-    
-    # 4. Compute Laplacian of the residual R
-    # Lap(R) = Div(G) - Lap(U_orig)
-    # Note: We only care about the interior for the solver.
-    f = div - lap_orig
-    
-    # 5. Extract interior of f for DST-I
-    # DST-I solves for interior points of a grid with zero boundary.
-    # Grid size for DST-I should be (h-2) x (w-2)
+    solver = solver or get_solver()
+    stacked = dx.ndim == 3
+    h, w = dx.shape[-2:]
+
+    if boundary_image is None:
+        boundary = np.zeros(dx.shape, dtype=np.float32)
+    elif boundary_image.ndim == 3 and not stacked:
+        boundary = (
+            0.299 * boundary_image[..., 0]
+            + 0.587 * boundary_image[..., 1]
+            + 0.114 * boundary_image[..., 2]
+        ).astype(np.float32)
+    else:
+        boundary = boundary_image
+    if out is None:
+        out = np.empty(dx.shape, dtype=np.float32)
+
+    # DST-I solves for the interior of a grid with zero boundary: (h-2) x (w-2).
     if h <= 2 or w <= 2:
-        return boundary_gray # Too small to reconstruct interior
-        
-    f_interior = f[1:-1, 1:-1]
-    
-    # 6. Solve for R_interior
-    r_interior = _solve_poisson_dst1(f_interior)
-    
-    # 7. Reconstruct U
-    result = boundary_gray.copy()
-    result[1:-1, 1:-1] += r_interior
-    
-    return np.clip(result, 0.0, 1.0)
+        np.copyto(out, boundary, casting="same_kind")
+        return out  # Too small to reconstruct interior
+
+    inner = (Ellipsis, slice(1, -1), slice(1, -1))
+    f_interior = _rhs_workspaces.acquire(dx.shape[:-2] + (h - 2, w - 2))
+    try:
+        residual_rhs(dx, dy, boundary, f_interior)
+        x0 = None
+        if initial_guess is not None and solver.supports_warm_start:
+            x0 = initial_guess[inner] - boundary[inner]
+        interior_mask = None if mask is None else mask[1:-1, 1:-1]
+
+        # Solve for R_interior in place: the right-hand side is not needed afterwards.
+        if stacked and not solver.supports_batch:
+            for c in range(f_interior.shape[0]):
+                solver.solve(
+                    f_interior[c],
+                    out=f_interior[c],
+                    x0=None if x0 is None else x0[c],
+                    mask=interior_mask,
+                )
+        else:
+            solver.solve(f_interior, out=f_interior, x0=x0, mask=interior_mask)
+
+        # U = U_orig + R; the border keeps the boundary image.
+        if out is not boundary:
+            np.copyto(out, boundary, casting="same_kind")
+        out[inner] += f_interior
+    finally:
+        _rhs_workspaces.release(f_interior)
+    return np.clip(out, 0.0, 1.0, out=out)
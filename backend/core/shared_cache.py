@@ -0,0 +1,427 @@
+"""
+Cross-process cache of derived arrays in POSIX shared memory.
+
+With several uvicorn workers (or WORKER_PROCESSES) a per-process cache holds
+every YCrCb image and gradient field once per process, and a user whose
+requests land on another worker misses it. Entries here are computed once,
+copied into a `multiprocessing.shared_memory` segment and then mapped
+read-only, without copying, by every process that asks for them. Raw pixels
+do not need this: their `.npy` sidecars are memory-mapped and already shared
+through the page cache.
+
+A small SQLite index next to the image index maps each key to its segment,
+the (shape, dtype, offset) of its arrays, its size and last access, and holds
+one reference row per process that has it mapped. Keys are
+"<image id>:<kind>"; image ids are content addresses, so an entry never goes
+stale and only has to be dropped when its image is deleted.
+
+- Eviction keeps the segments under SHARED_CACHE_MAX_MB, least recently used
+  first and unreferenced entries before referenced ones. Unlinking a segment
+  that is still mapped is safe: its memory is released when the last process
+  unmaps it.
+- Each process keeps at most SHARED_CACHE_LOCAL_ENTRIES segments mapped and
+  serves them without touching the index. A housekeeping thread per process
+  runs every SHARED_CACHE_RECHECK_S: it unmaps entries that other processes
+  evicted or invalidated (so unlinked segments are released within that
+  period, even by idle workers) and writes the batched last-access times.
+- Crashed workers: their reference rows are dropped by a periodic sweep
+  (SHARED_CACHE_SWEEP_S), which also unlinks segments that a worker created
+  but never indexed.
+- Segments are not handed to multiprocessing's resource tracker, which would
+  otherwise unlink them when the process that created or attached them exits.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from backend.models import config
+
+try:
+    import _posixshmem
+except ImportError:  # Windows: no named POSIX segments to share or unlink
+    _posixshmem = None
+
+logger = logging.getLogger(__name__)
+
+CacheValue = Union[np.ndarray, Tuple[np.ndarray, ...]]
+
+_SHM_DIR = Path("/dev/shm")
+_ALIGN = 64
+# Segments created but not indexed for this long are treated as leaked.
+_ORPHAN_AGE_S = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    layout TEXT NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+CREATE TABLE IF NOT EXISTS refs (
+    key TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    PRIMARY KEY (key, pid)
+);
+"""
+
+
+def _layout(arrays: Tuple[np.ndarray, ...]) -> Tuple[List[Tuple[List[int], str, int]], int]:
+    """(shape, dtype, offset) per array, each aligned to _ALIGN bytes, and the total size."""
+    layout, offset = [], 0
+    for arr in arrays:
+        layout.append((list(arr.shape), arr.dtype.str, offset))
+        offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+    return layout, max(offset, 1)
+
+
+def _views(buffer: memoryview, layout, is_tuple: bool) -> CacheValue:
+    arrays = []
+    for shape, dtype, offset in layout:
+        arr = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+        arr.setflags(write=False)
+        arrays.append(arr)
+    return tuple(arrays) if is_tuple else arrays[0]
+
+
+def _unlink(segment: str) -> None:
+    try:
+        _posixshmem.shm_unlink("/" + segment)
+    except FileNotFoundError:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Mapping:
+    """One segment mapped into this process."""
+
+    def __init__(self, segment: str, value: CacheValue, shm: shared_memory.SharedMemory):
+        self.segment = segment
+        self.value = value
+        self.shm = shm
+
+
+class SharedArrayCache:
+    def __init__(self, index_path: Path, max_bytes: int, local_entries: int, prefix: str):
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.local_entries = local_entries
+        self.prefix = prefix
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = 0
+        self._housekeeper_pid = 0
+        self._mapped: "OrderedDict[str, _Mapping]" = OrderedDict()
+        # Mappings dropped while callers still held views; closed once they are gone.
+        self._closing: List[shared_memory.SharedMemory] = []
+        # Last-access times of mapped entries, written by `housekeeping`.
+        self._accessed: Dict[str, float] = {}
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """The process's index connection, as one transaction; callers hold the lock."""
+        if self._conn is None or self._conn_pid != os.getpid():  # first use, or forked
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_SCHEMA)
+            self._conn, self._conn_pid = conn, os.getpid()
+        with self._conn:
+            yield self._conn
+
+    # -- mapping ---------------------------------------------------------
+
+    def _attach(self, segment: str, create_size: int = 0) -> shared_memory.SharedMemory:
+        shm = shared_memory.SharedMemory(name=segment, create=create_size > 0, size=create_size)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    def _close(self, shm: shared_memory.SharedMemory) -> bool:
+        try:
+            shm.close()
+            return True
+        except BufferError:  # a caller still holds views into it
+            return False
+
+    def _drop_mapping(self, key: str, conn: sqlite3.Connection) -> None:
+        mapping = self._mapped.pop(key, None)
+        if mapping is None:
+            return
+        conn.execute("DELETE FROM refs WHERE key = ? AND pid = ?", (key, os.getpid()))
+        mapping.value = None
+        if not self._close(mapping.shm):
+            self._closing.append(mapping.shm)
+
+    def _remember(self, key: str, mapping: _Mapping, conn: sqlite3.Connection) -> None:
+        self._mapped[key] = mapping
+        self._mapped.move_to_end(key)
+        conn.execute("INSERT OR IGNORE INTO refs (key, pid) VALUES (?, ?)", (key, os.getpid()))
+        while len(self._mapped) > self.local_entries:
+            self._drop_mapping(next(iter(self._mapped)), conn)
+        self._closing = [shm for shm in self._closing if not self._close(shm)]
+
+    # -- public API ------------------------------------------------------
+
+    def get(self, key: str) -> Optional[CacheValue]:
+        with self._lock:
+            self._accessed[key] = time.time()
+            mapping = self._mapped.get(key)
+            if mapping is not None:
+                self._mapped.move_to_end(key)
+                self.hits += 1
+                return mapping.value
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT segment, layout FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self._accessed.pop(key, None)
+                    self.misses += 1
+                    return None
+                segment, layout = row
+                try:
+                    shm = self._attach(segment)
+                except FileNotFoundError:  # lost (e.g. reboot); forget it
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    conn.execute("DELETE FROM refs WHERE key = ?", (key,))
+                    self._accessed.pop(key, None)
+                    self.misses += 1
+                    return None
+                meta = json.loads(layout)
+                value = _views(shm.buf, meta["arrays"], meta["tuple"])
+                self._remember(key, _Mapping(segment, value, shm), conn)
+                self.hits += 1
+                return value
+
+    def put(self, key: str, value: CacheValue) -> CacheValue:
+        """Share `value` under `key`; returns read-only views of the shared copy."""
+        is_tuple = isinstance(value, tuple)
+        arrays = value if is_tuple else (value,)
+        layout, size = _layout(arrays)
+        if size > self.max_bytes or not self._has_room(size):
+            return value
+
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        segment = f"{self.prefix}{digest}_{uuid.uuid4().hex[:8]}"
+        shm = self._attach(segment, create_size=size)
+        for arr, (_, _, offset) in zip(arrays, layout):
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, offset=offset)[...] = arr
+        shared = _views(shm.buf, layout, is_tuple)
+
+        with self._lock, self._connect() as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO entries (key, segment, layout, nbytes, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, segment, json.dumps({"arrays": layout, "tuple": is_tuple}), size, time.time()),
+            ).rowcount
+            if not inserted:
+                # Another process shared it first; keep our copy private.
+                del shared
+                _unlink(segment)
+                self._close(shm)
+                return value
+            self._drop_mapping(key, conn)
+            self._remember(key, _Mapping(segment, shared, shm), conn)
+            self._evict(conn)
+        return shared
+
+    def get_or_compute(
+        self, key: str, compute: Callable[[], CacheValue], store: bool = True
+    ) -> CacheValue:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if store:
+                value = self.put(key, value)
+        return value
+
+    def invalidate(self, image_id: str) -> None:
+        """Drop every entry of `image_id` (keys "<image id>:<kind>")."""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                # ";" sorts right after ":", so this is every "<image id>:..." key.
+                "SELECT key, segment FROM entries WHERE key >= ? AND key < ?",
+                (f"{image_id}:", f"{image_id};"),
+            ).fetchall()
+            for key, segment in rows:
+                self._remove(conn, key, segment)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock, self._connect() as conn:
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM entries"
+            ).fetchone()
+            return {
+                "entries": entries,
+                "bytes": size,
+                "maxBytes": self.max_bytes,
+                "mapped": len(self._mapped),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    # -- housekeeping ----------------------------------------------------
+
+    def _has_room(self, size: int) -> bool:
+        """Writing past a full tmpfs kills the process with SIGBUS, so check first."""
+        try:
+            stat = os.statvfs(_SHM_DIR)
+        except OSError:
+            return True
+        return stat.f_bavail * stat.f_frsize > 2 * size
+
+    def _remove(self, conn: sqlite3.Connection, key: str, segment: str) -> None:
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        conn.execute("DELETE FROM refs WHERE key = ?", (key,))
+        self._drop_mapping(key, conn)
+        _unlink(segment)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute(
+            "SELECT e.key, e.segment, e.nbytes FROM entries e "
+            "ORDER BY (SELECT COUNT(*) FROM refs r WHERE r.key = e.key) > 0, e.last_access"
+        ).fetchall()
+        for key, segment, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._remove(conn, key, segment)
+            total -= size
+            self.evictions += 1
+
+    def housekeeping(self) -> None:
+        """
+        Write the batched last-access times and unmap entries that are no longer
+        indexed under the segment mapped here, i.e. were evicted, invalidated or
+        replaced by another process. Runs every SHARED_CACHE_RECHECK_S.
+        """
+        with self._lock, self._connect() as conn:
+            if self._accessed:
+                conn.executemany(
+                    "UPDATE entries SET last_access = ? WHERE key = ?",
+                    [(when, key) for key, when in self._accessed.items()],
+                )
+                self._accessed.clear()
+            if self._mapped:
+                # Removing an entry also removes its refs, so this lists what is still valid.
+                indexed = dict(
+                    conn.execute(
+                        "SELECT e.key, e.segment FROM refs r JOIN entries e ON e.key = r.key "
+                        "WHERE r.pid = ?",
+                        (os.getpid(),),
+                    )
+                )
+                for key, mapping in list(self._mapped.items()):
+                    if indexed.get(key) != mapping.segment:
+                        self._drop_mapping(key, conn)
+            self._closing = [shm for shm in self._closing if not self._close(shm)]
+        self._maybe_sweep()
+
+    def start_housekeeping(self) -> None:
+        """Start this process's housekeeping thread (once per process, also after a fork)."""
+        with self._lock:
+            if self._housekeeper_pid == os.getpid():
+                return
+            self._housekeeper_pid = os.getpid()
+        threading.Thread(target=self._housekeeping_loop, name="shared-cache", daemon=True).start()
+
+    def _housekeeping_loop(self) -> None:
+        while True:
+            time.sleep(config.SHARED_CACHE_RECHECK_S)
+            try:
+                self.housekeeping()
+            except Exception:
+                logger.exception("Shared cache housekeeping failed")
+
+    def _maybe_sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep >= config.SHARED_CACHE_SWEEP_S:
+            self._last_sweep = now
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Shared cache sweep failed")
+
+    def sweep(self) -> None:
+        """Drop references of dead processes and unlink leaked segments."""
+        with self._lock, self._connect() as conn:
+            pids = [pid for (pid,) in conn.execute("SELECT DISTINCT pid FROM refs")]
+            dead = [pid for pid in pids if not _pid_alive(pid)]
+            conn.executemany("DELETE FROM refs WHERE pid = ?", [(pid,) for pid in dead])
+            if not _SHM_DIR.is_dir():
+                return
+            indexed = {segment for (segment,) in conn.execute("SELECT segment FROM entries")}
+            cutoff = time.time() - _ORPHAN_AGE_S
+            for path in _SHM_DIR.glob(f"{self.prefix}*"):
+                try:
+                    if path.name not in indexed and path.stat().st_mtime < cutoff:
+                        _unlink(path.name)
+                except FileNotFoundError:
+                    continue
+
+
+def _segment_prefix() -> str:
+    """Per-installation prefix, so two deployments on one host never share segments."""
+    return f"gv{hashlib.sha1(str(config.DATA_DIR).encode()).hexdigest()[:8]}_"
+
+
+_cache: Optional[SharedArrayCache] = None
+
+
+def enabled() -> bool:
+    return config.SHARED_CACHE_ENABLED and _posixshmem is not None
+
+
+def _instance() -> SharedArrayCache:
+    global _cache
+    if _cache is None:
+        _cache = SharedArrayCache(
+            index_path=config.SHARED_CACHE_INDEX_PATH,
+            max_bytes=config.SHARED_CACHE_MAX_MB * 1024 * 1024,
+            local_entries=config.SHARED_CACHE_LOCAL_ENTRIES,
+            prefix=_segment_prefix(),
+        )
+    _cache.start_housekeeping()
+    return _cache
+
+
+def get_or_compute(key: str, compute: Callable[[], CacheValue], store: bool = True) -> CacheValue:
+    return _instance().get_or_compute(key, compute, store)
+
+
+def invalidate(image_id: str) -> None:
+    if enabled():
+        _instance().invalidate(image_id)
+
+
+def stats() -> Dict[str, int]:
+    return _instance().stats() if enabled() else {}
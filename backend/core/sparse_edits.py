@@ -0,0 +1,196 @@
+"""
+Compact binary encoding of sparse gradient edits.
+
+A payload describes the non-zero part of one delta field (dx or dy) in the same
+units as the decoded edit PNGs, i.e. values in [-1, 1] before DELTA_SCALE.
+All integers are little-endian:
+
+    magic     4s   b"GVE1"
+    encoding  u8   0 = COO, 1 = RLE rows
+    dtype     u8   0 = int8 (value = q / 127), 1 = float16
+    flags     u16  bit 0: body is zlib-compressed
+    height    u32
+    width     u32
+    count     u32  COO: number of entries, RLE: number of runs
+    body           COO: u32 flat indices[count], values[count]
+                   RLE: (u32 row, u32 col, u32 length)[count], values[sum(length)]
+"""
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from backend.models import config
+
+MAGIC = b"GVE1"
+ENCODING_COO = 0
+ENCODING_RLE = 1
+DTYPE_INT8 = 0
+DTYPE_FLOAT16 = 1
+FLAG_ZLIB = 1
+
+_HEADER = struct.Struct("<4sBBHIII")
+_VALUE_DTYPES = {DTYPE_INT8: np.dtype("<i1"), DTYPE_FLOAT16: np.dtype("<f2")}
+INT8_SCALE = 127.0
+
+
+@dataclass
+class SparseDelta:
+    """Sparse delta field: flat row-major indices with float32 values."""
+
+    shape: Tuple[int, int]
+    indices: np.ndarray  # int64, flat row-major
+    values: np.ndarray  # float32 in [-1, 1]
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.indices // self.shape[1]
+
+    @property
+    def cols(self) -> np.ndarray:
+        return self.indices % self.shape[1]
+
+    def bounding_box(self, margin: int) -> Optional[Tuple[slice, slice]]:
+        """Padded bounding box of the edited pixels, or None for an empty delta."""
+        if self.indices.size == 0:
+            return None
+        h, w = self.shape
+        rows, cols = self.rows, self.cols
+        return (
+            slice(max(int(rows.min()) - margin, 0), min(int(rows.max()) + margin + 1, h)),
+            slice(max(int(cols.min()) - margin, 0), min(int(cols.max()) + margin + 1, w)),
+        )
+
+    def mask_in(self, window: Tuple[slice, slice], out: np.ndarray) -> np.ndarray:
+        """Mark edited pixels that fall inside `window` in the window-sized bool array `out`."""
+        rows, cols = self._local_coords(window, out.shape)
+        out[rows, cols] = True
+        return out
+
+    def add_to(self, region: np.ndarray, window: Tuple[slice, slice], scale: float) -> np.ndarray:
+        """In place: region += scale * delta for the entries inside `window`."""
+        rows, cols, values = self._local_coords(window, region.shape, with_values=True)
+        np.add.at(region, (rows, cols), values * scale)
+        return region
+
+    def _local_coords(self, window, region_shape, with_values=False):
+        y0 = window[0].start or 0
+        x0 = window[1].start or 0
+        rows = self.rows - y0
+        cols = self.cols - x0
+        inside = (rows >= 0) & (rows < region_shape[0]) & (cols >= 0) & (cols < region_shape[1])
+        if with_values:
+            return rows[inside], cols[inside], self.values[inside]
+        return rows[inside], cols[inside]
+
+
+def _dequantize(raw: np.ndarray, dtype_code: int) -> np.ndarray:
+    if dtype_code == DTYPE_INT8:
+        return raw.astype(np.float32) / INT8_SCALE
+    return raw.astype(np.float32)
+
+
+def decode_sparse_delta(payload: bytes, shape: Optional[Tuple[int, int]] = None) -> SparseDelta:
+    """
+    Parse a binary sparse edit payload, which must be of `shape` (H, W) when
+    given. Raises ValueError on malformed input. The header is validated before
+    anything is inflated, so its fields cannot make a small payload expand.
+    """
+    if len(payload) < _HEADER.size:
+        raise ValueError("Sparse edit payload is shorter than its header.")
+    magic, encoding, dtype_code, flags, height, width, count = _HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError("Sparse edit payload has an unknown magic number.")
+    if dtype_code not in _VALUE_DTYPES:
+        raise ValueError(f"Unknown sparse edit value type {dtype_code}.")
+    value_dtype = _VALUE_DTYPES[dtype_code]
+
+    max_side = config.MAX_TILED_IMAGE_DIMENSION
+    if height > max_side or width > max_side:
+        raise ValueError(f"Sparse edit of {height}x{width} exceeds {max_side}px per side.")
+    if shape is not None and (height, width) != tuple(shape):
+        raise ValueError(
+            f"Sparse edit of {height}x{width} does not match image dimensions {shape[0]}x{shape[1]}."
+        )
+    total = height * width
+    if count > total:
+        raise ValueError("Sparse edit has more entries than pixels.")
+    body = payload[_HEADER.size :]
+    if flags & FLAG_ZLIB:
+        # Bound the inflated size by the largest body the validated shape allows
+        # (COO: 4 + itemsize bytes per entry; RLE: 12 per run plus one value per pixel).
+        max_body = 12 * count + value_dtype.itemsize * total
+        inflater = zlib.decompressobj()
+        body = inflater.decompress(body, max_body + 1)
+        if len(body) > max_body or inflater.unconsumed_tail:
+            raise ValueError("Compressed sparse edit payload is larger than its header allows.")
+
+    if encoding == ENCODING_COO:
+        index_bytes = 4 * count
+        if len(body) != index_bytes + value_dtype.itemsize * count:
+            raise ValueError("COO payload size does not match its entry count.")
+        indices = np.frombuffer(body, dtype="<u4", count=count).astype(np.int64)
+        raw = np.frombuffer(body, dtype=value_dtype, count=count, offset=index_bytes)
+    elif encoding == ENCODING_RLE:
+        run_bytes = 12 * count
+        if len(body) < run_bytes:
+            raise ValueError("RLE payload is shorter than its run table.")
+        runs = np.frombuffer(body, dtype="<u4", count=3 * count).reshape(count, 3).astype(np.int64)
+        row, col, length = runs[:, 0], runs[:, 1], runs[:, 2]
+        if np.any(col + length > width):
+            raise ValueError("RLE run exceeds the row width.")
+        n_values = int(length.sum())
+        if len(body) != run_bytes + value_dtype.itemsize * n_values:
+            raise ValueError("RLE payload size does not match its run lengths.")
+        # Expand runs to flat indices: start of each run plus offset within it.
+        starts = np.repeat(row * width + col, length)
+        offsets = np.arange(n_values) - np.repeat(np.cumsum(length) - length, length)
+        indices = starts + offsets
+        raw = np.frombuffer(body, dtype=value_dtype, count=n_values, offset=run_bytes)
+    else:
+        raise ValueError(f"Unknown sparse edit encoding {encoding}.")
+
+    if indices.size and int(indices.max()) >= total:
+        raise ValueError("Sparse edit index lies outside the declared shape.")
+    values = _dequantize(raw, dtype_code)
+    if not np.all(np.isfinite(values)):
+        raise ValueError("Sparse edit values must be finite.")
+    return SparseDelta((height, width), indices, values)
+
+
+def encode_sparse_delta(
+    delta: np.ndarray,
+    encoding: int = ENCODING_RLE,
+    dtype_code: int = DTYPE_INT8,
+    compress: bool = True,
+) -> bytes:
+    """Encode the non-zero entries of a dense delta field (reference client / tests)."""
+    height, width = delta.shape
+    if dtype_code == DTYPE_INT8:
+        quantized = np.clip(np.round(delta * INT8_SCALE), -127, 127).astype("<i1")
+    else:
+        quantized = delta.astype("<f2")
+    flat = quantized.ravel()
+    indices = np.flatnonzero(flat)
+
+    if encoding == ENCODING_COO:
+        count = indices.size
+        body = indices.astype("<u4").tobytes() + flat[indices].tobytes()
+    else:
+        # Split the sorted indices into runs of consecutive pixels within a row.
+        rows = indices // width
+        breaks = np.flatnonzero((np.diff(indices) != 1) | (np.diff(rows) != 0)) + 1
+        starts = np.concatenate(([0], breaks)) if indices.size else np.empty(0, np.int64)
+        lengths = np.diff(np.concatenate((starts, [indices.size])))
+        first = indices[starts]
+        runs = np.stack([first // width, first % width, lengths], axis=1).astype("<u4")
+        count = runs.shape[0]
+        body = runs.tobytes() + flat[indices].tobytes()
+
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= FLAG_ZLIB
+    return _HEADER.pack(MAGIC, encoding, dtype_code, flags, height, width, count) + body
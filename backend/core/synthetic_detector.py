@@ -1,48 +1,209 @@
-from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
 from PIL import Image
 
-from backend.models import config
+from backend.core import metrics
 from backend.core.gradient_ops import gradient_magnitude
+from backend.models import config
 
 
-def _normalize_heatmap(data: np.ndarray) -> np.ndarray:
-    max_val = np.max(data) + 1e-6
+def _normalize_heatmap(data: np.ndarray, max_val: Optional[float] = None) -> np.ndarray:
+    """Scale each (H, W) slice of `data` by its own maximum (or `max_val`) to uint8."""
+    if max_val is None:
+        max_val = data.max(axis=(-2, -1), keepdims=True)
+    max_val = max_val + 1e-6
     norm = np.clip(data / max_val, 0, 1)
     return (norm * 255).astype(np.uint8)
 
 
-def analyze_gradients(dx: np.ndarray, dy: np.ndarray) -> Tuple[Dict[str, float], np.ndarray]:
+def _laplacian_stack(data: np.ndarray) -> np.ndarray:
+    """
+    cv2.Laplacian (ksize=1, BORDER_REFLECT_101) over the last two axes of an
+    (N, H, W) stack in one pass; numpy's "reflect" padding is REFLECT_101.
+    """
+    padded = np.pad(data, ((0, 0), (1, 1), (1, 1)), mode="reflect")
+    lap = padded[:, :-2, 1:-1] + padded[:, 2:, 1:-1]
+    lap += padded[:, 1:-1, :-2]
+    lap += padded[:, 1:-1, 2:]
+    lap -= 4.0 * data
+    return lap
+
+
+@metrics.timed("synthetic_detector.analyze")
+def analyze_gradient_stack(
+    dx: np.ndarray, dy: np.ndarray, heatmaps: bool = True
+) -> Tuple[List[Dict[str, float]], Optional[np.ndarray]]:
+    """
+    Score a stack of same-sized gradient fields (N, H, W) at once.
+    Returns one scores dict per image and the (N, H, W) uint8 heatmaps, or
+    None when `heatmaps` is False.
+    """
     mag = gradient_magnitude(dx, dy)
-    lap = cv2.Laplacian(mag, cv2.CV_32F)
+    lap = _laplacian_stack(mag) if mag.shape[-2] > 1 and mag.shape[-1] > 1 else np.zeros_like(mag)
+    axes = (1, 2)
 
-    std_mag = float(np.std(mag))
-    edge_consistency = float(np.clip(1.0 - np.tanh(std_mag * 0.5), 0.0, 1.0))
+    edge, smooth, texture = scores_from_stats(
+        std_mag=np.std(mag, axis=axes),
+        var_lap=np.var(lap, axis=axes),
+        mean_abs_lap=np.mean(np.abs(lap), axis=axes),
+        max_mag=np.max(mag, axis=axes),
+    )
+    scores = [
+        {
+            "edgeConsistency": float(e),
+            "smoothnessScore": float(s),
+            "textureWeirdness": float(t),
+        }
+        for e, s, t in zip(edge, smooth, texture)
+    ]
+    if not heatmaps:
+        return scores, None
+    return scores, np.stack([compute_heatmap(dx[i], dy[i]) for i in range(len(dx))])
 
-    var_lap = float(np.var(lap))
-    smoothness_score = float(np.clip(1.0 / (1.0 + var_lap), 0.0, 1.0))
 
-    texture_raw = float(np.mean(np.abs(lap)))
-    texture_weirdness = float(np.clip(texture_raw / (np.max(mag) + 1e-6), 0.0, 1.0))
+def scores_from_stats(std_mag, var_lap, mean_abs_lap, max_mag):
+    """
+    Map the magnitude / Laplacian statistics to (edgeConsistency,
+    smoothnessScore, textureWeirdness). Works on scalars or arrays, so full-frame,
+    stacked and tiled analysis share the formulas.
+    """
+    edge_consistency = np.clip(1.0 - np.tanh(std_mag * 0.5), 0.0, 1.0)
+    smoothness_score = np.clip(1.0 / (1.0 + var_lap), 0.0, 1.0)
+    texture_weirdness = np.clip(mean_abs_lap / (max_mag + 1e-6), 0.0, 1.0)
+    return edge_consistency, smoothness_score, texture_weirdness
 
-    scores = {
-        "edgeConsistency": edge_consistency,
-        "smoothnessScore": smoothness_score,
-        "textureWeirdness": texture_weirdness,
-    }
-    heatmap = _normalize_heatmap(mag)
-    return scores, heatmap
 
+def analyze_gradients(
+    dx: np.ndarray, dy: np.ndarray, heatmap: bool = True
+) -> Tuple[Dict[str, float], Optional[np.ndarray]]:
+    """Scores of one gradient field and its heatmap (None when `heatmap` is False)."""
+    scores, heatmaps = analyze_gradient_stack(dx[np.newaxis], dy[np.newaxis], heatmaps=heatmap)
+    return scores[0], None if heatmaps is None else heatmaps[0]
 
-def save_heatmap(image_id: str, heatmap: np.ndarray) -> str:
-    """Save heatmap as colorized PNG and return URL path."""
-    colored = cv2.applyColorMap(heatmap, cv2.COLORMAP_INFERNO)
-    path = config.ANALYSIS_DIR / f"{image_id}_heatmap.png"
-    path.parent.mkdir(parents=True, exist_ok=True)
-    Image.fromarray(colored[..., ::-1]).save(path, format="PNG")  # convert BGR to RGB
-    relative = path.relative_to(config.BASE_DIR)
-    return f"/{relative.as_posix()}"
 
+def _block_sums(data: np.ndarray, step: int) -> np.ndarray:
+    """float64 sums of float32 `data` over step x step blocks; the last row / column of blocks may be partial."""
+    pad_h, pad_w = -data.shape[0] % step, -data.shape[1] % step
+    if pad_h or pad_w:
+        data = np.pad(data, ((0, pad_h), (0, pad_w)))
+    height, width = data.shape
+    # INTER_AREA at an integer factor is an exact block mean, several times faster than numpy.
+    means = cv2.resize(data, (width // step, height // step), interpolation=cv2.INTER_AREA)
+    return means.astype(np.float64) * (step * step)
+
+
+def _summed_area(blocks: np.ndarray) -> np.ndarray:
+    """Summed-area table with a leading row and column of zeros: sat[y, x] = blocks[:y, :x].sum()."""
+    sat = np.zeros((blocks.shape[0] + 1, blocks.shape[1] + 1))
+    np.cumsum(np.cumsum(blocks, axis=0), axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def _window_sums(sat: np.ndarray, size: int) -> np.ndarray:
+    """
+    Sum over the size x size window (in blocks) centred on every block, clipped
+    at the borders. Four lookups per window, whatever its size.
+    """
+    h, w = sat.shape[0] - 1, sat.shape[1] - 1
+    y0 = np.arange(h) - size // 2
+    x0 = np.arange(w) - size // 2
+    y1, x1 = np.clip(y0 + size, 0, h), np.clip(x0 + size, 0, w)
+    y0, x0 = np.clip(y0, 0, h), np.clip(x0, 0, w)
+    return sat[np.ix_(y1, x1)] - sat[np.ix_(y0, x1)] - sat[np.ix_(y1, x0)] + sat[np.ix_(y0, x0)]
+
+
+def local_score_maps(
+    dx: np.ndarray,
+    dy: np.ndarray,
+    windows: Optional[Tuple[int, ...]] = None,
+    step: Optional[int] = None,
+    max_mag: Optional[float] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Per-region detector scores of one gradient field.
+
+    The statistics behind the global scores (std of the magnitude, variance
+    and mean absolute value of its Laplacian) are summed over step x step
+    blocks and turned into summed-area tables, so the statistics of any window
+    of blocks cost O(1). They are evaluated on a window centred on every block,
+    for each size in `windows` (pixels, rounded to whole blocks). The scores of
+    the different window sizes are averaged. Returns one float map of shape
+    (ceil(H / step), ceil(W / step)) per score name. Texture is relative to the
+    image's strongest gradient (or `max_mag` when only part of the image is
+    given), so region scores are comparable within an image.
+    """
+    windows = windows or config.DETECTOR_WINDOWS
+    step = step or config.DETECTOR_BLOCK_SIZE
+    mag = gradient_magnitude(dx, dy)
+    if min(mag.shape) > 1:
+        lap = cv2.Laplacian(mag, cv2.CV_32F, ksize=1)
+    else:
+        lap = np.zeros_like(mag)
+
+    height, width = mag.shape
+    rows = np.minimum(step, height - np.arange(0, height, step))
+    cols = np.minimum(step, width - np.arange(0, width, step))
+    counts = _summed_area(np.outer(rows, cols).astype(np.float64))
+    mag_sums = _summed_area(_block_sums(mag, step))
+    mag_squares = _summed_area(_block_sums(np.square(mag), step))
+    lap_sums = _summed_area(_block_sums(lap, step))
+    lap_squares = _summed_area(_block_sums(np.square(lap), step))
+    np.abs(lap, out=lap)
+    abs_lap_sums = _summed_area(_block_sums(lap, step))
+    if max_mag is None:
+        max_mag = float(mag.max())
+
+    totals = 0.0
+    sizes = sorted({max(1, round(window / step)) for window in windows})
+    for size in sizes:
+        area = _window_sums(counts, size)
+
+        def mean(sat: np.ndarray) -> np.ndarray:
+            return _window_sums(sat, size) / area
+
+        mag_mean, lap_mean = mean(mag_sums), mean(lap_sums)
+        # E[x^2] - E[x]^2 can dip below zero by rounding on flat regions.
+        std_mag = np.sqrt(np.maximum(mean(mag_squares) - mag_mean**2, 0.0))
+        var_lap = np.maximum(mean(lap_squares) - lap_mean**2, 0.0)
+        totals = totals + np.stack(scores_from_stats(std_mag, var_lap, mean(abs_lap_sums), max_mag))
+    names = ("edgeConsistency", "smoothnessScore", "textureWeirdness")
+    return dict(zip(names, (totals / len(sizes)).astype(np.float32)))
+
+
+def local_score(dx: np.ndarray, dy: np.ndarray, max_mag: Optional[float] = None) -> np.ndarray:
+    """Mean of the three `local_score_maps`, one value per block."""
+    maps = local_score_maps(dx, dy, max_mag=max_mag)
+    return sum(maps.values()) / len(maps)
+
+
+def heatmap_pixels(score: np.ndarray, low: float, high: float, shape: Tuple[int, int]) -> np.ndarray:
+    """
+    uint8 heatmap of `shape` (H, W) from a block `local_score`, with low..high
+    stretched to 0..255. Blocks are upsampled by exactly DETECTOR_BLOCK_SIZE
+    and cropped, so every pixel samples the same place of the block grid
+    whether the field is a whole image or a block-aligned part of it.
+    """
+    stretched = _normalize_heatmap(np.clip(score - low, 0.0, None)[np.newaxis], high - low)[0]
+    step = config.DETECTOR_BLOCK_SIZE
+    size = (stretched.shape[1] * step, stretched.shape[0] * step)
+    height, width = shape
+    return cv2.resize(stretched, size, interpolation=cv2.INTER_LINEAR)[:height, :width]
+
+
+@metrics.timed("synthetic_detector.heatmap")
+def compute_heatmap(dx: np.ndarray, dy: np.ndarray) -> np.ndarray:
+    """
+    uint8 (H, W) heatmap of one gradient field: the mean of its local scores
+    (see `local_score_maps`), stretched to the image's own range.
+    """
+    score = local_score(dx, dy)
+    return heatmap_pixels(score, float(score.min()), float(score.max()), dx.shape)
+
+
+@metrics.timed("synthetic_detector.colorize")
+def colorize_heatmap(heatmap: np.ndarray) -> Image.Image:
+    """Colorize a uint8 heatmap with the inferno colormap."""
+    colored = cv2.applyColorMap(heatmap, cv2.COLORMAP_INFERNO)
+    return Image.fromarray(colored[..., ::-1])  # convert BGR to RGB
@@ -0,0 +1,269 @@
+"""
+Out-of-core processing for images larger than MAX_IMAGE_DIMENSION.
+
+Every kernel reads TILE_SIZE tiles (plus a halo) from the memory-mapped pixel
+sidecar, so working memory depends on the tile size and not on the image:
+
+- `analyze` accumulates the detector statistics tile by tile. A halo of two
+  pixels covers the Sobel and Laplacian stencils, so the result matches the
+  full-frame computation up to floating-point summation order.
+- `reconstruct` solves the Poisson problem by two-level overlapping domain
+  decomposition. The correction an edit causes is global but smooth away from
+  the edit, so it is first solved on a coarse grid no larger than one tile and
+  interpolated; multiplicative Schwarz sweeps then re-solve the tiles around the
+  edits at full resolution (current estimate as Dirichlet boundary), queueing
+  neighbours whose overlap changed. The estimate lives in a scratch memmap and
+  the output PNG is streamed in strips.
+"""
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import cv2
+import numpy as np
+
+from backend.core import gradient_ops, image_store, poisson_solver
+from backend.core.gradient_ops import gradient_magnitude
+from backend.core.poisson_solver import PoissonBackend
+from backend.core.sparse_edits import SparseDelta
+from backend.core.synthetic_detector import scores_from_stats
+from backend.models import config
+
+# Sobel (1 px) followed by the Laplacian of the magnitude (1 px).
+ANALYSIS_HALO = 2
+
+
+@dataclass(frozen=True)
+class Tile:
+    """A tile's own pixels (`core`) and the halo-padded region it is computed on."""
+
+    core: Tuple[slice, slice]
+    padded: Tuple[slice, slice]
+
+    @property
+    def inner(self) -> Tuple[slice, slice]:
+        """`core` relative to `padded`."""
+        return tuple(
+            slice(c.start - p.start, c.stop - p.start) for c, p in zip(self.core, self.padded)
+        )
+
+
+def iter_tiles(height: int, width: int, size: int, halo: int) -> Iterator[Tile]:
+    """Row-major tiles covering the image, padded by `halo` and clipped to it."""
+    for top in range(0, height, size):
+        bottom = min(top + size, height)
+        for left in range(0, width, size):
+            right = min(left + size, width)
+            yield Tile(
+                core=(slice(top, bottom), slice(left, right)),
+                padded=(
+                    slice(max(top - halo, 0), min(bottom + halo, height)),
+                    slice(max(left - halo, 0), min(right + halo, width)),
+                ),
+            )
+
+
+def _overlap(a: Tuple[slice, slice], b: Tuple[slice, slice]) -> Optional[Tuple[slice, slice]]:
+    rows = slice(max(a[0].start, b[0].start), min(a[0].stop, b[0].stop))
+    cols = slice(max(a[1].start, b[1].start), min(a[1].stop, b[1].stop))
+    if rows.start >= rows.stop or cols.start >= cols.stop:
+        return None
+    return rows, cols
+
+
+def _relative(region: Tuple[slice, slice], origin: Tuple[slice, slice]) -> Tuple[slice, slice]:
+    return tuple(slice(r.start - o.start, r.stop - o.start) for r, o in zip(region, origin))
+
+
+def _ycrcb(pixels: np.ndarray) -> np.ndarray:
+    rgb = pixels.astype(np.float32)
+    rgb *= 1.0 / 255.0
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2YCrCb, dst=rgb)
+
+
+def analyze(image_id: str) -> Dict[str, float]:
+    """Detector scores of an oversized image, as `synthetic_detector.analyze_gradients`."""
+    return analyze_pixels(image_store.load_pixels(image_id))
+
+
+def analyze_pixels(pixels: np.ndarray) -> Dict[str, float]:
+    """`analyze` of uint8 RGB pixels (H, W, 3), e.g. a memory map or a decoded file."""
+    height, width = pixels.shape[:2]
+    count = 0
+    sum_mag = sum_mag2 = 0.0
+    sum_lap = sum_lap2 = sum_abs_lap = 0.0
+    max_mag = 0.0
+    for tile in iter_tiles(height, width, config.TILE_SIZE, ANALYSIS_HALO):
+        dx, dy = gradient_ops.compute_gradients(np.ascontiguousarray(pixels[tile.padded]))
+        mag = gradient_magnitude(dx, dy)
+        lap = cv2.Laplacian(mag, cv2.CV_32F)
+        mag, lap = mag[tile.inner], lap[tile.inner]
+
+        count += mag.size
+        sum_mag += float(mag.sum(dtype=np.float64))
+        sum_mag2 += float(np.square(mag, dtype=np.float64).sum())
+        sum_lap += float(lap.sum(dtype=np.float64))
+        sum_lap2 += float(np.square(lap, dtype=np.float64).sum())
+        sum_abs_lap += float(np.abs(lap).sum(dtype=np.float64))
+        max_mag = max(max_mag, float(mag.max()))
+
+    mean_mag = sum_mag / count
+    mean_lap = sum_lap / count
+    edge, smooth, texture = scores_from_stats(
+        std_mag=np.sqrt(max(sum_mag2 / count - mean_mag**2, 0.0)),
+        var_lap=max(sum_lap2 / count - mean_lap**2, 0.0),
+        mean_abs_lap=sum_abs_lap / count,
+        max_mag=max_mag,
+    )
+    return {
+        "edgeConsistency": float(edge),
+        "smoothnessScore": float(smooth),
+        "textureWeirdness": float(texture),
+    }
+
+
+def _touches(delta: SparseDelta, region: Tuple[slice, slice]) -> bool:
+    rows, cols = delta.rows, delta.cols
+    return bool(
+        np.any(
+            (rows >= region[0].start)
+            & (rows < region[0].stop)
+            & (cols >= region[1].start)
+            & (cols < region[1].stop)
+        )
+    )
+
+
+def _solve_tile(
+    pixels: np.ndarray,
+    current: np.ndarray,
+    tile: Tile,
+    deltas: Sequence[Optional[SparseDelta]],
+    solver: PoissonBackend,
+) -> np.ndarray:
+    """Re-solve one padded tile against the current estimate; returns the absolute change."""
+    y_orig = _ycrcb(pixels[tile.padded])[:, :, 0]
+    fields = gradient_ops.compute_forward_gradients(y_orig)
+    for field, delta in zip(fields, deltas):
+        if delta is not None:
+            delta.add_to(field, tile.padded, config.EDIT_DELTA_SCALE)
+
+    boundary = np.array(current[tile.padded])
+    solved = poisson_solver.reconstruct_image_from_gradients(
+        *fields, boundary_image=boundary, solver=solver, initial_guess=boundary
+    )
+    current[tile.padded] = solved
+    np.subtract(solved, boundary, out=solved)
+    return np.abs(solved, out=solved)
+
+
+def _coarse_correction(
+    deltas: Sequence[Optional[SparseDelta]], shape: Tuple[int, int]
+) -> Tuple[np.ndarray, int]:
+    """
+    Solve lap(R) = div(scaled edits) on a grid coarsened by `factor` so it fits
+    one tile. The unedited image reproduces itself exactly (residual method), so
+    R is all an edit changes. Returns (coarse R, factor).
+    """
+    height, width = shape
+    factor = max(1, -(-max(height, width) // config.TILE_SIZE))
+    rhs = np.zeros((-(-height // factor), -(-width // factor)), dtype=np.float32)
+    for delta, step in zip(deltas, ((0, 1), (1, 0))):
+        if delta is None:
+            continue
+        # A forward-gradient edit enters the divergence with + at its pixel and
+        # - at the next one; block sums restrict it to the coarse grid (whose
+        # spacing-`factor` Laplacian absorbs the factor**2).
+        values = delta.values * config.EDIT_DELTA_SCALE
+        rows, cols = delta.rows, delta.cols
+        np.add.at(rhs, (rows // factor, cols // factor), values)
+        rows, cols = rows + step[0], cols + step[1]
+        inside = (rows < height) & (cols < width)
+        np.add.at(rhs, (rows[inside] // factor, cols[inside] // factor), -values[inside])
+    return poisson_solver.get_solver("dst").solve(rhs), factor
+
+
+def _interpolate(coarse: np.ndarray, factor: int, region: Tuple[slice, slice]) -> np.ndarray:
+    """Bilinear interpolation of a coarse field (cell centres) onto a fine region."""
+
+    def weights(positions: range, size: int):
+        coords = np.clip((np.asarray(positions) + 0.5) / factor - 0.5, 0, size - 1)
+        low = np.minimum(coords.astype(np.int64), max(size - 2, 0))
+        frac = (coords - low).astype(np.float32)
+        return low, np.minimum(low + 1, size - 1), frac
+
+    r0, r1, fr = weights(range(region[0].start, region[0].stop), coarse.shape[0])
+    c0, c1, fc = weights(range(region[1].start, region[1].stop), coarse.shape[1])
+    rows = coarse[r0] * (1 - fr)[:, None] + coarse[r1] * fr[:, None]
+    return rows[:, c0] * (1 - fc) + rows[:, c1] * fc
+
+
+def _strips(pixels: np.ndarray, current: np.ndarray) -> Iterator[np.ndarray]:
+    """RGB uint8 row strips of the original chroma merged with the reconstructed Y."""
+    height, width = current.shape
+    rows = max(1, config.TILE_SIZE * config.TILE_SIZE // width)
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        ycrcb = _ycrcb(pixels[top:bottom])
+        ycrcb[:, :, 0] = current[top:bottom]
+        rgb = cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2RGB, dst=ycrcb)
+        np.clip(rgb, 0.0, 1.0, out=rgb)
+        rgb *= 255.0
+        yield rgb.astype(np.uint8)
+
+
+def reconstruct(
+    image_id: str,
+    deltas: Sequence[Optional[SparseDelta]],
+    solver: PoissonBackend,
+    key: str,
+) -> str:
+    """
+    Reconstruct the Y channel of an oversized image from sparse (dx, dy) edits
+    and store the result under request `key` like `image_store.save_reconstruction`.
+    Returns its URL.
+    """
+    pixels = image_store.load_pixels(image_id)
+    height, width = pixels.shape[:2]
+    tiles: List[Tile] = list(iter_tiles(height, width, config.TILE_SIZE, config.TILE_RECON_HALO))
+    edits = [d for d in deltas if d is not None and d.indices.size]
+
+    with tempfile.TemporaryDirectory(prefix="tiled-recon-") as scratch:
+        current = np.lib.format.open_memmap(
+            Path(scratch) / "y.npy", mode="w+", dtype=np.float32, shape=(height, width)
+        )
+        # Start from the original Y plus the interpolated coarse correction; away
+        # from the edits that is already accurate and those tiles are never solved.
+        coarse, factor = _coarse_correction(deltas, (height, width))
+        for tile in iter_tiles(height, width, config.TILE_SIZE, 0):
+            current[tile.core] = _ycrcb(pixels[tile.core])[:, :, 0] + _interpolate(
+                coarse, factor, tile.core
+            )
+
+        pending: Set[int] = {
+            i for i, tile in enumerate(tiles) if any(_touches(d, tile.padded) for d in edits)
+        }
+        for _ in range(config.TILED_RECON_MAX_SWEEPS):
+            if not pending:
+                break
+            queued: Set[int] = set()
+            for i in sorted(pending):
+                change = _solve_tile(pixels, current, tiles[i], deltas, solver)
+                if float(change.max(initial=0.0)) <= config.TILED_RECON_TOL:
+                    continue
+                # A neighbour must be re-solved if this solve moved values it sees.
+                for j, other in enumerate(tiles):
+                    if j == i:
+                        continue
+                    shared = _overlap(tiles[i].padded, other.padded)
+                    if shared is None:
+                        continue
+                    moved = change[_relative(shared, tiles[i].padded)]
+                    if float(moved.max()) > config.TILED_RECON_TOL:
+                        queued.add(j)
+            pending = queued
+
+        return image_store.save_reconstruction_strips(
+            image_id, width, height, _strips(pixels, current), key
+        )
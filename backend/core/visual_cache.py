@@ -0,0 +1,119 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+from PIL import Image
+
+from backend.core import metrics
+from backend.models import config
+
+VISUAL_FORMATS = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+@dataclass(frozen=True)
+class EncodedVisual:
+    data: bytes
+    media_type: str
+    etag: str
+
+
+def visual_etag(variant: str, name: str, fmt: str) -> str:
+    """
+    Strong ETag of a derived visual. Stored images never change under an id, so
+    the tag depends only on what is rendered and how, and can be checked without
+    loading or encoding anything. Bump VISUAL_VERSION when rendering changes.
+    """
+    key = f"{config.VISUAL_VERSION}:{variant}:{name}:{fmt}:{config.PNG_COMPRESS_LEVEL}:{config.PREVIEW_QUALITY}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+@metrics.timed("visual_cache.encode", size_arg=None)
+def encode_image(image: Image.Image, fmt: str) -> bytes:
+    """Encode with the fast settings used for all derived visuals."""
+    buffer = io.BytesIO()
+    if fmt == "png":
+        image.save(buffer, format="PNG", compress_level=config.PNG_COMPRESS_LEVEL)
+    elif fmt == "webp":
+        image.save(buffer, format="WEBP", quality=config.PREVIEW_QUALITY, method=0)
+    elif fmt == "jpeg":
+        image.convert("RGB").save(buffer, format="JPEG", quality=config.PREVIEW_QUALITY)
+    else:
+        raise ValueError(f"Unknown visual format {fmt!r}, expected one of {sorted(VISUAL_FORMATS)}.")
+    return buffer.getvalue()
+
+
+class _EncodedLRU:
+    """Thread-safe LRU of encoded visuals bounded by total byte size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, EncodedVisual]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag: str) -> EncodedVisual | None:
+        with self._lock:
+            visual = self._entries.get(etag)
+            if visual is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(etag)
+            self.hits += 1
+            return visual
+
+    def put(self, visual: EncodedVisual) -> None:
+        size = len(visual.data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(visual.etag, None)
+            if old is not None:
+                self._bytes -= len(old.data)
+            self._entries[visual.etag] = visual
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.data)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_cache = _EncodedLRU(config.VISUAL_CACHE_MAX_MB * 1024 * 1024)
+
+
+def get_or_render(
+    variant: str, name: str, fmt: str, render: Callable[[], Image.Image]
+) -> EncodedVisual:
+    """Return the encoded visual, rendering and encoding it at most once while cached."""
+    if fmt not in VISUAL_FORMATS:
+        raise ValueError(f"Unknown visual format {fmt!r}, expected one of {sorted(VISUAL_FORMATS)}.")
+    etag = visual_etag(variant, name, fmt)
+    visual = _cache.get(etag)
+    if visual is None:
+        visual = EncodedVisual(encode_image(render(), fmt), VISUAL_FORMATS[fmt], etag)
+        _cache.put(visual)
+    return visual
+
+
+def stats() -> Dict[str, int]:
+    return _cache.stats()
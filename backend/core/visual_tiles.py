@@ -0,0 +1,214 @@
+"""
+Deep-zoom tiles of the gradient (dx, dy, mag) and heatmap visuals.
+
+Zoom `max_zoom` is the full-resolution image and every zoom below halves it,
+down to zoom 0 which fits in one VISUAL_TILE_SIZE tile. A tile is computed
+from the smallest stored variant (pyramid level or the full image) at least as
+large as its zoom: only the tile plus a halo is read from the variant's
+memory-mapped pixels and resampled to the zoom, so a tile costs the same
+whatever the size of the image. The halo covers the Sobel stencil and, for
+heatmaps, the Laplacian and the detector windows, so tiles match the
+full-frame computation away from the image border.
+
+Resampling maps every zoom pixel to the same source position whatever the
+window it is computed in (an aligned integer box filter, then bilinear for the
+remaining factor below 2), and all tiles of an image share one normalisation,
+taken from its largest in-memory level. Neighbouring tiles and zooms therefore
+line up without seams; zooms finer than that level may saturate on the
+sharpest edges.
+"""
+import math
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from backend.core import gradient_cache, gradient_ops, image_store, metrics, synthetic_detector
+from backend.models import config
+
+TILE_VISUALS = ("dx", "dy", "mag", "heatmap")
+# Per-image normalisations kept in memory (a few floats each).
+_MAX_REFERENCES = 1024
+
+
+class TileGrid(NamedTuple):
+    width: int
+    height: int
+    max_zoom: int
+
+    def size(self, zoom: int) -> Tuple[int, int]:
+        """(width, height) of the image at `zoom`."""
+        factor = 1 << (self.max_zoom - zoom)
+        return -(-self.width // factor), -(-self.height // factor)
+
+    def tiles(self, zoom: int) -> Tuple[int, int]:
+        """Number of (columns, rows) of tiles at `zoom`."""
+        width, height = self.size(zoom)
+        tile = config.VISUAL_TILE_SIZE
+        return -(-width // tile), -(-height // tile)
+
+
+class _Reference(NamedTuple):
+    """Normalisation shared by all tiles of one image."""
+
+    max_dx: float
+    max_dy: float
+    max_mag: float
+    score_low: float
+    score_high: float
+
+
+_references: "OrderedDict[str, _Reference]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def grid(image_id: str) -> TileGrid:
+    """Tile pyramid of an image; raises FileNotFoundError like image_store."""
+    width, height = image_store.get_image_size(image_id)
+    long_side = max(width, height)
+    max_zoom = max(0, math.ceil(math.log2(long_side / config.VISUAL_TILE_SIZE)))
+    return TileGrid(width, height, max_zoom)
+
+
+def _reference(image_id: str) -> _Reference:
+    with _lock:
+        cached = _references.get(image_id)
+        if cached is not None:
+            _references.move_to_end(image_id)
+            return cached
+    # The largest pyramid level, or the image itself when it is smaller; its
+    # Sobel gradients are usually cached already for the full-frame visuals.
+    variant = image_store.resolve_variant(image_id, max(config.PYRAMID_LEVELS))
+    dx, dy = gradient_cache.get_sobel_gradients(variant)
+    score = synthetic_detector.local_score(dx, dy)
+    reference = _Reference(
+        max_dx=float(np.abs(dx).max()),
+        max_dy=float(np.abs(dy).max()),
+        max_mag=float(gradient_ops.gradient_magnitude(dx, dy).max()),
+        score_low=float(score.min()),
+        score_high=float(score.max()),
+    )
+    with _lock:
+        _references[image_id] = reference
+        while len(_references) > _MAX_REFERENCES:
+            _references.popitem(last=False)
+    return reference
+
+
+def forget(image_id: str) -> None:
+    with _lock:
+        _references.pop(image_id, None)
+
+
+def _source(image_id: str, tiles: TileGrid, zoom: int) -> str:
+    """Smallest stored variant at least as large as `zoom`."""
+    long_side = max(tiles.size(zoom))
+    for level in sorted(config.PYRAMID_LEVELS):
+        if long_side <= level < max(tiles.width, tiles.height):
+            return image_store.resolve_variant(image_id, level)
+    return image_id
+
+
+def _halo(name: str) -> int:
+    """Context around a tile, in zoom pixels; whole detector blocks keep their grid aligned."""
+    if name != "heatmap":
+        return 1  # Sobel
+    block = config.DETECTOR_BLOCK_SIZE
+    widest = max(max(1, round(window / block)) for window in config.DETECTOR_WINDOWS)
+    # Half the widest window, plus one block whose stencils see past the halo.
+    return (widest // 2 + 1) * block
+
+
+def _axis_window(start: int, stop: int, scale: float, size: int) -> Tuple[int, int]:
+    """Source rows (or columns) that zoom pixels start..stop interpolate from."""
+    first = math.floor((start + 0.5) * scale - 0.5)
+    last = math.ceil((stop - 0.5) * scale - 0.5)
+    return max(first - 1, 0), min(last + 2, size)
+
+
+def _resample_gray(
+    pixels: np.ndarray, rows: Tuple[int, int], cols: Tuple[int, int], zoom_size: Tuple[int, int]
+) -> np.ndarray:
+    """
+    float32 gray values in 0..255 of zoom pixels rows x cols, from uint8 RGB
+    `pixels` at least as large as the zoom (`zoom_size` is (width, height)).
+    """
+    src_height, src_width = pixels.shape[:2]
+    scale_y, scale_x = src_height / zoom_size[1], src_width / zoom_size[0]
+    if scale_y == 1.0 and scale_x == 1.0:
+        region = np.ascontiguousarray(pixels[rows[0] : rows[1], cols[0] : cols[1]])
+        return cv2.cvtColor(region, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+    # Integer box prefilter over a grid aligned to the whole image, then
+    # bilinear for the remaining factor (1 to 2); both map global coordinates.
+    box = max(1, int(min(scale_y, scale_x)))
+    boxed_height, boxed_width = src_height // box, src_width // box
+    scale_y, scale_x = boxed_height / zoom_size[1], boxed_width / zoom_size[0]
+    top, bottom = _axis_window(rows[0], rows[1], scale_y, boxed_height)
+    left, right = _axis_window(cols[0], cols[1], scale_x, boxed_width)
+    region = np.ascontiguousarray(pixels[top * box : bottom * box, left * box : right * box])
+    gray = cv2.cvtColor(region, cv2.COLOR_RGB2GRAY).astype(np.float32)
+    if box > 1:
+        gray = gray.reshape(bottom - top, box, right - left, box).mean(axis=(1, 3), dtype=np.float32)
+
+    # Destination pixel (j, i) of the window samples boxed pixel
+    # ((cols[0] + j + 0.5) * scale_x - 0.5 - left, (rows[0] + i + 0.5) * scale_y - 0.5 - top).
+    transform = np.array(
+        [
+            [scale_x, 0.0, (cols[0] + 0.5) * scale_x - 0.5 - left],
+            [0.0, scale_y, (rows[0] + 0.5) * scale_y - 0.5 - top],
+        ]
+    )
+    return cv2.warpAffine(
+        gray,
+        transform,
+        (cols[1] - cols[0], rows[1] - rows[0]),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_REFLECT_101,
+    )
+
+
+@metrics.timed("visual_tiles.render", size_arg=None)
+def render_tile(image_id: str, name: str, zoom: int, x: int, y: int) -> Image.Image:
+    """
+    Tile (x, y) of visual `name` at `zoom`. Raises ValueError for unknown
+    visuals and tiles outside the grid, FileNotFoundError for unknown images.
+    """
+    if name not in TILE_VISUALS:
+        raise ValueError(f"Unknown visual {name!r}, expected one of {list(TILE_VISUALS)}.")
+    tiles = grid(image_id)
+    columns, rows = tiles.tiles(zoom) if 0 <= zoom <= tiles.max_zoom else (0, 0)
+    if not (0 <= x < columns and 0 <= y < rows):
+        raise ValueError(f"No tile {zoom}/{x}/{y}; zoom 0 to {tiles.max_zoom}.")
+
+    width, height = tiles.size(zoom)
+    tile, halo = config.VISUAL_TILE_SIZE, _halo(name)
+    core: List[Tuple[int, int]] = [
+        (y * tile, min((y + 1) * tile, height)),
+        (x * tile, min((x + 1) * tile, width)),
+    ]
+    padded = [
+        (max(core[0][0] - halo, 0), min(core[0][1] + halo, height)),
+        (max(core[1][0] - halo, 0), min(core[1][1] + halo, width)),
+    ]
+    pixels = image_store.load_pixels(_source(image_id, tiles, zoom))
+    gray = _resample_gray(pixels, padded[0], padded[1], (width, height))
+    dx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3, scale=1.0 / 255.0)
+    dy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3, scale=1.0 / 255.0)
+
+    reference = _reference(image_id)
+    inner = (
+        slice(core[0][0] - padded[0][0], core[0][1] - padded[0][0]),
+        slice(core[1][0] - padded[1][0], core[1][1] - padded[1][0]),
+    )
+    if name == "heatmap":
+        score = synthetic_detector.local_score(dx, dy, max_mag=reference.max_mag)
+        heatmap = synthetic_detector.heatmap_pixels(
+            score, reference.score_low, reference.score_high, dx.shape
+        )
+        return synthetic_detector.colorize_heatmap(np.ascontiguousarray(heatmap[inner]))
+    scale = {"dx": reference.max_dx, "dy": reference.max_dy, "mag": reference.max_mag}[name]
+    return gradient_ops.create_gradient_visual(dx[inner], dy[inner], name, scale=scale)
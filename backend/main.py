@@ -2,7 +2,17 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from .api import routes_analysis, routes_gradients, routes_images, routes_reconstruct
+from .api import (
+    routes_analysis,
+    routes_gradients,
+    routes_images,
+    routes_jobs,
+    routes_metrics,
+    routes_reconstruct,
+    routes_session,
+    routes_visuals,
+)
+from .core import artifact_store, executor
 from .models import config
 
 
@@ -10,6 +20,9 @@ def create_app() -> FastAPI:
     config.ensure_directories()
 
     app = FastAPI(title="Gradient Field Backend", version="1.0.0")
+    app.add_event_handler("startup", artifact_store.start)
+    app.add_event_handler("shutdown", artifact_store.stop)
+    app.add_event_handler("shutdown", executor.shutdown)
 
     app.add_middleware(
         CORSMiddleware,
@@ -19,12 +32,19 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    if config.METRICS_ENABLED:
+        app.middleware("http")(routes_metrics.timing_middleware)
+
     app.mount("/static", StaticFiles(directory=config.STATIC_DIR), name="static")
 
     app.include_router(routes_images.router)
     app.include_router(routes_gradients.router)
     app.include_router(routes_reconstruct.router)
     app.include_router(routes_analysis.router)
+    app.include_router(routes_jobs.router)
+    app.include_router(routes_session.router)
+    app.include_router(routes_visuals.router)
+    app.include_router(routes_metrics.router)
     return app
 
 
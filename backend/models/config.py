@@ -1,23 +1,125 @@
+import os
 from pathlib import Path
 
 # Base directories
 BASE_DIR = Path(__file__).resolve().parent.parent
 STATIC_DIR = BASE_DIR / "static"
 IMAGE_DIR = STATIC_DIR / "images"
-GRADIENT_DIR = STATIC_DIR / "gradients"
 RECON_DIR = STATIC_DIR / "reconstructions"
-ANALYSIS_DIR = STATIC_DIR / "analysis"
+# Server-side state that must not be served under /static
+DATA_DIR = BASE_DIR / "data"
+INDEX_DB_PATH = DATA_DIR / "index.sqlite3"  # content-addressed image index (core/image_index.py)
+
+# Eviction of stored images with all their derived files (core/artifact_store.py)
+ARTIFACT_TTL_S = 30 * 24 * 3600  # drop images not accessed for this long (0 disables)
+ARTIFACT_QUOTA_MB = 50 * 1024  # then least recently used ones beyond this total (0 disables)
+ARTIFACT_SWEEP_INTERVAL_S = 300  # background sweep period (0 disables the sweep)
+ARTIFACT_TOUCH_INTERVAL_S = 60  # last-access writes per image are batched to this
 
 # Limits
-MAX_IMAGE_SIZE_MB = 10
-MAX_IMAGE_DIMENSION = 4096  # max width or height
+MAX_IMAGE_SIZE_MB = 256  # large enough for the 8K-16K scans MAX_TILED_IMAGE_DIMENSION allows
+MAX_IMAGE_DIMENSION = 4096  # max width or height for in-memory (full-frame) processing
+# Larger images are accepted up to this size and processed tile by tile from
+# their memory-mapped pixels (core/tiled.py); pyramid levels stay in memory.
+MAX_TILED_IMAGE_DIMENSION = 16384
+# Long-side sizes of the downsampled copies stored at upload ("level" parameter)
+PYRAMID_LEVELS = (512, 1024, 2048)
+MAX_SPARSE_EDIT_MB = 16  # per sparse edit part of POST /api/reconstruct/sparse
+
+# In-process cache of decoded images and gradient fields (per worker)
+GRADIENT_CACHE_MAX_MB = 512
+# With several workers, keep those entries once per host in POSIX shared memory
+# instead (core/shared_cache.py). Needs /dev/shm larger than SHARED_CACHE_MAX_MB
+# (Docker: --shm-size); entries that don't fit fall back to being uncached.
+SHARED_CACHE_ENABLED = False
+SHARED_CACHE_MAX_MB = 1024
+SHARED_CACHE_INDEX_PATH = DATA_DIR / "shared_cache.sqlite3"
+SHARED_CACHE_LOCAL_ENTRIES = 64  # segments kept mapped per worker
+SHARED_CACHE_RECHECK_S = 1.0  # per-worker housekeeping: drop mappings of evicted entries, write accesses
+SHARED_CACHE_SWEEP_S = 60  # cleanup after crashed workers runs at most this often
+
+# Worker pool for CPU-bound route work (see core/executor.py)
+WORKER_THREADS = min(8, os.cpu_count() or 1)
+WORKER_PROCESSES = 0  # > 0 enables a process pool for "process" endpoints
+WORKER_QUEUE_SIZE = 16  # tasks allowed to wait beyond the running workers
+ENDPOINT_CONCURRENCY = {
+    "images": 8,
+    "gradients": 4,
+    "analysis": 2,
+    "reconstruct": 2,
+    "session": 4,
+    "visuals": 4,
+}
+ENDPOINT_EXECUTOR = {
+    "images": "thread",  # uploads are handed over as open temporary files
+    "gradients": "thread",
+    "analysis": "thread",
+    "reconstruct": "thread",
+    "session": "thread",  # sessions hold in-process state; keep them on threads
+    "visuals": "thread",
+}
+
+# Job queue and request coalescing (core/jobs.py, api/routes_jobs.py)
+JOB_CONCURRENCY = 2  # queued jobs running at once (each still goes through the worker pool)
+MAX_PENDING_JOBS = 64  # queued jobs beyond this are rejected with 503
+JOB_RESULT_TTL_S = 60  # finished results are reused / pollable for this long
+JOB_EVENTS_KEEPALIVE_S = 15  # SSE comment interval while a job is still running
+
+# Stage timing, GET /metrics and the Server-Timing header (core/metrics.py)
+METRICS_ENABLED = True
+SERVER_TIMING = True  # add a Server-Timing header with the stages of each request
+SERVER_TIMING_MAX_ENTRIES = 12  # slowest stages listed per response
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# POST /api/analyze/batch
+MAX_ANALYSIS_BATCH = 1000  # image ids per request
+ANALYSIS_STACK_MB = 128  # gradient memory of one stacked group of same-sized images
+
+# Region heatmaps (synthetic_detector.local_score_maps): scores are evaluated
+# per DETECTOR_BLOCK_SIZE block on windows of each size, then averaged.
+DETECTOR_WINDOWS = (16, 32, 64)  # window sides in px of the analysed level
+DETECTOR_BLOCK_SIZE = 8  # px; heatmap resolution and window granularity
+
+# Factor to scale user edits down.
+# 0.1 means a "full white" stroke adds 0.1 to the gradient derivative.
+# This prevents small edits from blowing out the image dynamic range.
+EDIT_DELTA_SCALE = 0.1
+
+# Derived visuals (gradients, heatmaps) are rendered on demand, kept encoded in
+# memory and served with ETags by api/routes_visuals.py.
+VISUAL_FORMAT = "png"  # default encoder: "png", "webp" or "jpeg"
+PNG_COMPRESS_LEVEL = 1  # zlib level; 1 is several times faster than the default 6
+PREVIEW_QUALITY = 85  # webp / jpeg quality
+VISUAL_CACHE_MAX_MB = 256
+VISUAL_VERSION = 3  # bump when rendering changes to invalidate client caches
+# Deep-zoom tiles of the same visuals (core/visual_tiles.py), cached alongside them
+VISUAL_TILE_SIZE = 256
+
+# WebSocket editing sessions (api/routes_session.py)
+MAX_EDIT_SESSIONS = 16  # per worker; each holds two float32 delta fields
+SESSION_PREVIEW_FORMAT = "png"  # any VISUAL_FORMAT encoder
 
 # Solver params
-POISSON_EPS = 1e-3
+POISSON_SOLVER = "dst"  # default backend: "dst" (direct) or "multigrid" (iterative)
+POISSON_EPS = 1e-3  # relative residual tolerance of iterative backends
+POISSON_FFT_WORKERS = -1  # scipy.fft worker threads per transform (-1: all cores)
+
+# Out-of-core tiles (core/tiled.py). Working memory scales with TILE_SIZE,
+# not with the image.
+TILE_SIZE = 1024
+TILE_RECON_HALO = 64  # overlap of neighbouring Poisson subdomains
+TILED_RECON_MAX_SWEEPS = 8  # Schwarz sweeps over the tiles touched by an edit
+TILED_RECON_TOL = 0.5 / 255.0  # boundary change that re-queues a neighbouring tile
+
+# "local" reconstruction mode: window around edited pixels
+LOCAL_RECON_MARGIN = 32  # px added around the edit bounding box
+# Decoded edit PNGs map gray 127/128 to -/+1/255, so anything at or below
+# 2/255 counts as "no edit".
+LOCAL_RECON_THRESHOLD = 2.0 / 255.0
 
 
 def ensure_directories() -> None:
     """Create required directories if they do not yet exist."""
-    for path in [STATIC_DIR, IMAGE_DIR, GRADIENT_DIR, RECON_DIR, ANALYSIS_DIR]:
+    for path in [STATIC_DIR, IMAGE_DIR, RECON_DIR, DATA_DIR]:
         path.mkdir(parents=True, exist_ok=True)
 
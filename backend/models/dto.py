@@ -1,4 +1,4 @@
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -7,10 +7,19 @@ class UploadImageResponse(BaseModel):
     imageId: str
     width: int
     height: int
+    levels: List[int] = Field(
+        default_factory=list,
+        description="Long-side sizes of the stored downsampled copies",
+    )
+    existing: bool = Field(
+        False,
+        description="The same pixels were already stored; imageId is the earlier upload's",
+    )
 
 
 class GradientsResponse(BaseModel):
     imageId: str
+    level: Optional[int] = None
     width: int
     height: int
     dxUrl: str
@@ -28,7 +37,22 @@ class ReconstructionRequest(BaseModel):
         default=None,
         description="Base64 PNG of edited dy in [-1,1] encoded to grayscale",
     )
-    mode: Optional[str] = "full"
+    mode: Optional[str] = Field(
+        default="full",
+        description='"full" solves the whole frame, "local" only a padded window around the edits',
+    )
+    solver: Optional[str] = Field(
+        default=None,
+        description='Poisson backend ("dst" or "multigrid"); defaults to the server setting',
+    )
+    level: Optional[int] = Field(
+        default=None,
+        description="Pyramid level (long side in px) to reconstruct; edits must match its size",
+    )
+    channels: Optional[str] = Field(
+        default="luma",
+        description='"luma" reconstructs Y only; "rgb" takes RGB edit PNGs (one delta per channel) and solves all three channels',
+    )
 
 
 class ReconstructionResponse(BaseModel):
@@ -38,6 +62,9 @@ class ReconstructionResponse(BaseModel):
 
 class AnalysisRequest(BaseModel):
     imageId: str
+    level: Optional[int] = Field(
+        default=None, description="Pyramid level (long side in px) to analyze"
+    )
 
 
 class AnalysisResponse(BaseModel):
@@ -46,6 +73,27 @@ class AnalysisResponse(BaseModel):
     heatmapUrl: str
 
 
+class AnalysisBatchRequest(BaseModel):
+    imageIds: List[str]
+    level: Optional[int] = Field(
+        default=None, description="Pyramid level (long side in px) to analyze"
+    )
+    heatmaps: bool = Field(default=True, description="Include heatmapUrl in each result")
+
+
+class VisualTilesResponse(BaseModel):
+    """Deep-zoom tile pyramid of an image; zoom `maxZoom` is full resolution."""
+
+    imageId: str
+    width: int
+    height: int
+    tileSize: int
+    maxZoom: int
+    urls: Dict[str, str] = Field(
+        description="Tile URL template per visual, with {z}, {x} and {y} placeholders"
+    )
+
+
 class ErrorDetail(BaseModel):
     code: str
     message: str
@@ -53,3 +101,25 @@ class ErrorDetail(BaseModel):
 
 class ErrorResponse(BaseModel):
     error: ErrorDetail
+
+
+class AnalysisBatchResult(BaseModel):
+    """One NDJSON line of POST /api/analyze/batch: scores or an error."""
+
+    imageId: str
+    scores: Optional[Dict[str, float]] = None
+    heatmapUrl: Optional[str] = None
+    error: Optional[ErrorDetail] = None
+
+
+class JobResponse(BaseModel):
+    """State of a reconstruct / analyze job; `result` holds the endpoint's response once done."""
+
+    jobId: str
+    kind: str
+    status: str = Field(description='"queued", "running", "done" or "failed"')
+    coalesced: bool = Field(
+        default=False, description="True if an identical request already had this job"
+    )
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[ErrorDetail] = None
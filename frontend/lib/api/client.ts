@@ -32,9 +32,12 @@ export const api = {
     return response.data;
   },
 
-  getGradients: async (imageId: string): Promise<GradientsResponse> => {
+  getGradients: async (
+    imageId: string,
+    level?: number
+  ): Promise<GradientsResponse> => {
     const response = await apiClient.get<GradientsResponse>('/api/gradients', {
-      params: { imageId },
+      params: { imageId, level },
     });
     return response.data;
   },
@@ -49,9 +52,13 @@ export const api = {
     return response.data;
   },
 
-  analyzeImage: async (imageId: string): Promise<AnalysisResponse> => {
+  analyzeImage: async (
+    imageId: string,
+    level?: number
+  ): Promise<AnalysisResponse> => {
     const response = await apiClient.post<AnalysisResponse>('/api/analyze', {
       imageId,
+      level,
     });
     return response.data;
   },
@@ -7,10 +7,13 @@ export interface UploadImageResponse {
   imageId: string;
   width: number;
   height: number;
+  levels?: number[];
+  existing?: boolean;
 }
 
 export interface GradientsResponse {
   imageId: string;
+  level?: number | null;
   width: number;
   height: number;
   dxUrl: string;
@@ -18,12 +21,25 @@ export interface GradientsResponse {
   magnitudeUrl: string;
 }
 
+// GET /api/visuals/{imageId}/tiles; fill {z}, {x}, {y} in each URL template
+export interface VisualTilesResponse {
+  imageId: string;
+  width: number;
+  height: number;
+  tileSize: number;
+  maxZoom: number; // full resolution; zoom 0 fits one tile
+  urls: Record<'dx' | 'dy' | 'mag' | 'heatmap', string>;
+}
+
 // Simplified edit structure for now
 export interface ReconstructionRequest {
   imageId: string;
   editedDx?: string; // Base64 or other format, to be defined
   editedDy?: string;
-  mode: 'full' | 'patch'; // just an example
+  mode: 'full' | 'local'; // 'local' only re-solves a window around the edits
+  solver?: 'dst' | 'multigrid';
+  level?: number; // pyramid level (long side in px); edits must match its size
+  channels?: 'luma' | 'rgb'; // 'rgb': edits are RGB PNGs, one delta per channel
 }
 
 export interface ReconstructionResponse {
@@ -0,0 +1,23 @@
+import tracemalloc
+
+import numpy as np
+
+from backend.api import routes_analysis
+
+
+def test_batch_group_stays_within_planned_bytes_per_pixel():
+    """A stacked group's fields plus the traced peak of scoring them stay within STACK_BYTES_PER_PIXEL."""
+    count, height, width = 4, 1024, 768
+    rng = np.random.default_rng(0)
+    fields = [
+        (rng.random((height, width), dtype=np.float32), rng.random((height, width), dtype=np.float32))
+        for _ in range(count)
+    ]
+    tracemalloc.start()
+    try:
+        routes_analysis.score_stack(fields)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    fields_bytes = sum(dx.nbytes + dy.nbytes for dx, dy in fields)
+    assert fields_bytes + peak <= routes_analysis.STACK_BYTES_PER_PIXEL * count * height * width
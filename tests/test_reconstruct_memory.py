@@ -0,0 +1,8 @@
+from backend.benchmarks import kernels
+
+
+def test_reconstruct_pipeline_stays_within_peak_budget():
+    """The reconstruct pipeline's traced peak plus pooled buffers stays within PEAK_BUDGET_FRAMES."""
+    size = kernels.PEAK_BUDGET_MIN_SIZE
+    result = kernels.measure("reconstruct_pipeline", size, repeat=1)
+    assert kernels.check_budgets({"results": {f"reconstruct_pipeline@{size}": result}}) == []